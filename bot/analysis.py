@@ -0,0 +1,161 @@
+import asyncio
+import uuid
+
+from bot.engine import EngineError
+from core.engine import MATE_SCORE, MAX_PLY
+from game import Game
+from piece import PieceColor
+
+# Centipawns a move has to lose compared to the best one to be marked as a mistake or a blunder
+MISTAKE = 100
+BLUNDER = 300
+
+
+def format_score(score: int) -> str:
+    """Formats a score for white the way engines usually show it, pawns with a sign or #N for a mate in N moves"""
+    if abs(score) >= MATE_SCORE - MAX_PLY:
+        moves = (MATE_SCORE - abs(score) + 1) // 2
+        return f"#{moves}" if score > 0 else f"#-{moves}"
+    return f"{score / 100:+.2f}"
+
+
+class PlyAnalysis:
+    def __init__(
+        self,
+        ply: int,
+        played: str,
+        best: None | str,
+        score: int,
+        loss: int,
+        cached: bool,
+    ):
+        self.ply = ply  # starting at 0 for white's first move
+        self.played = played  # SAN of the played move
+        self.best = best  # SAN of the move the engine prefers
+        self.score = score  # evaluation for white after the played move
+        self.loss = loss  # centipawns the played move lost compared to the best move, never negative
+        self.cached = cached  # if the evaluation of the position before the move came from the store
+
+    def mark(self) -> str:
+        if self.loss >= BLUNDER:
+            return "??"
+        if self.loss >= MISTAKE:
+            return "?"
+        return ""
+
+
+class _Position:
+    __slots__ = ("fen", "key", "turn", "code", "san")
+
+    def __init__(self, fen, key, turn, code, san):
+        self.fen = fen
+        self.key = key
+        self.turn = turn
+        self.code = code  # the move played from here, None for the final position
+        self.san = san
+
+
+def _positions(codes: list[int]) -> list[_Position]:
+    """Replays the moves, RETURNS: every position of the game, the one after the last move included"""
+    g = Game()
+    res = []
+    for code in codes + [None]:
+        key = g.board.position_key(g.turn)
+        san = str(g.board.to_san_move(code, g.turn)) if code is not None else None
+        res.append(_Position(g.to_FEN(), key, g.turn, code, san))
+        if code is not None:
+            g.play_moves([code])
+    return res
+
+
+class Analyzer:
+    """
+    Analyzes finished games on the engine pool, one position at a time from the first move to the last.
+    The evaluations are read from the store for all positions at once, so only the positions nobody analyzed at this depth before get searched, and the new ones are saved when the analysis is done.
+    Results come out in order as soon as both positions around a move are evaluated, while the positions after it are still being searched.
+    The evaluations are shared by every game which reaches the position, so the positions are searched without the history of the game: a draw by repetition in one game isn't one in the others. Searches without a history also get a transposition table of their own on the workers, so scores of the game searches dont leak in either.
+    """
+
+    def __init__(self, pool, store, depth: int = 4, time_limit: float = 3.0):
+        self.pool = pool
+        self.store = store
+        self.depth = depth
+        self.time_limit = time_limit
+
+        self.analyses = 0
+        self.positions = 0
+        self.cache_hits = 0
+
+    async def analyze(self, codes: list[int]):
+        """Yields a PlyAnalysis for every move of the game"""
+        positions = _positions(codes)
+        cached = await self.store.get_evals([p.key for p in positions], self.depth)
+        hits = set(cached)
+        self.analyses += 1
+        self.positions += len(positions)
+        self.cache_hits += sum(p.key in hits for p in positions)
+
+        # the searches of this analysis share the pool fairly with the running games, which have their own owners
+        owner = ("analysis", uuid.uuid4())
+        searches = {}
+        for p in positions:
+            if p.key not in cached and p.key not in searches:
+                searches[p.key] = asyncio.create_task(
+                    self.pool.search(
+                        owner,
+                        p.fen,
+                        self.time_limit,
+                        None,
+                        self.depth,
+                        (),
+                    )
+                )
+
+        found = []  # new evaluations to store
+        board = Game().board
+        try:
+            evals = [await self._eval(positions[0], cached, searches, found)]
+            for i, p in enumerate(positions[:-1]):
+                evals.append(await self._eval(positions[i + 1], cached, searches, found))
+                (_, score, best), (_, next_score, _) = evals[i], evals[i + 1]
+
+                # both scores are for the side to move, so the one after the move is negated to be for the player who made it
+                loss = max(0, score + next_score)
+                white_score = -next_score if p.turn == PieceColor.White else next_score
+                best_san = (
+                    str(board.to_san_move(best, p.turn)) if best is not None else None
+                )
+                yield PlyAnalysis(i, p.san, best_san, white_score, loss, p.key in hits)
+                board.make_move(p.code, p.turn)
+        finally:
+            self.pool.cancel(owner)
+            for t in searches.values():
+                t.cancel()
+            # collects what the searches which won't be looked at anymore ended with, so the errors of failed ones aren't reported as never retrieved
+            await asyncio.gather(*searches.values(), return_exceptions=True)
+            if found:
+                await self.store.save_evals(found)
+
+    async def _eval(self, p: _Position, cached: dict, searches: dict, found: list):
+        """RETURNS: (depth, score for the side to move, best move) of the position"""
+        if p.key in cached:
+            return cached[p.key]
+        res = await searches[p.key]
+        if res is None:
+            raise EngineError("the analysis was cancelled")
+        # mates are proven and the game is over in positions without a move, so their scores are exact whatever the depth
+        exact = res.move is None or abs(res.score) >= MATE_SCORE - MAX_PLY
+        depth = max(self.depth, res.depth) if exact else res.depth
+        e = (depth, res.score, res.move)
+        # a search which ran out of time didn't reach the depth, so it doesn't count as one for the cache
+        if depth >= self.depth:
+            cached[p.key] = e
+            found.append((p.key, *e))
+        return e
+
+    def stats(self) -> dict:
+        return {
+            "analyses": self.analyses,
+            "positions": self.positions,
+            "cache_hits": self.cache_hits,
+        }
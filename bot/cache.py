@@ -0,0 +1,259 @@
+import time
+from collections import OrderedDict
+
+
+class PngCache:
+    """
+    LRU cache of encoded board images, keyed by whatever decides how the image looks (see render_key).
+    Its bounded both by the number of entries and by the total size of the images, whichever one is hit first.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> None | bytes:
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return  # wouldnt fit even if the cache was empty
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size_bytes -= len(old)
+        self._entries[key] = data
+        self.size_bytes += len(data)
+
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def render_key(board, squares_to_color: None | dict = None, flipped: bool = False):
+    """
+    Key of a board image in the PngCache. Only where the pieces are changes the image, so the position is keyed by the piece bitboards.
+    The zobrist hash would also include the side to move, castling rights and en passant, giving the same picture separate entries.
+    """
+    highlights = frozenset(squares_to_color.items()) if squares_to_color else None
+    return (tuple(board.pieces[0]), tuple(board.pieces[1]), highlights, flipped)
+
+
+class TTLCache:
+    """
+    Dict whose entries expire `ttl` seconds after they were last set.
+    Every entry lives for the same amount of time, so the entries are kept in the order they expire in and purging only has to look at the oldest ones.
+    """
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expiry time, value), oldest first
+
+        self.expired = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        self.purge()
+        self._entries.pop(key, None)
+        self._entries[key] = (self._clock() + self.ttl, value)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def purge(self) -> int:
+        """Drops the expired entries. RETURNS: how many were dropped"""
+        now = self._clock()
+        n = 0
+        while self._entries:
+            key, (expiry, _) = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            del self._entries[key]
+            n += 1
+        self.expired += n
+        return n
+
+    def __contains__(self, key) -> bool:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+        }
+
+
+class GameCache:
+    """
+    The running games kept in memory, along with which user is playing which game.
+    Its bounded to max_games, going over that evicts the least recently used game, and games which haven't been used for idle_timeout seconds are evicted by evict_idle.
+    `persist` is awaited with the game before it is evicted and should return False if the game couldn't be saved, in which case it is kept. An evicted game is loaded back from the database the next time one of its players needs it.
+    Bot users (the engine playing as the bot itself) can be in any number of games, so only the human players are mapped to their game.
+    """
+
+    def __init__(
+        self, max_games: int, idle_timeout: float, persist, clock=time.monotonic
+    ):
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self._persist = persist
+        self._clock = clock
+
+        self._games = OrderedDict()  # game id -> game, least recently used first
+        self._last_used = {}  # game id -> time it was last used
+        self._users = {}  # user id -> game id
+        self._evicting = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.idle_evictions = 0
+        self.failed_evictions = 0
+
+    def _touch(self, gid):
+        self._games.move_to_end(gid)
+        self._last_used[gid] = self._clock()
+
+    def get(self, gid):
+        game = self._games.get(gid)
+        if game is None:
+            self.misses += 1
+            return None
+        self._touch(gid)
+        self.hits += 1
+        return game
+
+    def get_by_user(self, user_id):
+        gid = self._users.get(user_id)
+        if gid is None:
+            self.misses += 1
+            return None
+        return self.get(gid)
+
+    def has_user(self, user_id) -> bool:
+        return user_id in self._users
+
+    async def put(self, game):
+        gid = game.id
+        self._games[gid] = game
+        self._touch(gid)
+        for p in _humans(game):
+            self._users[p.id] = gid
+
+        while len(self._games) - len(self._evicting) > self.max_games:
+            lru = next(g for g in self._games if g not in self._evicting)
+            if lru == gid or not await self._evict(lru):
+                break
+
+    def remove(self, game) -> bool:
+        """Forgets the game without saving it, for games which are over. RETURNS: False if the game wasn't in the cache"""
+        gid = game.id
+        if self._games.pop(gid, None) is None:
+            return False
+        self._last_used.pop(gid, None)
+        for p in _humans(game):
+            if self._users.get(p.id) == gid:
+                del self._users[p.id]
+        return True
+
+    async def evict_idle(self) -> int:
+        """Evicts the games which weren't used in the last idle_timeout seconds. RETURNS: how many were evicted"""
+        deadline = self._clock() - self.idle_timeout
+        idle = []
+        for gid in self._games:  # least recently used first, so it can stop at the first recent one
+            if self._last_used[gid] > deadline:
+                break
+            if gid not in self._evicting:
+                idle.append(gid)
+
+        n = 0
+        for gid in idle:
+            if await self._evict(gid):
+                n += 1
+        self.idle_evictions += n
+        return n
+
+    async def _evict(self, gid) -> bool:
+        game = self._games.get(gid)
+        if game is None:
+            return False
+        used = self._last_used[gid]
+        self._evicting.add(gid)
+        try:
+            saved = await self._persist(game)
+        except Exception as e:
+            print(f"Failed to save game {gid} before evicting it: {e}")
+            saved = False
+        finally:
+            self._evicting.discard(gid)
+
+        # a command might have used the game while it was being saved, its changes wont be in what was saved
+        if not saved or self._last_used.get(gid) != used:
+            if not saved:
+                self.failed_evictions += 1
+            return False
+        self.remove(game)
+        self.evictions += 1
+        return True
+
+    def __len__(self):
+        return len(self._games)
+
+    def stats(self) -> dict:
+        return {
+            "games": len(self._games),
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "idle_evictions": self.idle_evictions,
+            "failed_evictions": self.failed_evictions,
+        }
+
+
+def _humans(game) -> list:
+    return [p for p in (game.player1, game.player2) if not p.bot]
@@ -1,24 +1,89 @@
+import asyncio
+import os
+import time
 import uuid
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from core import game as gamemod, piece, move as movemod
+from core import game as gamemod, piece, move as movemod, book as bookmod
 from piece import PieceColor
 from game import GameState
+from core.engine import DIFFICULTIES
 
 from data import db as chessdb
-
-# TODO: improve these caches
-gameid_to_game = {}
-users_to_gameid = {}
-cooldowns = {}
-players_data = {}
+from data.store import Store
+from data.writebehind import MatchWriteBehind
+from bot.analysis import Analyzer, format_score
+from bot.cache import GameCache, PngCache, TTLCache
+from bot.engine import EngineError, EnginePool
+from bot.leaderboard import Leaderboard
+from bot.render import RenderBusy, RenderService
 
 TIMEOUT = 180  # seconds
 COOLDOWN = 15
 
+# Limits of the cache of encoded board images, most games share their first few positions so these get reused a lot
+PNG_CACHE_MAX_ENTRIES = 2048
+PNG_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+png_cache = PngCache(PNG_CACHE_MAX_ENTRIES, PNG_CACHE_MAX_BYTES)
+
+# The engine plays its first moves from the polyglot book, and the games show the name of the opening they are in. The book is built from the openings, see core/book.py
+BOOK_PATH = "./assets/book.bin"
+OPENINGS_PATH = "./assets/openings.tsv"
+
+opening_book = bookmod.OpeningBook(BOOK_PATH)
+opening_names = bookmod.opening_names(OPENINGS_PATH)
+
+# Rendering runs on a pool so it doesnt block the event loop. Threads are enough since Pillow releases the GIL while drawing and encoding, set RENDER_USE_PROCESSES to use processes instead
+RENDER_WORKERS = 2
+RENDER_USE_PROCESSES = False
+# How many renders can be handed to the pool at once, the rest wait for their turn
+RENDER_MAX_PENDING = 32
+# How many renders can wait for their turn, past that the board is left out of the message until the next one
+RENDER_MAX_WAITING = 256
+
+# Match updates are batched, they are written every MATCH_FLUSH_INTERVAL seconds or once MATCH_FLUSH_MAX_PENDING games have updates waiting. Finished games are written straight away
+MATCH_FLUSH_INTERVAL = 2.0
+MATCH_FLUSH_MAX_PENDING = 64
+
+# A FEN of the position is stored every CHECKPOINT_INTERVAL moves (counting both sides), restoring a game starts from the last one and only replays the moves after it
+CHECKPOINT_INTERVAL = 20
+
+# At most GAME_CACHE_MAX_GAMES running games are kept in memory, and games nobody played in for GAME_IDLE_TIMEOUT seconds are dropped. Both are saved first and loaded back when needed
+GAME_CACHE_MAX_GAMES = 1000
+GAME_IDLE_TIMEOUT = 30 * 60
+# How often to look for idle games and expired cooldowns
+GAME_SWEEP_INTERVAL = 60
+
+# Users found to have no running game aren't looked up in the database again for this long. Games are only started and ended through this process, so it is kept up to date and this only bounds its size
+NO_GAME_TTL = 15 * 60
+
+# How many players the leaderboard shows, and how often it is read from the database again
+LEADERBOARD_SIZE = 10
+LEADERBOARD_REFRESH_INTERVAL = 5 * 60
+# How soon after a game ends it is read again, every game ending in that time is picked up by the same read
+LEADERBOARD_MIN_REFRESH_INTERVAL = 10
+
+# At startup the running matches are read WARM_START_BATCH_SIZE at a time, and each batch is restored concurrently
+WARM_START_BATCH_SIZE = 50
+
+# The engine thinks on its own processes, leaving a core for the bot itself
+ENGINE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# How much longer than its time limit a search gets before it is stopped, see EnginePool
+ENGINE_GRACE = 2.0
+
+# How deep /analyze searches every position, the evaluations are stored per depth so changing it starts a new cache
+ANALYSIS_DEPTH = 4
+ANALYSIS_TIME_LIMIT = 3.0
+# How often the analysis embed is edited while the analysis runs, in seconds. Editing on every move would hit the rate limits on long games
+ANALYSIS_EDIT_INTERVAL = 2.0
+
+
+RENDER_BUSY_MESSAGE = "⚠️ Too busy to draw the board right now, it will show again after the next move"
+
 
 async def validate_user(to_id, ctx) -> bool:
     if to_id != ctx.user.id:
@@ -103,6 +168,32 @@ class GameSession(gamemod.Game):
         self.player2 = player2
         self.msg = msg  # the message to edit when updating embed
 
+        # What has already been written to the database, so only the changes since then need to be written
+        self.version = 0
+        self.persisted_moves = 0
+        self.persisted_state = (self.state, self.turn)
+        # loaded from a document which stores the moves in an older format, the next write converts it
+        self.needs_migration = False
+
+        self.checkpoints = []
+        self.persisted_checkpoints = 0
+        # Number of moves before the checkpoint the game was restored from. Those are only in move_codes, their SAN is worked out the first time the moves are shown
+        self.restored_from = 0
+        self._restored_san = None
+
+        # Difficulty of the engine for games against the bot, it plays the side of the bot user
+        self.engine = None
+        # Name of the last known opening the game went through
+        self.opening = None
+
+    def _on_move_played(self, played_move, move, evaluate: bool = True):
+        super()._on_move_played(played_move, move, evaluate)
+        name = opening_names.get(self.board.position_key(self.turn))
+        if name:
+            self.opening = name
+        if len(self.move_codes) % CHECKPOINT_INTERVAL == 0:
+            self.checkpoints.append({"ply": len(self.move_codes), "fen": self.to_FEN()})
+
     def is_turn(self, player: int) -> bool:
         if player != self.player1.id and player != self.player2.id:
             return  # raise an exception maybe idk
@@ -114,10 +205,32 @@ class GameSession(gamemod.Game):
         )
         return needed == self.turn
 
+    def is_engine_turn(self) -> bool:
+        if not self.engine:
+            return False
+        p = self.player1 if self.turn == PieceColor.White else self.player2
+        return p.bot
+
     def last_move(self) -> None | movemod.Move:
         if self.played_moves:
             return self.played_moves[-1][1]
 
+    def san_moves(self) -> list[str]:
+        """The SAN of every move of the game, the ones before the checkpoint it was restored from included"""
+        if self._restored_san is None:
+            g = gamemod.Game()
+            b = g.board
+            self._restored_san = []
+            opening = None
+            for m in self.move_codes[: self.restored_from]:
+                self._restored_san.append(str(b.to_san_move(m, g.turn)))
+                b.make_move(m, g.turn)
+                g.turn = PieceColor(1 - g.turn)
+                opening = opening_names.get(b.position_key(g.turn), opening)
+            # openings are over long before the first checkpoint, so the moves after it didn't find the game's
+            self.opening = self.opening or opening
+        return self._restored_san + [str(m) for _, m in self.played_moves]
+
     def get_embed(self) -> discord.Embed:
         p1 = self.player1
         p2 = self.player2
@@ -138,11 +251,11 @@ class GameSession(gamemod.Game):
 
         desc = f"<:wking:1456615925057847461> ** {p1.mention} ** | <:bking:1456616121439621368> ** {p2.mention} **\n"
 
-        if len(self.played_moves) > 0:
+        sans = self.san_moves()
+        if len(sans) > 0:
             DIST_BETWEEN_MOVES = 10
             desc += "```"
-            for i, (_full_move, min_move) in enumerate(self.played_moves):
-                move_str = str(min_move)
+            for i, move_str in enumerate(sans):
                 if i % 2 == 0:
                     desc += str(i // 2 + 1) + ". "
                 desc += move_str + " "
@@ -153,6 +266,19 @@ class GameSession(gamemod.Game):
             desc += "```"
         color = 0xFFFFFF if self.turn == PieceColor.White else 0
         embed = discord.Embed(title=title, description=desc, color=color)
+        if self.opening:
+            embed.add_field(name="Opening", value=self.opening)
+        tb = self.board.probe_tablebase(self.turn) if self.state == GameState.Playing else None
+        if tb:
+            wdl, plies = tb
+            if wdl == 0:
+                result = "Draw with best play"
+            else:
+                winner = self.turn if wdl > 0 else PieceColor(1 - self.turn)
+                result = f"{'White' if winner == PieceColor.White else 'Black'} mates in {(plies + 1) // 2}"
+            embed.add_field(name="Tablebase", value=result)
+        if self.state != GameState.Playing:
+            embed.set_footer(text=f"Game {self.id}, see /analyze")
 
         return embed
 
@@ -162,12 +288,61 @@ class GameSession(gamemod.Game):
     def to_match_data(self) -> chessdb.MatchData:
         return chessdb.MatchData(
             self.id,
-            self.played_moves,
+            movemod.pack_moves(self.move_codes),
             self.player1.id,
             self.player2.id,
             self.state,
             self.turn,
+            self.checkpoints,
+            self.engine,
+        )
+
+    def to_match_delta(self) -> None | chessdb.MatchDelta:
+        """
+        Returns the changes since the last call (or since the game was loaded), and marks them as persisted.
+        RETURNS: None if nothing changed
+        """
+        new_moves = len(self.move_codes) > self.persisted_moves
+        state, turn = self.persisted_state
+        if (
+            not new_moves
+            and state == self.state
+            and turn == self.turn
+            and not self.needs_migration
+        ):
+            return None
+
+        # documents being migrated get all the moves in the new format, and so does a game which is over since its moves get stored as one blob
+        rewrite = self.needs_migration or self.state != GameState.Playing
+        delta = chessdb.MatchDelta(
+            self.id,
+            self.version,
+            b"" if rewrite else movemod.pack_moves(self.move_codes[self.persisted_moves :]),
+            self.state if state != self.state else None,
+            self.turn if turn != self.turn else None,
+            self.checkpoints[self.persisted_checkpoints :],
+            movemod.pack_moves(self.move_codes) if rewrite else None,
+            self.needs_migration,
         )
+        self.needs_migration = False
+        self.version += 1
+        self.persisted_moves = len(self.move_codes)
+        self.persisted_state = (self.state, self.turn)
+        self.persisted_checkpoints = len(self.checkpoints)
+        return delta
+
+    def _replay(self, codes: list[int], checkpoints: list[dict]):
+        """Sets the game up from the last of the checkpoints and replays the moves after it, the ones before it are just kept for the move list"""
+        start = 0
+        if checkpoints:
+            cp = checkpoints[-1]
+            self.set_FEN(cp["fen"])
+            self.starting_turn = PieceColor.White
+            start = cp["ply"]
+            self.move_codes = codes[:start]
+            self.restored_from = start
+        # the stored moves are already known to be legal, so they are replayed without parsing or checking them
+        self.play_moves(codes[start:])
 
     @staticmethod
     def from_match_data(
@@ -177,16 +352,89 @@ class GameSession(gamemod.Game):
         Returns GameSession object from MatchData object given player1 and player2.
         The reason to pass in the two extra discord.User params is because to retrieve the User objects we need the Bot object. But I don't want to pass the Bot object to this method.
         """
+        codes = movemod.unpack_moves(m.moves)
+        checkpoints = [cp for cp in m.checkpoints if cp["ply"] <= len(codes)]
         g = GameSession(player1, player2)
-        g.play_san_str(" ".join(m.moves_full))
+        g._replay(codes, checkpoints)
+        if g.restored_from and g.halfmove_clock > len(codes) - g.restored_from:
+            # The positions since the last capture or pawn move can come up again, so they all have to be counted for the repetitions. They go back past the checkpoint, so it's replayed from one before them
+            last_irreversible = len(codes) - g.halfmove_clock
+            g = GameSession(player1, player2)
+            g._replay(codes, [cp for cp in checkpoints if cp["ply"] <= last_irreversible])
+        # replaying made the checkpoints after the one it started from again, the stored ones are kept instead
+        last_stored = checkpoints[-1]["ply"] if checkpoints else 0
+        g.checkpoints = checkpoints + [cp for cp in g.checkpoints if cp["ply"] > last_stored]
+
         g.id = m._id
         g.turn = m.turn
+        g.version = m.version
+        g.persisted_moves = len(g.move_codes)
+        g.persisted_state = (g.state, g.turn)
+        g.needs_migration = m.needs_migration
+        g.engine = m.engine
+        # games stored before checkpoints existed get theirs on the next write, since replaying made them again
+        g.persisted_checkpoints = len(m.checkpoints)
         return g
 
 
 class Chess(commands.Cog):
-    def __init__(self, bot):
+    def __init__(self, bot, store: Store):
         self.bot = bot
+        self.store = store
+        self.match_writer = MatchWriteBehind(
+            store,
+            MATCH_FLUSH_INTERVAL,
+            MATCH_FLUSH_MAX_PENDING,
+            self._on_match_conflicts,
+        )
+        self.renderer = RenderService(
+            png_cache,
+            RENDER_WORKERS,
+            RENDER_USE_PROCESSES,
+            RENDER_MAX_PENDING,
+            RENDER_MAX_WAITING,
+        )
+        self.games = GameCache(
+            GAME_CACHE_MAX_GAMES, GAME_IDLE_TIMEOUT, self._persist_game
+        )
+        self.cooldowns = TTLCache(COOLDOWN)
+        # users known not to have a running game
+        self.no_game = TTLCache(NO_GAME_TTL)
+        # ids of the games whose updates were rejected by a version conflict, see _on_match_conflicts
+        self.match_conflicts = TTLCache(NO_GAME_TTL)
+        # user id -> id of the game they finished last, what /analyze looks at by default
+        self.last_game = TTLCache(NO_GAME_TTL)
+        self.leaderboard = Leaderboard(
+            store,
+            LEADERBOARD_SIZE,
+            LEADERBOARD_REFRESH_INTERVAL,
+            LEADERBOARD_MIN_REFRESH_INTERVAL,
+        )
+        self.engine_pool = EnginePool(ENGINE_WORKERS, ENGINE_GRACE)
+        self.analyzer = Analyzer(
+            self.engine_pool, store, ANALYSIS_DEPTH, ANALYSIS_TIME_LIMIT
+        )
+        # game id -> task playing the engine's move in it, see _engine_move
+        self._engine_moves = {}
+        self._sweeper = None
+
+    async def cog_load(self):
+        self.match_writer.start()
+        self.leaderboard.start()
+        self.engine_pool.start()
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def cog_unload(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for task in self._engine_moves.values():
+            task.cancel()
+        self.leaderboard.close()
+        self.renderer.shutdown()
+        self.engine_pool.shutdown()
+        await self.match_writer.close()
+        self.store.close()
 
     @app_commands.command(description="Start a game of chess with someone else")
     @app_commands.describe(against="Player to play against")
@@ -205,27 +453,34 @@ class Chess(commands.Cog):
             await ctx.followup.send("❌ Cant play against a bot, silly")
             return
 
-        if ctx.user.id in users_to_gameid:
+        if self.games.has_user(ctx.user.id):
             await ctx.followup.send(
                 "❌ Cannot create a new game when you already have a previous one running."
             )
             return
 
-        if against.id in users_to_gameid:
+        # their game could have been evicted from memory, so it has to be looked up like ours
+        await self._try_load_active_game_from_user_id(against.id)
+        if self.games.has_user(against.id):
             await ctx.followup.send(
                 "❌ Cannot create a new game when the other person already has a previous game running."
             )
             return
 
         async def on_accept():
-            g = GameSession(ctx.user, against)
-            gameid = g.id
-            gameid_to_game[gameid] = g
+            # either of them could have started another game while this one was waiting to be accepted
+            for user_id in (ctx.user.id, against.id):
+                await self._try_load_active_game_from_user_id(user_id)
+            if self.games.has_user(ctx.user.id) or self.games.has_user(against.id):
+                await ctx.followup.send("❌ One of you started another game in the meantime")
+                return
 
-            users_to_gameid[ctx.user.id] = gameid
-            users_to_gameid[against.id] = gameid
+            g = GameSession(ctx.user, against)
+            await self.games.put(g)
+            self.no_game.pop(ctx.user.id)
+            self.no_game.pop(against.id)
 
-            g.to_match_data().insert_to_db()
+            await self.store.insert_match(g.to_match_data())
 
             msg = await self._send_game_with_embed(ctx, g)
             g.msg = msg
@@ -235,6 +490,48 @@ class Chess(commands.Cog):
             view=GameOptionView(against.id, on_accept),
         )
 
+    @app_commands.command(
+        name="play-bot", description="Start a game of chess against the bot"
+    )
+    @app_commands.describe(
+        difficulty="How strong the bot plays", color="The color you play with"
+    )
+    @app_commands.choices(
+        difficulty=[
+            app_commands.Choice(name=d.capitalize(), value=d) for d in DIFFICULTIES
+        ],
+        color=[
+            app_commands.Choice(name="White", value="white"),
+            app_commands.Choice(name="Black", value="black"),
+        ],
+    )
+    async def play_bot(self, ctx, difficulty: str = "medium", color: str = "white"):
+        await ctx.response.defer()
+
+        if not await self._handle_cooldown(ctx):
+            return
+        await self._try_load_active_game_from_user_id(ctx.user.id)
+
+        if self.games.has_user(ctx.user.id):
+            await ctx.followup.send(
+                "❌ Cannot create a new game when you already have a previous one running."
+            )
+            return
+
+        if color == "white":
+            g = GameSession(ctx.user, self.bot.user)
+        else:
+            g = GameSession(self.bot.user, ctx.user)
+        g.engine = difficulty
+        await self.games.put(g)
+        self.no_game.pop(ctx.user.id)
+
+        await self.store.insert_match(g.to_match_data())
+
+        if g.is_engine_turn():
+            await asyncio.shield(self._engine_move(g))
+        g.msg = await self._send_game_with_embed(ctx, g)
+
     @app_commands.command(description="Start a game of chess with someone else")
     @app_commands.describe(move="Player to play against")
     async def play(self, ctx, move: str):
@@ -245,19 +542,24 @@ class Chess(commands.Cog):
             return
 
         if not game.is_turn(ctx.user.id):
-            await ctx.followup.send("❌ Not your move")
+            await ctx.followup.send(
+                "❌ Not your move, the bot is thinking"
+                if game.is_engine_turn()
+                else "❌ Not your move"
+            )
             return
 
         if not game.play_san(move):
             await ctx.followup.send("❌ Invalid move, idiot")
             return
 
+        self._queue_match_update(game)
         if game.state != GameState.Playing:
-            self._save_and_delete_game(game)
-
-        game.to_match_data().update_on_db()
+            await self._save_and_delete_game(game)
 
         await ctx.followup.send(f"✅ Played the move: {str(game.last_move())}")
+        if game.is_engine_turn() and game.state == GameState.Playing:
+            await asyncio.shield(self._engine_move(game))
         await self._show_board(ctx, game)
 
     @app_commands.command(description="Resign a game of chess, you quitter")
@@ -278,7 +580,7 @@ class Chess(commands.Cog):
                 if ctx.user.id == game.player1.id
                 else GameState.WinWhite
             )
-            self._save_and_delete_game(game)
+            await self._save_and_delete_game(game)
             await self._send_game_with_embed(ctx, game)
 
         await ctx.followup.send(
@@ -299,16 +601,21 @@ class Chess(commands.Cog):
             return
 
         other_player = game.player2 if ctx.user.id == game.player1.id else game.player1
+        if game.engine:
+            await ctx.followup.send("❌ The bot doesn't take draws, play it out")
+            return
 
         async def ondraw():
             game.state = GameState.Draw
-            self._save_and_delete_game(game)
+            await self._save_and_delete_game(game)
             await self._show_board(ctx, game)
 
         await ctx.followup.send(
             "Sent a draw, waiting for player to accept", ephemeral=False
         )
-        await game.msg.reply(
+        # games loaded back from the database dont have a message until the board is shown again
+        send = game.msg.reply if game.msg else ctx.followup.send
+        await send(
             content=f"{other_player.mention}, do you accept a draw?",
             view=DrawView(ondraw, other_player.id),
         )
@@ -318,7 +625,7 @@ class Chess(commands.Cog):
     async def profile(self, ctx, user: None | discord.User):
         await ctx.response.defer()
         p = user if user else ctx.user
-        p_data = chessdb.PlayerData.from_id(p.id) or chessdb.PlayerData(p.id)
+        p_data = await self.store.get_player(p.id) or chessdb.PlayerData(p.id)
         embed = (
             discord.Embed(title=f"{p.name}'s profile")
             .set_thumbnail(url=p.avatar.url)
@@ -330,22 +637,95 @@ class Chess(commands.Cog):
             .add_field(
                 name="Number of Losses", value=str(p_data.num_losses), inline=True
             )
+            .add_field(name="Rating", value=str(round(p_data.rating)), inline=True)
+            .add_field(
+                name="Rank",
+                value=f"#{await self.leaderboard.rank_of(p_data.rating)}",
+                inline=True,
+            )
+        )
+
+        await ctx.followup.send(embed=embed)
+
+    @app_commands.command(description="Show the highest rated players")
+    async def leaderboard(self, ctx):
+        await ctx.response.defer()
+        lines = [
+            f"**{i}.** <@{user_id}> ({round(rating)})"
+            for i, (user_id, rating) in enumerate(self.leaderboard.top, 1)
+        ]
+        embed = discord.Embed(
+            title="Leaderboard",
+            description="\n".join(lines) or "Nobody has played yet",
         )
 
+        p_data = await self.store.get_player(ctx.user.id)
+        if p_data:
+            embed.set_footer(
+                text=f"You are #{await self.leaderboard.rank_of(p_data.rating)} of {len(self.leaderboard)} with a rating of {round(p_data.rating)}"
+            )
         await ctx.followup.send(embed=embed)
 
+    @app_commands.command(description="Let the engine go through a finished game")
+    @app_commands.describe(
+        game_id="Id of the game, shown under it once it's over. Leave blank for your last game"
+    )
+    async def analyze(self, ctx, game_id: None | str):
+        await ctx.response.defer()
+
+        if not await self._handle_cooldown(ctx):
+            return
+
+        if game_id:
+            try:
+                gid = uuid.UUID(game_id)
+            except ValueError:
+                await ctx.followup.send("❌ That's not a game id")
+                return
+        else:
+            gid = self.last_game.get(ctx.user.id)
+            if gid is None:
+                await ctx.followup.send(
+                    "❌ No recent game to analyze, give the id of one"
+                )
+                return
+
+        match_data = await self.store.get_match(gid)
+        if not match_data:
+            await ctx.followup.send("❌ No game with that id")
+            return
+        if match_data.state == GameState.Playing:
+            await ctx.followup.send("❌ The game is still running, no cheating")
+            return
+
+        codes = movemod.unpack_moves(match_data.moves)
+        lines = []
+        msg = await ctx.followup.send(embed=_analysis_embed(gid, lines, len(codes)))
+        last_edit = time.monotonic()
+        try:
+            async for a in self.analyzer.analyze(codes):
+                prefix = f"{a.ply // 2 + 1}." if a.ply % 2 == 0 else "   "
+                best = f" (best {a.best})" if a.mark() and a.best else ""
+                lines.append(
+                    f"{prefix:<4} {a.played + a.mark():<9} {format_score(a.score):>7}{best}"
+                )
+                if time.monotonic() - last_edit >= ANALYSIS_EDIT_INTERVAL:
+                    await msg.edit(embed=_analysis_embed(gid, lines, len(codes)))
+                    last_edit = time.monotonic()
+        except EngineError as e:
+            await msg.edit(content=f"❌ The analysis stopped: {e}")
+            return
+        await msg.edit(embed=_analysis_embed(gid, lines, len(codes)))
+
     async def _handle_cooldown(self, ctx) -> bool:
         """Handles if user is on cooldown or not, and adds or updates them accordingly"""
 
-        import datetime
-
-        now = datetime.datetime.now().timestamp()
-        if ctx.user.id in cooldowns:
-            if now - cooldowns[ctx.user.id] < COOLDOWN:
-                await ctx.followup.send(content="❌ You're on a cooldown")
-                return False
+        # entries expire after COOLDOWN seconds, so being in there means being on a cooldown
+        if ctx.user.id in self.cooldowns:
+            await ctx.followup.send(content="❌ You're on a cooldown")
+            return False
 
-        cooldowns[ctx.user.id] = now
+        self.cooldowns.set(ctx.user.id, True)
         return True
 
     async def _show_board(self, ctx, game: GameSession):
@@ -365,104 +745,275 @@ class Chess(commands.Cog):
             await self._update_game_embed(ctx, game)
 
     async def _try_get_game_of_user(self, ctx) -> None | GameSession:
-        if ctx.user.id not in users_to_gameid:
+        game = self.games.get_by_user(ctx.user.id)
+        if not game:
+            # it might not have been loaded yet, or have been evicted
             await self._try_load_active_game_from_user_id(ctx.user.id)
-
-        gameid = users_to_gameid.get(ctx.user.id)
-
-        if not gameid:
-            await ctx.followup.send("❌ You don't have any running games, dumass.!")
-            return None
-
-        game = gameid_to_game.get(gameid)
+            game = self.games.get_by_user(ctx.user.id)
 
         if not game:
-            await ctx.followup.send("❌ Invalid game idk what went wrong")
+            await ctx.followup.send("❌ You don't have any running games, dumass.!")
             return None
 
+        self._resume_engine(game)
         return game
 
     async def _send_game_with_embed(self, ctx, game: GameSession) -> discord.Message:
-        file = self._get_board_as_file(game)
         embed = game.get_embed()
+        try:
+            file = await self._get_board_as_file(game)
+        except RenderBusy:
+            return await ctx.followup.send(content=RENDER_BUSY_MESSAGE, embed=embed)
         embed.set_image(url="attachment://board.png")
         return await ctx.followup.send(embed=embed, file=file)
 
     async def _update_game_embed(self, ctx, game: GameSession):
-        file = self._get_board_as_file(game)
         embed = game.get_embed()
+        try:
+            file = await self._get_board_as_file(game)
+        except RenderBusy:
+            # the old image would show a position the game isn't in anymore
+            await game.msg.edit(content=RENDER_BUSY_MESSAGE, embed=embed, attachments=[])
+            return
         embed.set_image(url="attachment://board.png")
-        await game.msg.edit(embed=embed, attachments=[file])
-
-    def _get_board_as_file(
-        self, game: GameSession, fname: str = "board.png"
+        await game.msg.edit(content=None, embed=embed, attachments=[file])
+
+    async def _get_board_as_file(
+        self,
+        game: GameSession,
+        fname: str = "board.png",
+        squares_to_color: None | dict = None,
+        flipped: bool = False,
     ) -> discord.File:
         import io
 
-        byte_arr = io.BytesIO()
-        img = game.board.to_image()
-        img.save(byte_arr, "png")
-        byte_arr.seek(0)
-        file = discord.File(byte_arr, filename=fname)
+        data = await self.renderer.render(game.board, squares_to_color, flipped)
+        file = discord.File(io.BytesIO(data), filename=fname)
         return file
 
-    def _save_and_delete_game(self, game: GameSession):
+    async def _save_and_delete_game(self, game: GameSession):
         """Update database with the game and player data and cleans up the dicts"""
-        gameid = game.id
-        if gameid not in gameid_to_game:
+        if not self.games.remove(game):
             return  # consider throwing an error
-        gameid_to_game.pop(gameid)
+        if game.engine:
+            self.engine_pool.cancel(game.id)
+        for p in (game.player1, game.player2):
+            if not p.bot:
+                self.no_game.set(p.id, True)
+                self.last_game.set(p.id, game.id)
+
+        # the game is over, so the final state is written now instead of waiting for the next flush
+        self._queue_match_update(game)
+        await self.match_writer.flush()
+        if game.id in self.match_conflicts:
+            return  # the stored match isn't over, so there is no result to record
+        if game.engine:
+            return  # games against the bot don't count towards the stats or the rating
+        await self.store.record_match_result(
+            game.player1.id, game.player2.id, game.state
+        )
+        self.leaderboard.mark_stale()
 
-        users_to_gameid.pop(game.player1.id)
-        users_to_gameid.pop(game.player2.id)
+    async def warm_start(self):
+        """
+        Loads the running matches into memory, so the first move of every game after a restart doesnt have to load it.
+        It waits for the bot to be ready first, so the players can be found in the gateway's cache instead of being fetched one by one.
+        """
+        await self.bot.wait_until_ready()
 
-        local_match_data = game.to_match_data()
+        start = time.perf_counter()
+        loaded = failed = 0
+        async for batch in self.store.iter_running_matches(WARM_START_BATCH_SIZE):
+            results = await asyncio.gather(
+                *(self._restore_match(m) for m in batch), return_exceptions=True
+            )
+            for m, res in zip(batch, results):
+                if isinstance(res, Exception):
+                    failed += 1
+                    print(f"Failed to restore match {m._id}: {res}")
+                elif res:
+                    loaded += 1
+            if len(self.games) >= self.games.max_games:
+                break  # anything more would only evict the games just loaded
+
+        print(
+            f"Restored {loaded} running matches ({failed} failed) in {time.perf_counter() - start:.2f}s"
+        )
 
-        player1_data = chessdb.PlayerData.from_id(
-            game.player1.id
-        ) or chessdb.PlayerData(game.player1.id)
-        player2_data = chessdb.PlayerData.from_id(
-            game.player2.id
-        ) or chessdb.PlayerData(game.player2.id)
+    async def _restore_match(self, match_data: chessdb.MatchData) -> bool:
+        """Puts the match in the cache unless one of its players already has a game loaded. RETURNS: True if it was put in the cache"""
+        if self.games.has_user(match_data.white) or self.games.has_user(
+            match_data.black
+        ):
+            return False
 
-        player1_data.num_matches += 1
-        player2_data.num_matches += 1
+        player1, player2 = await asyncio.gather(
+            self._get_user(match_data.white), self._get_user(match_data.black)
+        )
+        # one of them could have started playing while the users were being fetched
+        if self.games.has_user(match_data.white) or self.games.has_user(
+            match_data.black
+        ):
+            return False
 
-        # accordingly update their stats
-        match game.state:
-            case GameState.Playing:
-                pass
-            case GameState.Draw:
-                player1_data.num_draws += 1
-                player2_data.num_draws += 1
-            case GameState.WinWhite:
-                player1_data.num_wins += 1
-                player2_data.num_losses += 1
-            case GameState.WinBlack:
-                player2_data.num_wins += 1
-                player1_data.num_losses += 1
+        game = GameSession.from_match_data(match_data, player1, player2)
+        # loaded from what is stored, so its updates are made from the right version again
+        self.match_conflicts.pop(game.id)
+        await self.games.put(game)
+        self._resume_engine(game)
+        return True
 
-        local_match_data.update_on_db()
-        player1_data.update_db()
-        player2_data.update_db()
+    async def _get_user(self, user_id) -> discord.User:
+        """Looks in the gateway's cache before asking the API"""
+        return self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+
+    def _engine_move(self, game: GameSession) -> asyncio.Task:
+        """
+        Starts playing the engine's move in the game, unless it is already being played.
+        RETURNS: the task playing the move, shield it when awaiting it so the move isn't cancelled along with whoever waits for it
+        """
+        task = self._engine_moves.get(game.id)
+        if task is None:
+            task = asyncio.create_task(self._play_engine_move(game))
+            self._engine_moves[game.id] = task
+            task.add_done_callback(lambda t: self._engine_move_done(game.id, t))
+        return task
+
+    def _engine_move_done(self, gid, task: asyncio.Task):
+        if self._engine_moves.get(gid) is task:
+            del self._engine_moves[gid]
+        if not task.cancelled() and task.exception():
+            print(f"Failed to play the engine's move on game {gid}: {task.exception()!r}")
+
+    def _resume_engine(self, game: GameSession):
+        """Starts the engine's move if it is its turn, for games loaded while it was (or left while it was thinking) since nothing else would"""
+        if game.is_engine_turn() and game.state == GameState.Playing:
+            self._engine_move(game)
+
+    async def _play_engine_move(self, game: GameSession):
+        """
+        Plays a move from the opening book, or lets the engine think on its pool and plays its move unless the game ended in the meantime (like the player resigning).
+        If the game was evicted or reloaded while the engine was thinking, the move is played on the game as it is now, as long as it is still in the position the engine looked at.
+        """
+        limits = DIFFICULTIES[game.engine]
+        codes = list(game.move_codes)
+
+        # the book is only a few lookups, no need to bother the pool with it
+        move = opening_book.choose(game.board, game.turn)
+        if move is None:
+            try:
+                res = await self.engine_pool.search(
+                    game.id,
+                    game.to_FEN(),
+                    limits["time_limit"],
+                    limits["max_nodes"],
+                    limits["max_depth"],
+                    # any position the game went through counts as a draw to the engine, so it doesn't walk into repetitions
+                    game.position_counts.keys(),
+                )
+                if res is None:
+                    return  # cancelled, the game is over
+                move = res.move
+            except Exception as e:
+                print(f"Engine failed on game {game.id} ({e!r}), playing the first legal move")
+                move = game.board.generate_legal_moves(game.turn)[0]
+
+        current = self.games.get(game.id)
+        if current is None:
+            if game.state != GameState.Playing or game.id in self.match_conflicts:
+                return  # over, or forgotten because what is stored changed
+            # evicted while the engine was thinking, its moves were saved before that so it can be loaded back
+            match_data = await self.store.get_match(game.id)
+            if match_data is None or match_data.state != GameState.Playing:
+                return
+            await self._restore_match(match_data)
+            current = self.games.get(game.id)
+        if (
+            current is None
+            or current.state != GameState.Playing
+            or current.move_codes != codes
+        ):
+            return
+        game = current
+        game.play_moves([move])
+
+        self._queue_match_update(game)
+        if game.state != GameState.Playing:
+            await self._save_and_delete_game(game)
+
+    def _queue_match_update(self, game: GameSession):
+        delta = game.to_match_delta()
+        if delta:
+            self.match_writer.submit(delta)
+
+    async def _persist_game(self, game: GameSession) -> bool:
+        """Writes out everything about the game which isn't saved yet, before it gets evicted from the cache"""
+        self._queue_match_update(game)
+        try:
+            await self.match_writer.flush()
+        except Exception:
+            return False  # already logged, the game stays in memory until it can be saved
+        return game.id not in self.match_conflicts
+
+    def _on_match_conflicts(self, gids: list):
+        """
+        Forgets the games whose updates were rejected, what is in memory is behind what is stored so nothing more of it can be written.
+        The next command of one of their players loads the stored match again.
+        """
+        for gid in gids:
+            # a flush only reports the conflicts of the updates it wrote, and the update of a game being saved could have gone out with another flush
+            self.match_conflicts.set(gid, True)
+            game = self.games.get(gid)
+            if game is None:
+                continue
+            self.games.remove(game)
+            if game.engine:
+                self.engine_pool.cancel(game.id)
+                # the move being played is dropped, the game gets a new one once it is loaded again
+                self._engine_moves.pop(gid, None)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(GAME_SWEEP_INTERVAL)
+            self.cooldowns.purge()
+            self.no_game.purge()
+            self.last_game.purge()
+            self.match_conflicts.purge()
+            n = await self.games.evict_idle()
+            if n:
+                print(f"Evicted {n} idle games, cache: {self.games.stats()}")
 
     async def _try_load_active_game_from_user_id(self, user_id):
-        match_data = chessdb.MatchData.get_active_game_by_userid(user_id)
+        if self.games.has_user(user_id) or user_id in self.no_game:
+            return
+        match_data = await self.store.get_active_match(user_id)
         if not match_data:
+            self.no_game.set(user_id, True)
             return
 
         other_player = (
             match_data.white if user_id == match_data.black else match_data.black
         )
-        if other_player in users_to_gameid:
+        if self.games.has_user(other_player):
             return  # Maybe throw an error idk
 
-        player1 = await self.bot.fetch_user(match_data.white)
-        player2 = await self.bot.fetch_user(match_data.black)
-
-        game = GameSession.from_match_data(match_data, player1, player2)
-        gid = game.id
-        gameid_to_game[gid] = game
-
-        users_to_gameid[match_data.white] = gid
-        users_to_gameid[match_data.black] = gid
+        await self._restore_match(match_data)
+
+
+def _analysis_embed(gid, lines: list[str], total: int) -> discord.Embed:
+    """The lines of the analysis so far, keeping the latest ones if they don't all fit"""
+    MAX_LEN = 4000  # embed descriptions can be 4096 characters long
+    shown = []
+    length = 0
+    for line in reversed(lines):
+        length += len(line) + 1
+        if length > MAX_LEN:
+            break
+        shown.append(line)
+    shown.reverse()
+
+    title = "Analysis" if len(lines) == total else f"Analyzing... {len(lines)}/{total}"
+    desc = "```\n" + "\n".join(shown) + "```" if shown else "Starting the engine..."
+    return discord.Embed(title=title, description=desc).set_footer(
+        text=f"Game {gid}, depth {ANALYSIS_DEPTH}"
+    )
@@ -0,0 +1,288 @@
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from core.engine import MAX_PLY, search_fen
+
+
+class EngineError(Exception):
+    pass
+
+
+def _worker_main(conn, stop):
+    """
+    Runs in each worker process, searching the positions it is sent one at a time until it gets None.
+    The transposition table stays around between searches, so later moves of a game find some of their work already done.
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        # a stop meant for the previous search might have come in after it was already done
+        stop.clear()
+        fen, time_limit, max_nodes, max_depth, history = job
+        try:
+            res = search_fen(fen, time_limit, max_nodes, max_depth, history, stop)
+        except Exception as e:
+            conn.send((False, repr(e)))
+        else:
+            conn.send((True, res))
+
+
+class _Job:
+    __slots__ = ("owner", "args", "time_limit", "future", "queued_at")
+
+    def __init__(self, owner, args: tuple, time_limit: None | float, future):
+        self.owner = owner
+        self.args = args
+        self.time_limit = time_limit
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+
+class _Worker:
+    def __init__(self, ctx, n: int):
+        self.conn, child = ctx.Pipe()
+        self.stop = ctx.Event()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child, self.stop),
+            name=f"engine-{n}",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+        self.n = n
+        self.job = None  # the job being searched
+        self.job_started = 0.0
+        self.busy_time = 0.0  # seconds spent on finished jobs
+
+
+class EnginePool:
+    """
+    Runs engine searches on worker processes, so they use the other cores instead of holding the GIL of the bot's process.
+    Searches are queued per owner (the game they are for), and the workers take turns between the owners with queued searches, so a game asking for a lot of them doesn't hold up the others.
+    Every search gets its time limit plus `grace` seconds once a worker starts on it, after that it is told to stop, and the worker is restarted if it still doesn't answer after another `grace` seconds.
+    """
+
+    def __init__(self, workers: int = 1, grace: float = 2.0):
+        self.workers = workers
+        self.grace = grace
+
+        # spawned instead of forked, since the bot's process has threads (the render pool, the database driver) which forking doesn't copy
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._idle = []
+        # waits for the answers of the workers, one thread each
+        self._receivers = None
+        self._queues = OrderedDict()  # owner -> deque of its jobs, whoever's turn it is first
+        self._tasks = set()
+        self._started_at = 0.0
+
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.restarts = 0
+        self.nodes = 0
+        self.wait_time = 0.0  # seconds the started jobs spent in the queue
+
+    def start(self):
+        if self._workers:
+            return
+        self._receivers = ThreadPoolExecutor(
+            self.workers, thread_name_prefix="engine-recv"
+        )
+        self._workers = [_Worker(self._ctx, n) for n in range(self.workers)]
+        self._idle = list(self._workers)
+        self._started_at = time.perf_counter()
+
+    async def search(
+        self,
+        owner,
+        fen: str,
+        time_limit: None | float = None,
+        max_nodes: None | int = None,
+        max_depth: int = MAX_PLY,
+        history=(),
+    ):
+        """
+        Queues a search of the position, see core.engine.search_fen for the arguments.
+        RETURNS: the SearchResult, or None if the searches of the owner got cancelled
+        """
+        self.start()
+        job = _Job(
+            owner,
+            (fen, time_limit, max_nodes, max_depth, list(history)),
+            time_limit,
+            asyncio.get_running_loop().create_future(),
+        )
+        self._queues.setdefault(owner, deque()).append(job)
+        self.submitted += 1
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # whoever was waiting for it gave up, so the worker can move on
+            self._cancel_job(job)
+            raise
+
+    def cancel(self, owner) -> int:
+        """Drops the queued searches of the owner and stops the running ones. RETURNS: how many searches were cancelled"""
+        n = 0
+        for job in self._queues.pop(owner, ()):
+            if not job.future.done():
+                job.future.set_result(None)
+                n += 1
+        for w in self._workers:
+            if w.job is not None and w.job.owner == owner and not w.job.future.done():
+                w.stop.set()
+                w.job.future.set_result(None)
+                n += 1
+        self.cancelled += n
+        return n
+
+    def _cancel_job(self, job: _Job):
+        jobs = self._queues.get(job.owner)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.owner]
+        for w in self._workers:
+            if w.job is job:
+                w.stop.set()
+        self.cancelled += 1
+
+    def _dispatch(self):
+        while self._idle and self._queues:
+            owner, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            if jobs:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            if job.future.done():
+                continue
+
+            worker = self._idle.pop()
+            task = asyncio.create_task(self._run(worker, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, worker: _Worker, job: _Job):
+        loop = asyncio.get_running_loop()
+        worker.job = job
+        worker.job_started = time.perf_counter()
+        self.wait_time += worker.job_started - job.queued_at
+
+        watchdog = None
+        if job.time_limit is not None:
+            watchdog = loop.call_later(
+                job.time_limit + self.grace, self._overtime, worker, job
+            )
+        try:
+            worker.conn.send(job.args)
+            ok, res = await loop.run_in_executor(self._receivers, worker.conn.recv)
+        except (EOFError, OSError) as e:
+            ok, res = False, f"worker {worker.n} died: {e!r}"
+            if self._workers:  # and wasn't shut down
+                worker = self._restart(worker)
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            worker.busy_time += time.perf_counter() - worker.job_started
+            worker.job = None
+
+        if not job.future.done():
+            if ok:
+                self.completed += 1
+                self.nodes += res.nodes
+                job.future.set_result(res)
+            else:
+                self.failed += 1
+                job.future.set_exception(EngineError(res))
+
+        if self._workers:  # not shut down in the meantime
+            self._idle.append(worker)
+            self._dispatch()
+
+    def _overtime(self, worker: _Worker, job: _Job):
+        if worker.job is not job:
+            return
+        worker.stop.set()
+        asyncio.get_running_loop().call_later(self.grace, self._kill_if_stuck, worker, job)
+
+    def _kill_if_stuck(self, worker: _Worker, job: _Job):
+        if worker.job is job:
+            print(f"Engine worker {worker.n} didn't stop, restarting it")
+            worker.process.kill()  # the pending recv fails, which restarts it
+
+    def _restart(self, worker: _Worker) -> _Worker:
+        worker.process.kill()
+        worker.conn.close()
+        new = _Worker(self._ctx, worker.n)
+        new.busy_time = worker.busy_time
+        new.job, new.job_started = worker.job, worker.job_started
+        self._workers[self._workers.index(worker)] = new
+        self.restarts += 1
+        return new
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def utilization(self) -> float:
+        """RETURNS: the share of the workers' time spent searching since they were started, from 0 to 1"""
+        if not self._workers:
+            return 0.0
+        now = time.perf_counter()
+        busy = sum(
+            w.busy_time + (now - w.job_started if w.job else 0) for w in self._workers
+        )
+        return busy / ((now - self._started_at) * len(self._workers))
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed
+        busy = sum(w.busy_time for w in self._workers)
+        return {
+            "workers": len(self._workers),
+            "queue_depth": self.queue_depth,
+            "running": sum(w.job is not None for w in self._workers),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "utilization": self.utilization(),
+            "avg_wait": self.wait_time / started if started else 0.0,
+            "nodes_per_second": self.nodes / busy if busy else 0.0,
+        }
+
+    def shutdown(self):
+        workers, self._workers, self._idle = self._workers, [], []
+        for w in workers:
+            if w.job is not None and not w.job.future.done():
+                w.job.future.set_result(None)
+            try:
+                w.conn.send(None)
+            except OSError:
+                pass
+        for w in workers:
+            w.process.join(timeout=1)
+            if w.process.is_alive():
+                w.process.kill()
+            w.conn.close()
+        for jobs in self._queues.values():
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_result(None)
+        self._queues.clear()
+        if self._receivers:
+            self._receivers.shutdown(wait=False, cancel_futures=True)
+            self._receivers = None
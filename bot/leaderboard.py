@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+
+class Leaderboard:
+    """
+    The top players and the number of players, so showing the leaderboard never sorts the players collection.
+    Both are read from the store every refresh_interval seconds, or min_interval seconds after a game ends (see mark_stale), whichever comes first.
+    A rank is counted on the rating index by the store, so the ratings of everyone are never read. Ranks of ratings in the top players are worked out from them, and the counted ones are kept until the next refresh.
+    """
+
+    def __init__(
+        self,
+        store,
+        size: int = 10,
+        refresh_interval: float = 300.0,
+        min_interval: float = 10.0,
+    ):
+        self.store = store
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.min_interval = min_interval
+
+        self.top = []  # (user id, rating) of the best players, best first
+        self.players = 0
+        self._ranks = {}  # rating -> rank, of the ratings below the top players which were counted since the last refresh
+        self._stale = asyncio.Event()
+        self._task = None
+
+        self.refreshes = 0
+        self.rank_counts = 0  # ranks which had to be counted by the store
+        self.last_refresh = 0.0  # time.time() of the last refresh
+        self.last_refresh_latency = 0.0  # seconds
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def refresh(self):
+        start = time.perf_counter()
+        top, players = await asyncio.gather(
+            self.store.get_top_players(self.size), self.store.count_players()
+        )
+        self.top = [(p.user_id, p.rating) for p in top]
+        self.players = players
+        self._ranks = {}
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self.last_refresh_latency = time.perf_counter() - start
+
+    async def _run(self):
+        while True:
+            # cleared before reading, so a game ending during the refresh gets another one
+            self._stale.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh the leaderboard: {e}")
+            try:
+                await asyncio.wait_for(self._stale.wait(), self.refresh_interval)
+                # games ending right after this one are picked up by the same refresh
+                await asyncio.sleep(self.min_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def mark_stale(self):
+        """Called when ratings change, the top players are read again within min_interval seconds"""
+        self._stale.set()
+
+    async def rank_of(self, rating: float) -> int:
+        """RETURNS: the rank (starting at 1) of a player with the given rating, players with the same rating share it"""
+        if self.refreshes and (len(self.top) < self.size or rating >= self.top[-1][1]):
+            # everyone rated higher is one of the top players
+            return sum(r > rating for _, r in self.top) + 1
+        rank = self._ranks.get(rating)
+        if rank is None:
+            rank = self._ranks[rating] = await self.store.count_players_above(rating) + 1
+            self.rank_counts += 1
+        return rank
+
+    def __len__(self):
+        return self.players
+
+    def stats(self) -> dict:
+        return {
+            "players": self.players,
+            "refreshes": self.refreshes,
+            "rank_counts": self.rank_counts,
+            "last_refresh": self.last_refresh,
+            "last_refresh_latency": self.last_refresh_latency,
+        }
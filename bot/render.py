@@ -0,0 +1,123 @@
+import asyncio
+import io
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from board import Board
+from bot.cache import PngCache, render_key
+
+
+def render_png(
+    config: list, squares_to_color: None | dict = None, flipped: bool = False
+) -> bytes:
+    """
+    Draws the board configuration and encodes it as a PNG.
+    This runs inside the worker pool, so it only takes a (picklable) copy of the configuration instead of the board which keeps on changing.
+    """
+    b = Board()
+    b.config = config
+    img = b.to_image(squares_to_color=squares_to_color, flipped=flipped)
+    byte_arr = io.BytesIO()
+    img.save(byte_arr, "png")
+    return byte_arr.getvalue()
+
+
+class RenderBusy(Exception):
+    """Raised instead of rendering when too many renders are already waiting for the pool"""
+
+
+class RenderService:
+    """
+    Renders boards to PNG bytes on a thread or process pool, so that Pillow never runs on the event loop.
+    At most max_pending renders are handed to the pool at once, anything after that waits (without blocking the loop) for a free slot. Renders of the same image which are requested at the same time are only done once.
+    Once max_waiting renders are waiting, new ones are rejected with RenderBusy instead of piling up behind them.
+    """
+
+    def __init__(
+        self,
+        cache: PngCache,
+        workers: int = 2,
+        use_processes: bool = False,
+        max_pending: int = 32,
+        max_waiting: int = 256,
+    ):
+        self.cache = cache
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=workers)
+            if use_processes
+            else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        )
+        self._slots = asyncio.Semaphore(max_pending)
+        self.max_waiting = max_waiting
+        self._in_progress = {}  # render key -> future of the render
+
+        self.waiting = 0  # renders waiting for a free slot
+        self.running = 0  # renders handed to the pool
+        self.rendered = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self.waiting + self.running
+
+    async def render(
+        self, board, squares_to_color: None | dict = None, flipped: bool = False
+    ) -> bytes:
+        key = render_key(board, squares_to_color, flipped)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        fut = self._in_progress.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._in_progress[key] = fut
+        try:
+            data = await self._render(board.config.copy(), squares_to_color, flipped)
+            self.cache.put(key, data)
+            fut.set_result(data)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # marks it as retrieved, so it doesnt warn when nobody else was waiting
+            raise
+        finally:
+            self._in_progress.pop(key, None)
+        return data
+
+    async def _render(self, config, squares_to_color, flipped) -> bytes:
+        if self._slots.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise RenderBusy(f"{self.waiting} renders are already waiting")
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, render_png, config, squares_to_color, flipped
+            )
+        finally:
+            self.running -= 1
+            self.rendered += 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "waiting": self.waiting,
+            "running": self.running,
+            "rendered": self.rendered,
+            "rejected": self.rejected,
+            **self.cache.stats(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,73 @@
+"""
+Benchmark of Game.eval_state, which runs after every move.
+It plays through a few games and times evaluating the state after each move, with the old evaluation (which looked at both sides and rescanned the whole board every time) and with the current one.
+
+Usage (from the root of the repo):
+    python core/bench_eval.py [--repeat N]
+"""
+
+import argparse
+import time
+
+from game import Game, GameState
+from piece import PieceColor, PieceType
+
+GAMES = [
+    # Scholar's mate
+    "e4 e5 Bc4 Nc6 Qh5 Nf6 Qxf7#",
+    # Italian game, goes into a long middlegame
+    "e4 e5 Nf3 Nc6 Bc4 Bc5 c3 Nf6 d4 exd4 cxd4 Bb4+ Nc3 Nxe4 O-O Bxc3 d5 Bf6 Re1 Ne7 Rxe4 d6 Bg5 Bxg5 Nxg5 h6 Qe2 hxg5 Re1 Be6 dxe6 f6 Re3 c6 Rh3 Rxh3 gxh3 g6 Qf3 Qa5 Rd1 Qf5 Qb3 O-O-O Qa3 Qc5 Qb3 d5 Bf1",
+    # Queen's gambit declined
+    "d4 d5 c4 e6 Nc3 Nf6 Bg5 Be7 e3 O-O Nf3 h6 Bh4 b6 cxd5 Nxd5 Bxe7 Qxe7 Nxd5 exd5 Rc1 Be6 Qa4 c5 Qa3 Rc8 Bb5 a6 dxc5 bxc5 O-O Ra7 Be2 Nd7 Nd4 Qf8 Nxe6 fxe6 e4 d4 f4 Qe7 e5 Rb8 Bc4 Kh8",
+]
+
+
+def legacy_eval_state(g: Game) -> GameState:
+    """The evaluation as it used to be: mate and stalemate for both sides, history scans and a full board scan for the material"""
+    b = g.board
+    if b.is_checkmate(g.turn) or b.is_checkmate(g.turn.compl()):
+        return GameState.WinWhite if g.turn == PieceColor.Black else GameState.WinBlack
+    if b.is_stalemate(g.turn) or b.is_stalemate(g.turn.compl()) or g.is_fivefold_rep():
+        return GameState.Draw
+    if len(g.played_moves) >= 75 * 2 and not any(
+        m.is_normal_move() and (m.move.piece_type == PieceType.Pawn or m.move.is_capture)
+        for m, _ in g.played_moves[-75 * 2 :]
+    ):
+        return GameState.Draw
+    pieces = [p for p in b.config if p]
+    if all(p.type in (PieceType.King, PieceType.Bishop, PieceType.Knight) for p in pieces):
+        if len(pieces) <= 3:
+            return GameState.Draw
+    return GameState.Playing
+
+
+def bench(evaluate, repeat: int) -> tuple[float, int]:
+    """Returns (total seconds spent evaluating, number of evaluations)"""
+    took = 0.0
+    n = 0
+    for moves in GAMES:
+        g = Game()
+        for move in moves.split():
+            g.play_san(move)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                evaluate(g)
+            took += time.perf_counter() - start
+            n += repeat
+    return took, n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of Game.eval_state")
+    parser.add_argument("--repeat", type=int, default=20, help="Evaluations per position")
+    args = parser.parse_args(argv)
+
+    before, n = bench(legacy_eval_state, args.repeat)
+    after, _ = bench(Game.eval_state, args.repeat)
+    print(f"before: {before / n * 1e6:8.1f} us per move")
+    print(f"after:  {after / n * 1e6:8.1f} us per move")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Bitboard helpers used by the Board.
+
+A bitboard is just a python int where bit i is turned on if the square with index i is set. The indexing is the same one Board.config uses, so 0 represents A1, 7 represents H1 and 63 represents H8.
+The attack tables for the knight, king and pawn are precomputed once at import. Sliding pieces (rook, bishop, queen) use precomputed rays which get cut off at the first blocker.
+"""
+
+from piece import PieceColor
+
+FULL = (1 << 64) - 1
+
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+RANK_1 = 0xFF
+RANK_2 = RANK_1 << 8
+RANK_7 = RANK_1 << 48
+RANK_8 = RANK_1 << 56
+
+# All the squares which are light colored (A1 is a dark square, so B1 is the first light one)
+LIGHT_SQUARES = 0x55AA55AA55AA55AA
+DARK_SQUARES = FULL ^ LIGHT_SQUARES
+
+
+def bit(i: int) -> int:
+    return 1 << i
+
+
+def lsb(bb: int) -> int:
+    """Returns the index of the least significant bit which is turned on. The bitboard must not be empty"""
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb: int) -> int:
+    """Returns the index of the most significant bit which is turned on. The bitboard must not be empty"""
+    return bb.bit_length() - 1
+
+
+def popcount(bb: int) -> int:
+    return bb.bit_count()
+
+
+def iter_bits(bb: int):
+    """Yields the index of every bit which is turned on, from the lowest to the highest"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _leaper_attacks(dirs) -> list[int]:
+    table = []
+    for i in range(64):
+        file, rank = i % 8, i // 8
+        mask = 0
+        for df, dr in dirs:
+            f, r = file + df, rank + dr
+            if 0 <= f < 8 and 0 <= r < 8:
+                mask |= 1 << (r * 8 + f)
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_attacks(
+    [(-1, 2), (-1, -2), (1, 2), (1, -2), (-2, 1), (-2, -1), (2, 1), (2, -1)]
+)
+KING_ATTACKS = _leaper_attacks(
+    [(0, 1), (1, 0), (1, 1), (-1, 0), (0, -1), (-1, 1), (-1, -1), (1, -1)]
+)
+
+# PAWN_ATTACKS[color][i] are the squares a pawn of that color standing on i attacks
+PAWN_ATTACKS = [
+    _leaper_attacks([(-1, 1), (1, 1)]),
+    _leaper_attacks([(-1, -1), (1, -1)]),
+]
+
+
+def _rays(df: int, dr: int) -> list[int]:
+    table = []
+    for i in range(64):
+        f, r = i % 8 + df, i // 8 + dr
+        mask = 0
+        while 0 <= f < 8 and 0 <= r < 8:
+            mask |= 1 << (r * 8 + f)
+            f += df
+            r += dr
+        table.append(mask)
+    return table
+
+
+# Rays going towards higher indices get cut at their lowest blocker, the others at their highest blocker
+_NORTH = _rays(0, 1)
+_EAST = _rays(1, 0)
+_NORTH_EAST = _rays(1, 1)
+_NORTH_WEST = _rays(-1, 1)
+_SOUTH = _rays(0, -1)
+_WEST = _rays(-1, 0)
+_SOUTH_WEST = _rays(-1, -1)
+_SOUTH_EAST = _rays(1, -1)
+
+
+def _positive_ray(ray: list[int], i: int, occupied: int) -> int:
+    attacks = ray[i]
+    blockers = attacks & occupied
+    if blockers:
+        attacks ^= ray[(blockers & -blockers).bit_length() - 1]
+    return attacks
+
+
+def _negative_ray(ray: list[int], i: int, occupied: int) -> int:
+    attacks = ray[i]
+    blockers = attacks & occupied
+    if blockers:
+        attacks ^= ray[blockers.bit_length() - 1]
+    return attacks
+
+
+def rook_attacks(i: int, occupied: int) -> int:
+    return (
+        _positive_ray(_NORTH, i, occupied)
+        | _positive_ray(_EAST, i, occupied)
+        | _negative_ray(_SOUTH, i, occupied)
+        | _negative_ray(_WEST, i, occupied)
+    )
+
+
+def bishop_attacks(i: int, occupied: int) -> int:
+    return (
+        _positive_ray(_NORTH_EAST, i, occupied)
+        | _positive_ray(_NORTH_WEST, i, occupied)
+        | _negative_ray(_SOUTH_WEST, i, occupied)
+        | _negative_ray(_SOUTH_EAST, i, occupied)
+    )
+
+
+def queen_attacks(i: int, occupied: int) -> int:
+    return rook_attacks(i, occupied) | bishop_attacks(i, occupied)
+
+
+def pawn_pushes(color: PieceColor, pawns: int, empty: int) -> tuple[int, int]:
+    """
+    Returns the (single pushes, double pushes) target squares of the given pawns, where `empty` are the squares which are not occupied.
+    """
+    if color == PieceColor.White:
+        single = (pawns << 8) & empty & FULL
+        double = ((single & (RANK_2 << 8)) << 8) & empty
+    else:
+        single = (pawns >> 8) & empty
+        double = ((single & (RANK_7 >> 8)) >> 8) & empty
+    return single, double
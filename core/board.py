@@ -1,9 +1,51 @@
 from square import SquarePosition, File
-from move import Move, NormalMove, Castling
+from move import (
+    Move,
+    NormalMove,
+    Castling,
+    MOVE_FLAG_DOUBLE_PUSH,
+    MOVE_FLAG_EN_PASSANT,
+    MOVE_FLAG_CASTLE,
+    MOVE_FLAG_PROMOTION_KNIGHT,
+    MOVE_FLAG_PROMOTION_BISHOP,
+    MOVE_FLAG_PROMOTION_ROOK,
+    MOVE_FLAG_PROMOTION_QUEEN,
+    flag_to_promotion,
+    piece_to_alpha,
+    move_from,
+    move_to,
+    move_flag,
+)
 from piece import PieceColor, PieceType, Piece
-from img import IMG_SIZE, SQUARE_SIZE, PIECE_IMAGES, WHITE, BLACK
-
-from PIL import Image
+from bitboard import (
+    KNIGHT_ATTACKS,
+    KING_ATTACKS,
+    PAWN_ATTACKS,
+    FULL,
+    LIGHT_SQUARES,
+    RANK_1,
+    RANK_8,
+    rook_attacks,
+    bishop_attacks,
+    queen_attacks,
+    pawn_pushes,
+    iter_bits,
+    lsb,
+)
+from zobrist import PIECE_KEYS, CASTLING_KEYS, EN_PASSANT_KEYS, BLACK_TO_MOVE
+import polyglot
+import tablebase
+from img import IMG_SIZE, SQUARE_SIZE, get_board_background, get_piece_sprite
+
+
+# The number of each PieceType in polyglot, which orders them pawn, knight, bishop, rook, queen, king
+_POLYGLOT_PIECES = [None, 0, 1, 3, 2, 5, 4]
+_POLYGLOT_CASTLING = [
+    (PieceColor.White, Castling.Short),
+    (PieceColor.White, Castling.Long),
+    (PieceColor.Black, Castling.Short),
+    (PieceColor.Black, Castling.Long),
+]
 
 
 class InvalidFEN(Exception):
@@ -84,10 +126,78 @@ def sign(x: int) -> int:
     return (abs(x) // x) if x != 0 else 0
 
 
+# Where the rook moves from and to, given the square the king lands on when castling
+_castle_rook_squares = {
+    6: (7, 5),
+    2: (0, 3),
+    62: (63, 61),
+    58: (56, 59),
+}
+
+# The castling right which is lost when a piece moves from or to (captures on) one of the rook's starting squares
+_castle_rook_corners = {
+    0: (PieceColor.White, Castling.Long),
+    7: (PieceColor.White, Castling.Short),
+    56: (PieceColor.Black, Castling.Long),
+    63: (PieceColor.Black, Castling.Short),
+}
+
+# Queen first so that the most likely promotion is tried first
+_promotion_flags = (
+    MOVE_FLAG_PROMOTION_QUEEN,
+    MOVE_FLAG_PROMOTION_KNIGHT,
+    MOVE_FLAG_PROMOTION_ROOK,
+    MOVE_FLAG_PROMOTION_BISHOP,
+)
+
+
+def _starting_config() -> list[None | Piece]:
+    config = [None for _ in range(8 * 8)]
+    # pawns
+    for i in range(8, 16):
+        config[i] = Piece.pawn(PieceColor.White)
+    for i in range(48, 56):
+        config[i] = Piece.pawn(PieceColor.Black)
+
+    # rooks
+    config[0] = Piece.rook(PieceColor.White)
+    config[7] = Piece.rook(PieceColor.White)
+    config[-8] = Piece.rook(PieceColor.Black)
+    config[-1] = Piece.rook(PieceColor.Black)
+
+    # knights
+    config[1] = Piece.knight(PieceColor.White)
+    config[6] = Piece.knight(PieceColor.White)
+    config[-7] = Piece.knight(PieceColor.Black)
+    config[-2] = Piece.knight(PieceColor.Black)
+
+    # bishop
+    config[2] = Piece.bishop(PieceColor.White)
+    config[5] = Piece.bishop(PieceColor.White)
+    config[-6] = Piece.bishop(PieceColor.Black)
+    config[-3] = Piece.bishop(PieceColor.Black)
+
+    # queen
+    config[3] = Piece.queen(PieceColor.White)
+    config[-5] = Piece.queen(PieceColor.Black)
+
+    # king
+    config[4] = Piece.king(PieceColor.White)
+    config[-4] = Piece.king(PieceColor.Black)
+    return config
+
+
 class Board:
     def __init__(self):
         # Our board configuration. 63 represents H8, 0 represents A1
-        self.config = [None for f in range(0, 8) for r in range(0, 8)]
+        self._config = [None for f in range(0, 8) for r in range(0, 8)]
+
+        # Bitboards of every piece, indexed as pieces[color][piece_type] (index 0 of the inner list is unused since PieceType starts at 1)
+        # These are kept in sync with config by _put and _remove, so never assign to config[i] directly
+        self.pieces = [[0] * 7, [0] * 7]
+        # Squares occupied by each color, and by both of them
+        self.occupancy = [0, 0]
+        self.occupied = 0
 
         # Represents if the player can castle, assuming the path for the king and rook is clear
         # Esentially, this tracks if the king or the rooks have moved at all
@@ -108,74 +218,207 @@ class Board:
             PieceColor.White: 0b00000000,
             PieceColor.Black: 0b00000000,
         }
-        # pawns
-        for i in range(8, 16):
-            self.config[i] = Piece.pawn(PieceColor.White)
-        for i in range(48, 56):
-            self.config[i] = Piece.pawn(PieceColor.Black)
-
-        # rooks
-        self.config[0] = Piece.rook(PieceColor.White)
-        self.config[7] = Piece.rook(PieceColor.White)
-        self.config[-8] = Piece.rook(PieceColor.Black)
-        self.config[-1] = Piece.rook(PieceColor.Black)
-
-        # knights
-        self.config[1] = Piece.knight(PieceColor.White)
-        self.config[6] = Piece.knight(PieceColor.White)
-        self.config[-7] = Piece.knight(PieceColor.Black)
-        self.config[-2] = Piece.knight(PieceColor.Black)
-
-        # bishop
-        self.config[2] = Piece.bishop(PieceColor.White)
-        self.config[5] = Piece.bishop(PieceColor.White)
-        self.config[-6] = Piece.bishop(PieceColor.Black)
-        self.config[-3] = Piece.bishop(PieceColor.Black)
-
-        # queen
-        self.config[3] = Piece.queen(PieceColor.White)
-        self.config[-5] = Piece.queen(PieceColor.Black)
-
-        # king
-        self.config[4] = Piece.king(PieceColor.White)
-        self.config[-4] = Piece.king(PieceColor.Black)
+
+        # Number of moves since the last capture or pawn move, for the fifty and seventy five move rules
+        self.halfmove_clock = 0
+
+        # Stores what make_move changed, so unmake_move can take it back
+        self._undo = []
+
+        # Zobrist hash of the position (see zobrist.py), without the side to move since the board doesnt know whose turn it is. Use position_key for that
+        self.zobrist = self.compute_zobrist()
+
+        for i, p in enumerate(_starting_config()):
+            if p:
+                self._put(i, p)
+
+    @property
+    def config(self):
+        return self._config
+
+    @config.setter
+    def config(self, config):
+        self._config = config
+        self._sync_bitboards()
+
+    def _sync_bitboards(self):
+        """Rebuilds the bitboards from config"""
+        self.pieces = [[0] * 7, [0] * 7]
+        self.occupancy = [0, 0]
+        for i, p in enumerate(self._config):
+            if p:
+                self.pieces[p.color][p.type] |= 1 << i
+                self.occupancy[p.color] |= 1 << i
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+        self.zobrist = self.compute_zobrist()
+
+    def compute_zobrist(self) -> int:
+        """Computes the zobrist hash from scratch. Call this (and assign to zobrist) after changing can_castle or en_passant directly"""
+        h = 0
+        for i, p in enumerate(self._config):
+            if p:
+                h ^= PIECE_KEYS[p.color][p.type][i]
+        for color, rights in self.can_castle.items():
+            for side, allowed in rights.items():
+                if allowed:
+                    h ^= CASTLING_KEYS[(color, side)]
+        return h ^ self._en_passant_key()
+
+    def _en_passant_key(self) -> int:
+        """
+        The en passant part of the hash. The file is only hashed when a pawn is actually there to capture it, so positions that only differ by an unusable en passant file are treated as the same, like the repetition rules want it.
+        """
+        for color in PieceColor:
+            ep = self.en_passant[color]
+            if not ep:
+                continue
+            file = ep.bit_length() - 1
+            # the square the capturing pawn would land on
+            target = file + (16 if color == PieceColor.White else 40)
+            if PAWN_ATTACKS[color][target] & self.pieces[1 - color][PieceType.Pawn]:
+                return EN_PASSANT_KEYS[file]
+        return 0
+
+    def position_key(self, turn: PieceColor) -> int:
+        """The zobrist hash of the position with the given side to move"""
+        return self.zobrist ^ (BLACK_TO_MOVE if turn == PieceColor.Black else 0)
+
+    def polyglot_key(self, turn: PieceColor) -> int:
+        """
+        The hash Polyglot opening books key the position with, see polyglot.py.
+        Its keys differ from the ones of position_key, and it is computed from scratch since its only needed when probing a book.
+        """
+        keys = polyglot.RANDOM64
+        key = 0
+        for color in PieceColor:
+            for ptype in PieceType:
+                kind = 2 * _POLYGLOT_PIECES[ptype] + (color == PieceColor.White)
+                for i in iter_bits(self.pieces[color][ptype]):
+                    key ^= keys[polyglot.PIECE + 64 * kind + i]
+
+        for n, (color, side) in enumerate(_POLYGLOT_CASTLING):
+            if self.can_castle[color][side]:
+                key ^= keys[polyglot.CASTLE + n]
+
+        # like in the zobrist hash, the enpassant file only counts when a pawn can actually capture there
+        color = 1 - turn
+        ep = self.en_passant[color]
+        if ep:
+            file = ep.bit_length() - 1
+            target = file + (16 if color == PieceColor.White else 40)
+            if PAWN_ATTACKS[color][target] & self.pieces[turn][PieceType.Pawn]:
+                key ^= keys[polyglot.EN_PASSANT + file]
+
+        if turn == PieceColor.White:
+            key ^= keys[polyglot.TURN]
+        return key
+
+    def _put(self, i: int, p: Piece):
+        """Places a piece at the index, updating the bitboards. The square must be empty"""
+        b = 1 << i
+        self._config[i] = p
+        self.pieces[p.color][p.type] |= b
+        self.occupancy[p.color] |= b
+        self.occupied |= b
+        self.zobrist ^= PIECE_KEYS[p.color][p.type][i]
+
+    def _remove(self, i: int) -> None | Piece:
+        """Removes the piece at the index (if any) and returns it"""
+        p = self._config[i]
+        if p is None:
+            return None
+        b = ~(1 << i)
+        self._config[i] = None
+        self.pieces[p.color][p.type] &= b
+        self.occupancy[p.color] &= b
+        self.occupied &= b
+        self.zobrist ^= PIECE_KEYS[p.color][p.type][i]
+        return p
 
     def to_image(
         self,
         img_dims: tuple[int, int] = (IMG_SIZE, IMG_SIZE),
         sq_dims: tuple[int, int] = (SQUARE_SIZE, SQUARE_SIZE),
         squares_to_color: dict[SquarePosition, tuple[int, int, int, int]] = None,
+        flipped: bool = False,
     ):
-        if squares_to_color is None:
-            squares_to_color = {}
-        img = Image.new("RGBA", img_dims, (0, 0, 0, 255))
-        for k, sq in enumerate(self.config):
-            i = k // 8
-            j = k % 8
-            flippy = (i + j) % 2 == 0  # determines square color lol
-            flipped_i = 7 - i
-            pos = (j * sq_dims[0], flipped_i * sq_dims[1])
-            sq_color = squares_to_color.get(SquarePosition.from_index(k)) or (
-                BLACK if flippy else WHITE
-            )
-            sq_img = Image.new("RGBA", sq_dims, sq_color)
-            if sq is not None:
-                p_img = PIECE_IMAGES[sq.type][
-                    "white" if sq.color == PieceColor.White else "black"
-                ]
-                p_img.convert("RGBA")
-                p_img = p_img.resize(sq_dims)
-                sq_img.paste(p_img, (0, 0), p_img)
-            img.paste(sq_img, pos)
+        """
+        Draws the board. If flipped is True the board is drawn from black's side (the square colors dont change since the board is symmetric)
+        """
+
+        def square_pos(k: int) -> tuple[int, int]:
+            file, rank_i = k % 8, k // 8
+            if flipped:
+                return ((7 - file) * sq_dims[0], rank_i * sq_dims[1])
+            return (file * sq_dims[0], (7 - rank_i) * sq_dims[1])
+
+        img = get_board_background(img_dims, sq_dims).copy()
+        if squares_to_color:
+            for sq, color in squares_to_color.items():
+                x, y = square_pos(sq.to_index())
+                img.paste(color, (x, y, x + sq_dims[0], y + sq_dims[1]))
+
+        for k in iter_bits(self.occupied):
+            p = self._config[k]
+            sprite = get_piece_sprite(p.type, p.color, sq_dims)
+            img.paste(sprite, square_pos(k), sprite)
 
         return img
 
+    def to_FEN(
+        self,
+        turn: PieceColor,
+        halfmove_clock: None | int = None,
+        fullmove_number: int = 1,
+    ) -> str:
+        """
+        Returns the FEN of the position. The board doesnt know whose turn it is or how many moves were played, so those have to be given. The halfmove clock defaults to the board's own
+        """
+        if halfmove_clock is None:
+            halfmove_clock = self.halfmove_clock
+
+        rows = []
+        for rank in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for file in range(8):
+                p = self._config[rank * 8 + file]
+                if not p:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                c = piece_to_alpha.get(p.type, "P")
+                row += c if p.color == PieceColor.White else c.lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        castling = ""
+        for color, short, long_ in ((PieceColor.White, "K", "Q"), (PieceColor.Black, "k", "q")):
+            if self.can_castle[color][Castling.Short]:
+                castling += short
+            if self.can_castle[color][Castling.Long]:
+                castling += long_
+
+        # the square behind the pawn which just moved two steps
+        en_passant = "-"
+        ep = self.en_passant[1 - turn]
+        if ep:
+            file = File(ep.bit_length() - 1)
+            en_passant = f"{file}{3 if turn == PieceColor.Black else 6}"
+
+        side = "w" if turn == PieceColor.White else "b"
+        return f"{'/'.join(rows)} {side} {castling or '-'} {en_passant} {halfmove_clock} {fullmove_number}"
+
     def _move_raw(self, from_: SquarePosition, to: SquarePosition):
         from_i = from_.to_index()
         to_i = to.to_index()
-        p = self.config[from_i]
-        self.config[from_i] = None
-        self.config[to_i] = p
+        p = self._remove(from_i)
+        self._remove(to_i)
+        if p:
+            self._put(to_i, p)
 
     def move_piece(self, move: Move) -> None | Move:
         inner = None
@@ -189,69 +432,37 @@ class Board:
         return Move(inner)
 
     def move_normal(self, move: NormalMove, turn: PieceColor) -> None | NormalMove:
+        """
+        Finds the legal move matching the (possibly partial) move given and plays it.
+        RETURNS: The move with all the details filled in, False if the move is ambigous and None if there is no such legal move
+        """
+        to_i = move.to.to_index()
         from_ = move.from_
-        to = move.to
-        is_capture = move.is_capture
         avail = []
-        file = to.file
-
-        match move.piece_type:
-            case PieceType.Pawn:
-                avail = self._get_pawn_which_can_move_to(
-                    turn, to, from_, is_capture=is_capture
-                )
-            case PieceType.Rook:
-                avail = self._get_rook_which_can_move_to(
-                    turn, to, from_, is_capture=is_capture
-                )
-            case PieceType.Bishop:
-                avail = self._get_bishop_which_can_move_to(
-                    turn, to, from_, is_capture=is_capture
-                )
-            case PieceType.Queen:
-                avail_as_bish = self._get_bishop_which_can_move_to(
-                    turn, to, from_, ptype=PieceType.Queen, is_capture=is_capture
-                )
-                avail_as_rook = self._get_rook_which_can_move_to(
-                    turn, to, from_, ptype=PieceType.Queen, is_capture=is_capture
-                )
-                avail = avail_as_bish + avail_as_rook
-
-            case PieceType.King:
-                if not from_:
-                    for i, v in enumerate(self.config):
-                        # ASSUMPTION: there is only 1 king of each color on the board
-                        if v and v.type == PieceType.King and v.color == turn:
-                            from_ = SquarePosition.from_index(i)
-                            break
-                    if not from_:
-                        self.print_board()
-                        self.to_image(
-                            (IMG_SIZE, IMG_SIZE), (SQUARE_SIZE, SQUARE_SIZE)
-                        ).show()
-
-                fi = from_.to_index()
-                toi = to.to_index()
-                possible_sqs = [
-                    fi - 8 - 1,
-                    fi - 8,
-                    fi - 8 + 1,
-                    fi - 1,
-                    fi + 1,
-                    fi + 8 - 1,
-                    fi + 8,
-                    fi + 8 + 1,
-                ]
-                if toi in possible_sqs and (
-                    not self.config[toi]
-                    or self.config[toi].color != turn
-                    and is_capture
-                ):
-                    avail.append(from_)
-            case PieceType.Knight:
-                avail = self._get_knight_which_can_move_to(
-                    turn, to, from_, is_capture=is_capture
-                )
+        for m in self.generate_legal_moves(turn):
+            if move_to(m) != to_i:
+                continue
+            from_i = move_from(m)
+            flag = move_flag(m)
+            if flag == MOVE_FLAG_CASTLE:
+                continue
+            p = self._config[from_i]
+            if p.type != move.piece_type:
+                continue
+            if from_ is not None:
+                if from_.file is not None and from_.file != from_i % 8:
+                    continue
+                if from_.rank is not None and from_.rank != from_i // 8 + 1:
+                    continue
+            # a move marked as capture has to capture, but a capture not marked with an x is still let through
+            if move.is_capture and not (
+                self._config[to_i] or flag == MOVE_FLAG_EN_PASSANT
+            ):
+                continue
+            promotion_to = flag_to_promotion.get(flag)
+            if promotion_to and promotion_to != move.promotion_to:
+                continue  # No piece was to promote to was give, therefore its not a valid move
+            avail.append(m)
 
         if len(avail) > 1:  # Ambigous move
             return False
@@ -259,116 +470,293 @@ class Board:
         if len(avail) == 0:
             return None
 
-        ps = avail.pop()
+        m = avail.pop()
+        played = self.to_move(m, turn).move
+        self.make_move(m, turn)
+        return played
 
-        saved_state = self.copy()
+    def castle(self, move: Castling, turn: PieceColor) -> None | Castling:
+        # the king lands on the G file when castling short and on the C file when castling long
+        to_file = File.G if move == Castling.Short else File.C
+        for m in self.generate_legal_moves(turn):
+            if move_flag(m) == MOVE_FLAG_CASTLE and move_to(m) % 8 == to_file:
+                self.make_move(m, turn)
+                return move
+        return None
 
-        # Checking valid promotion moves
-        if move.piece_type == PieceType.Pawn and to.rank == (
-            8 if turn == PieceColor.White else 1
-        ):
-            if not move.promotion_to:
-                return False  # No piece was to promote to was give, therefore its not a valid move
-            self.config[ps.to_index()] = Piece(move.promotion_to, turn)
-
-        # Castling updating
-        if move.piece_type == PieceType.King:
-            self.can_castle[turn] = {Castling.Short: False, Castling.Long: False}
-        elif move.piece_type == PieceType.Rook:
-            if ps.file == File.A:
-                self.can_castle[turn][Castling.Long] = False
-            elif ps.file == File.A:
-                self.can_castle[turn][Castling.Short] = False
-
-        if self.is_en_passant(turn, to, ps):
-            pawn_to_take = SquarePosition(
-                to.file, to.rank + (-1 if turn == PieceColor.White else 1)
+    def to_move(self, m: int, turn: PieceColor) -> Move:
+        """
+        Converts a compact move (see move.py) into a Move with all the details filled in. This has to be called before the move is made on the board.
+        """
+        from_i = move_from(m)
+        to_i = move_to(m)
+        flag = move_flag(m)
+        if flag == MOVE_FLAG_CASTLE:
+            res = Move(Castling.Short if to_i % 8 == File.G else Castling.Long)
+        else:
+            res = Move(
+                NormalMove(
+                    self._config[from_i].type,
+                    SquarePosition.from_index(to_i),
+                    SquarePosition.from_index(from_i),
+                    is_capture=self._config[to_i] is not None
+                    or flag == MOVE_FLAG_EN_PASSANT,
+                    is_en_passant=flag == MOVE_FLAG_EN_PASSANT,
+                    promotion_to=flag_to_promotion.get(flag),
+                )
             )
-            self.config[pawn_to_take.to_index()] = None
+        res.turn = turn
+        return res
 
-        # Enpassant updating
-        if (
-            move.piece_type == PieceType.Pawn
-            and abs(ps.to_index() - to.to_index()) == 8 * 2
-        ):
-            file = int(ps.file)
-            self.en_passant[turn] = 1 << file
-            self.en_passant[1 - turn] = 0
+    def to_san_move(self, m: int, turn: PieceColor) -> Move:
+        """
+        Like to_move, but only with the details SAN would write down: the square the piece came from is only given (as little of it as needed) if another piece of the same type could also go there, and for pawn captures. This has to be called before the move is made on the board.
+        """
+        res = self.to_move(m, turn)
+        if res.is_castling():
+            return res
+
+        nm = res.move
+        from_i = move_from(m)
+        to_i = move_to(m)
+        nm.from_ = None
+        if nm.piece_type == PieceType.Pawn:
+            if nm.is_capture:
+                nm.from_ = SquarePosition.empty()
+                nm.from_.file = File(from_i % 8)
+            return res
+
+        others = [
+            i
+            for i in iter_bits(self.pieces[turn][nm.piece_type] & ~(1 << from_i))
+            if self._pseudo_targets(i, turn, nm.piece_type) >> to_i & 1
+        ]
+        if others:
+            # only worth generating the legal moves when there is something to tell apart, one of them could be pinned
+            legal = {
+                move_from(x) for x in self.generate_legal_moves(turn) if move_to(x) == to_i
+            }
+            others = [i for i in others if i in legal]
+        if not others:
+            return res
+
+        nm.from_ = SquarePosition.empty()
+        if all(i % 8 != from_i % 8 for i in others):
+            nm.from_.file = File(from_i % 8)
+        elif all(i // 8 != from_i // 8 for i in others):
+            nm.from_.rank = from_i // 8 + 1
         else:
-            self.en_passant[turn] = 0
-            self.en_passant[1 - turn] = 0
-
-        self._move_raw(ps, to)
-
-        if self.is_check(turn):
-            self.config = saved_state.config
-            self.en_passant = saved_state.en_passant
-            self.can_castle = saved_state.can_castle
-
-            return None
+            nm.from_ = SquarePosition.from_index(from_i)
+        return res
 
-        move.from_ = ps
-        return move
+    def last_move(self) -> None | int:
+        """Returns the compact move which was made last, if any"""
+        return self._undo[-1][0] if self._undo else None
 
-    def castle(self, move: Castling, turn: PieceColor) -> None | Castling:
-        if not self.can_castle[turn][move] or self.is_check(turn):
-            return False
-        rank = 1 if turn == PieceColor.White else 8
-
-        match move:
-            case Castling.Short:
-                kpos = SquarePosition(File.E, rank)
-                rpos = SquarePosition(File.H, rank)
-                move_dir = 1
-                sq_visited_by_king = {
-                    SquarePosition(File.F, rank),
-                    SquarePosition(File.G, rank),
-                }
-                newkpos = SquarePosition(File.G, rank)
-                newrpos = SquarePosition(File.F, rank)
-
-            case Castling.Long:
-                kpos = SquarePosition(File.E, rank)
-                rpos = SquarePosition(File.A, rank)
-                move_dir = -1
-                sq_visited_by_king = {
-                    SquarePosition(File.D, rank),
-                    SquarePosition(File.C, rank),
-                }
-                newkpos = SquarePosition(File.C, rank)
-                newrpos = SquarePosition(File.D, rank)
-
-        king = self.get(kpos)
-        rook = self.get(rpos)
-
-        # sanity checks
-        if (
-            not king
-            or king.color != turn
-            or not rook
-            or rook.color != turn
-            or king.type != PieceType.King
-            or rook.type != PieceType.Rook
-        ):
-            return False  # may consider throwing an error here idk
+    def make_move(self, m: int, turn: PieceColor):
+        """
+        Plays a compact move (see move.py) in place, without checking if its legal. Only the things that changed are pushed onto the undo stack, so it can be taken back with unmake_move.
+        """
+        from_i = m & 63
+        to_i = (m >> 6) & 63
+        flag = m >> 12
+        prev_zobrist = self.zobrist
+        ep_key = self._en_passant_key() if self.en_passant[1 - turn] else 0
+
+        p = self._remove(from_i)
+        cap_i = to_i
+        if flag == MOVE_FLAG_EN_PASSANT:
+            cap_i = to_i - 8 if turn == PieceColor.White else to_i + 8
+        captured = self._remove(cap_i)
+
+        if flag >= MOVE_FLAG_PROMOTION_KNIGHT:
+            self._put(to_i, Piece(flag_to_promotion[flag], turn))
+        else:
+            self._put(to_i, p)
+
+        if flag == MOVE_FLAG_CASTLE:
+            rook_from, rook_to = _castle_rook_squares[to_i]
+            self._put(rook_to, self._remove(rook_from))
+
+        # Castling updating, a right is lost when the king or the rook moves, or when the rook is captured
+        lost_rights = []
+        if p.type == PieceType.King:
+            for side, allowed in self.can_castle[turn].items():
+                if allowed:
+                    lost_rights.append((turn, side))
+        for i in (from_i, to_i):
+            right = _castle_rook_corners.get(i)
+            if right and self.can_castle[right[0]][right[1]]:
+                lost_rights.append(right)
+        for color, side in lost_rights:
+            self.can_castle[color][side] = False
+            self.zobrist ^= CASTLING_KEYS[(color, side)]
 
-        # check if there is any checks in the files
-        if self.get_all_covered_squares(1 - turn, True) & sq_visited_by_king:
-            return None
+        # Enpassant updating
+        prev_en_passant = (
+            self.en_passant[PieceColor.White],
+            self.en_passant[PieceColor.Black],
+        )
+        self.en_passant[1 - turn] = 0
+        self.zobrist ^= ep_key
+        if flag == MOVE_FLAG_DOUBLE_PUSH:
+            self.en_passant[turn] = 1 << (from_i % 8)
+            self.zobrist ^= self._en_passant_key()
+        else:
+            self.en_passant[turn] = 0
 
-        # check if its clear
-        for v in range(1, 3):
-            p = SquarePosition(File(move_dir * v + kpos.file), kpos.rank)
-            if self.get(p):
-                return move
+        prev_halfmove_clock = self.halfmove_clock
+        if p.type == PieceType.Pawn or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        self._undo.append(
+            (
+                m,
+                turn,
+                p,
+                captured,
+                cap_i,
+                prev_en_passant,
+                lost_rights,
+                prev_zobrist,
+                prev_halfmove_clock,
+            )
+        )
 
-        self._move_raw(kpos, newkpos)
-        self._move_raw(rpos, newrpos)
+    def unmake_move(self):
+        """Takes back the last move made with make_move"""
+        (
+            m,
+            turn,
+            p,
+            captured,
+            cap_i,
+            prev_en_passant,
+            lost_rights,
+            prev_zobrist,
+            prev_halfmove_clock,
+        ) = self._undo.pop()
+        from_i = m & 63
+        to_i = (m >> 6) & 63
+
+        if m >> 12 == MOVE_FLAG_CASTLE:
+            rook_from, rook_to = _castle_rook_squares[to_i]
+            self._put(rook_from, self._remove(rook_to))
+
+        self._remove(to_i)
+        self._put(from_i, p)
+        if captured:
+            self._put(cap_i, captured)
+
+        for color, side in lost_rights:
+            self.can_castle[color][side] = True
+        self.en_passant[PieceColor.White] = prev_en_passant[0]
+        self.en_passant[PieceColor.Black] = prev_en_passant[1]
+        self.zobrist = prev_zobrist
+        self.halfmove_clock = prev_halfmove_clock
+
+    def generate_pseudo_legal_moves(self, turn: PieceColor) -> list[int]:
+        """
+        Generates all the compact moves (see move.py) the given color can make, without checking if they leave the king in check.
+        """
+        moves = []
+        pieces = self.pieces[turn]
+        own = self.occupancy[turn]
+        enemy = self.occupancy[1 - turn]
+        occ = self.occupied
+        empty = ~occ & FULL
 
-        self.can_castle[turn][move] = False
-        self.can_castle[turn][not move] = False
+        # pawns
+        pawns = pieces[PieceType.Pawn]
+        forward = 8 if turn == PieceColor.White else -8
+        last_rank = RANK_8 if turn == PieceColor.White else RANK_1
+        single, double = pawn_pushes(turn, pawns, empty)
+        for to in iter_bits(single):
+            if (1 << to) & last_rank:
+                for flag in _promotion_flags:
+                    moves.append((to - forward) | (to << 6) | (flag << 12))
+            else:
+                moves.append((to - forward) | (to << 6))
+        for to in iter_bits(double):
+            moves.append(
+                (to - 2 * forward) | (to << 6) | (MOVE_FLAG_DOUBLE_PUSH << 12)
+            )
 
-        return move
+        ep_file = self.en_passant[1 - turn]
+        ep_to = -1
+        if ep_file:
+            ep_to = (ep_file.bit_length() - 1) + (40 if turn == PieceColor.White else 16)
+        pawn_attacks = PAWN_ATTACKS[turn]
+        for from_i in iter_bits(pawns):
+            attacks = pawn_attacks[from_i]
+            for to in iter_bits(attacks & enemy):
+                if (1 << to) & last_rank:
+                    for flag in _promotion_flags:
+                        moves.append(from_i | (to << 6) | (flag << 12))
+                else:
+                    moves.append(from_i | (to << 6))
+            if ep_to >= 0 and attacks & (1 << ep_to):
+                moves.append(from_i | (ep_to << 6) | (MOVE_FLAG_EN_PASSANT << 12))
+
+        # everything else
+        not_own = ~own
+        for from_i in iter_bits(pieces[PieceType.Knight]):
+            for to in iter_bits(KNIGHT_ATTACKS[from_i] & not_own):
+                moves.append(from_i | (to << 6))
+        for from_i in iter_bits(pieces[PieceType.Bishop]):
+            for to in iter_bits(bishop_attacks(from_i, occ) & not_own):
+                moves.append(from_i | (to << 6))
+        for from_i in iter_bits(pieces[PieceType.Rook]):
+            for to in iter_bits(rook_attacks(from_i, occ) & not_own):
+                moves.append(from_i | (to << 6))
+        for from_i in iter_bits(pieces[PieceType.Queen]):
+            for to in iter_bits(queen_attacks(from_i, occ) & not_own):
+                moves.append(from_i | (to << 6))
+        king = pieces[PieceType.King]
+        if not king:
+            return moves
+        king_i = lsb(king)
+        for to in iter_bits(KING_ATTACKS[king_i] & not_own):
+            moves.append(king_i | (to << 6))
+
+        # castling, the square the king lands on gets checked when the move is made
+        rights = self.can_castle[turn]
+        if rights[Castling.Short] or rights[Castling.Long]:
+            rank_start = 0 if turn == PieceColor.White else 56
+            if king_i != rank_start + File.E or self.is_square_attacked(king_i, 1 - turn):
+                return moves
+            rook = self.pieces[turn][PieceType.Rook]
+            if (
+                rights[Castling.Short]
+                and rook & (1 << (rank_start + File.H))
+                and not occ & (0b01100000 << rank_start)
+                and not self.is_square_attacked(rank_start + File.F, 1 - turn)
+            ):
+                moves.append(
+                    king_i | ((rank_start + File.G) << 6) | (MOVE_FLAG_CASTLE << 12)
+                )
+            if (
+                rights[Castling.Long]
+                and rook & (1 << rank_start)
+                and not occ & (0b00001110 << rank_start)
+                and not self.is_square_attacked(rank_start + File.D, 1 - turn)
+            ):
+                moves.append(
+                    king_i | ((rank_start + File.C) << 6) | (MOVE_FLAG_CASTLE << 12)
+                )
+        return moves
+
+    def generate_legal_moves(self, turn: PieceColor) -> list[int]:
+        """Generates all the legal compact moves (see move.py) the given color can make"""
+        legal = []
+        for m in self.generate_pseudo_legal_moves(turn):
+            self.make_move(m, turn)
+            if not self.is_check(turn):
+                legal.append(m)
+            self.unmake_move()
+        return legal
 
     def get_covered_squares(
         self, turn: PieceColor, pos: SquarePosition, pawn_captures_only: bool = False
@@ -421,107 +809,145 @@ class Board:
         Note: This means that it excludes invalid captures (like a piece capturing its another piece of the same color) and potential captures. If you want all the covered squares, then use get_covered_squares which returns all the sqaures covered by the piece of a given color, position and type.
         Note: This also doesn't check for any checks that might happen when a piece is moved to a square.
         """
-        playable = set()
         p = self.get(pos)
         if not p:
             return set()
+        return {
+            SquarePosition.from_index(i)
+            for i in iter_bits(self._pseudo_targets(pos.to_index(), p.color, p.type))
+        }
 
-        forward = 1 if p.color == PieceColor.White else -1
-
-        dirs = _dirs.get(p.type) or get_pawn_dirs(color, pos, True, True)
-
-        # special case for king and pawn and the knight
-        if (
-            p.type == PieceType.King
-            or p.type == PieceType.Pawn
-            or p.type == PieceType.Knight
-        ):
-            for dir_ in dirs:
-                i = pos
-                try:
-                    i = SquarePosition(i.file + dir_[0], i.rank + dir_[1])
-                except Exception:
-                    continue
-                if self.get(i) and self.get(i).color == color:
-                    continue
-                if p.type == PieceType.Pawn:
-                    if abs(dir_[1]) == 2 and self.get(
-                        SquarePosition(i.file, i.rank - forward)
-                    ):
-                        continue
-
-                    if dir_[0] == 0 and self.get(i):
-                        continue
-                    if dir_[0] != 0 and (not self.get(i) or self.get(i).color == color):
-                        continue
-
-                playable.add(i)
-            return playable
-
-        for dir_ in dirs:
-            i = pos
-            # god i should really make an iterator for this
-            while True:
-                try:
-                    i = SquarePosition(i.file + dir_[0], i.rank + dir_[1])
-                except Exception as _:
-                    break
+    def _pseudo_targets(self, i: int, color: PieceColor, ptype: PieceType) -> int:
+        """Bitboard version of get_raw_playable_moves for the piece at index i (castling and en passant not included)"""
+        own = self.occupancy[color]
+        match ptype:
+            case PieceType.Pawn:
+                single, double = pawn_pushes(color, 1 << i, ~self.occupied & FULL)
+                return (
+                    single | double | PAWN_ATTACKS[color][i] & self.occupancy[1 - color]
+                )
+            case PieceType.Knight:
+                return KNIGHT_ATTACKS[i] & ~own
+            case PieceType.King:
+                return KING_ATTACKS[i] & ~own
+            case PieceType.Bishop:
+                return bishop_attacks(i, self.occupied) & ~own
+            case PieceType.Rook:
+                return rook_attacks(i, self.occupied) & ~own
+            case PieceType.Queen:
+                return queen_attacks(i, self.occupied) & ~own
+        return 0
 
-                if self.get(i) and self.get(i).color == color:
-                    break
-                playable.add(i)
-                if self.get(i) and self.get(i).color != color:
-                    break
-        return playable
+    def attacks_mask(self, color: PieceColor, include_pawns: bool = True) -> int:
+        """
+        Returns a bitboard of all the squares attacked by the pieces of the given color. This includes squares which are occupied by pieces of the same color.
+        """
+        p = self.pieces[color]
+        occ = self.occupied
+        mask = 0
+        if include_pawns:
+            for i in iter_bits(p[PieceType.Pawn]):
+                mask |= PAWN_ATTACKS[color][i]
+        for i in iter_bits(p[PieceType.Knight]):
+            mask |= KNIGHT_ATTACKS[i]
+        for i in iter_bits(p[PieceType.King]):
+            mask |= KING_ATTACKS[i]
+        for i in iter_bits(p[PieceType.Bishop] | p[PieceType.Queen]):
+            mask |= bishop_attacks(i, occ)
+        for i in iter_bits(p[PieceType.Rook] | p[PieceType.Queen]):
+            mask |= rook_attacks(i, occ)
+        return mask
+
+    def is_square_attacked(self, i: int, by: PieceColor) -> bool:
+        """Checks if the square at index i is attacked by any piece of the given color"""
+        p = self.pieces[by]
+        if KNIGHT_ATTACKS[i] & p[PieceType.Knight]:
+            return True
+        # the squares from which a pawn could attack us are the ones an opposite colored pawn on our square would attack
+        if PAWN_ATTACKS[1 - by][i] & p[PieceType.Pawn]:
+            return True
+        if KING_ATTACKS[i] & p[PieceType.King]:
+            return True
+        occ = self.occupied
+        queens = p[PieceType.Queen]
+        if bishop_attacks(i, occ) & (p[PieceType.Bishop] | queens):
+            return True
+        if rook_attacks(i, occ) & (p[PieceType.Rook] | queens):
+            return True
+        return False
 
     def get_all_covered_squares(self, color: PieceColor, pawn_captures_only: bool):
         """
         Gets all the squares which are covered by the pieces of the given color. This includes squares of potential captures (that is, squares which already contian a piece of the same color, but is protected by another piece of the same color).
         """
-        s = set()
-        for i, p in enumerate(self.config):
-            if p is None or p.color != color:
-                continue
-            s |= self.get_covered_squares(
-                color,
-                SquarePosition.from_index(i),
-                pawn_captures_only=pawn_captures_only,
-            )
+        mask = self.attacks_mask(color, include_pawns=pawn_captures_only)
+        if not pawn_captures_only:
+            # same as get_covered_squares, the pawns cover the squares they can be pushed to instead of the ones they capture on
+            single, double = pawn_pushes(color, self.pieces[color][PieceType.Pawn], FULL)
+            mask |= single | double
 
-        return s
+        return {SquarePosition.from_index(i) for i in iter_bits(mask)}
 
     def is_check(self, turn: PieceColor) -> bool:
         """
         Checks if the king of the given color is in check
         """
-        s = self.get_all_covered_squares(1 - turn, True)
-        our_king = None
-        for i, v in enumerate(self.config):
-            if v is None or v.color != turn or v.type != PieceType.King:
-                continue
-            our_king = SquarePosition.from_index(i)
-        return our_king in s
+        king = self.pieces[turn][PieceType.King]
+        if not king:
+            return False
+        return self.is_square_attacked(lsb(king), 1 - turn)
 
     def has_valid_moves(self, turn: PieceColor) -> bool:
-        saved_state = self.copy()
-        for i, v in enumerate(self.config):
-            if not v or v.color != turn:
-                continue
-            from_ = SquarePosition.from_index(i)
-            playable_moves = self.get_raw_playable_moves(turn, from_, v.type)
-            for to in playable_moves:
-                self._move_raw(from_, to)
-                in_check = self.is_check(turn)
-
-                self.config = saved_state.config.copy()
-                self.en_passant = saved_state.en_passant.copy()
-                self.can_castle = saved_state.can_castle.copy()
-
-                if in_check:
-                    continue
+        for m in self.generate_pseudo_legal_moves(turn):
+            self.make_move(m, turn)
+            in_check = self.is_check(turn)
+            self.unmake_move()
+            if not in_check:
                 return True
         return False
 
+    def insufficient_material(self) -> bool:
+        """
+        Returns True if neither side can possibly checkmate with the material on the board. Thats the case when there are only:
+            - The 2 Kings
+            - The 2 Kings and a Bishop or a Knight
+            - The 2 Kings and any number of Bishops, as long as all of them are on the same square color
+        """
+        white = self.pieces[PieceColor.White]
+        black = self.pieces[PieceColor.Black]
+        for ptype in (PieceType.Pawn, PieceType.Rook, PieceType.Queen):
+            if white[ptype] or black[ptype]:
+                return False
+
+        knights = white[PieceType.Knight] | black[PieceType.Knight]
+        bishops = white[PieceType.Bishop] | black[PieceType.Bishop]
+        minors = (knights | bishops).bit_count()
+        if minors <= 1:
+            return True
+        if knights:
+            return False
+        return not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES
+
+    def probe_tablebase(self, turn: PieceColor):
+        """
+        Looks the position up in the endgame tablebases (see tablebase.py), the table of the material is only opened the first time it's needed.
+        RETURNS: (1 if the side to move wins, 0 for a draw or -1 if it loses, plies until mate), or None if there is no table for the position
+        """
+        if self.occupied.bit_count() > tablebase.MAX_PIECES:
+            return None
+        # the tables don't know about castling or enpassant
+        if self._en_passant_key() or any(
+            allowed for rights in self.can_castle.values() for allowed in rights.values()
+        ):
+            return None
+        pieces = [
+            (color, ptype, i)
+            for color in PieceColor
+            for ptype in PieceType
+            for i in iter_bits(self.pieces[color][ptype])
+        ]
+        return tablebase.probe(pieces, turn)
+
     def is_checkmate(self, turn: PieceColor) -> bool:
         return self.is_check(turn) and not self.has_valid_moves(turn)
 
@@ -542,347 +968,24 @@ class Board:
         p = self.get(pos)
         return p is not None and p.color == turn and p.type == ptype
 
-    def is_en_passant(self, turn, to, from_):
-        if not to.rank == (6 if turn == PieceColor.White else 3):
-            return False
-        cap_pos = SquarePosition(
-            to.file, to.rank + (-1 if turn == PieceColor.White else 1)
-        )
-
-        return (
-            from_.file is not None
-            and self.get(to) is None
-            and abs(from_.file - to.file) == 1
-            and 1 << to.file == self.en_passant[1 - turn]
-            and self.is_proper_piece(1 - turn, PieceType.Pawn, cap_pos)
-        )
-
     def get(self, pos: SquarePosition):
         return self.config[pos.to_index()]
 
-    def _get_pawn_which_can_move_to(
-        self,
-        turn,
-        to: SquarePosition,
-        from_: None | SquarePosition = None,
-        ptype: PieceType = PieceType.Pawn,
-        is_capture: bool = False,
-    ):
-        avail = []
-        if self.get(to) is not None and not (is_capture):
-            return []
-        if turn == PieceColor.White:
-            start = to.to_index()
-            end = SquarePosition(to.file, 1).to_index()
-            inc = -8
-            init_sq = SquarePosition(to.file, 2)
-        else:
-            start = to.to_index()
-            end = SquarePosition(to.file, 8).to_index()
-            inc = 8
-            init_sq = SquarePosition(to.file, 7)
-
-        if is_capture:
-            if not from_:
-                return []
-            if self.is_en_passant(turn, to, from_):
-                from_.rank = 5 if turn == PieceColor.White else 4
-                avail.append(from_)
-                return avail
-
-            # these conditions dont apply to en passant
-            if not (self.get(to) and self.get(to).color != turn):
-                return []
-
-            if from_.is_partial():
-                if not from_.file:
-                    return []  # invalid notation (i think??)
-                if abs(from_.file - to.file) != 1:
-                    return []  # attempting to capture at file which isnt adjacent
-                try:
-                    p = SquarePosition(File(from_.file), to.rank + sign(inc))
-                except Exception as _e:
-                    return []
-                piece = self.get(p)
-                if piece and piece.type == ptype and piece.color == turn:
-                    avail.append(p)
-                return avail
-            else:
-                if abs(from_.rank - to.rank) != 1 or abs(from_.file - to.file) != 1:
-                    return []
-                avail.append(from_)
-                return avail
-
-        for i in range(start, end + 1, inc):
-            p1 = SquarePosition.from_index(i)
-            p = self.get(p1)
-            if not p or p.color != turn or p.type != PieceType.Pawn:
-                continue
-            dist = abs(p1.rank - to.rank)
-            if not (dist == 1 or dist == 2 and p1.rank == init_sq.rank):
-                continue
-            avail.append(p1)
-            break  # break because theres no way any other pawn can also go to the same rank if theyre on the same file
-        return avail
-
-    def _get_knight_which_can_move_to(
-        self,
-        turn,
-        to: SquarePosition,
-        from_: None | SquarePosition = None,
-        ptype: PieceType = PieceType.Knight,
-        is_capture: bool = False,
-    ):
-        # TODO: Add parital move functionality
-        avail = []
-
-        possible_dists = [
-            (-1, 2),
-            (-1, -2),
-            (1, 2),
-            (1, -2),
-            (-2, 1),
-            (-2, -1),
-            (2, 1),
-            (2, -1),
-        ]
-
-        def is_valid_start_pos(pos):
-            dist = (pos.file - to.file, pos.rank - to.rank)
-            return dist in possible_dists
-
-        if self.get(to) and (not is_capture or not self.get(to).color != turn):
-            return []
-        if (
-            from_
-            and self.is_proper_piece(turn, PieceType.Knight, from_)
-            and is_valid_start_pos(from_)
-        ):
-            avail.append(from_)
-
-        for dist in possible_dists:
-            try:
-                p1 = SquarePosition(File(to.file + dist[0]), to.rank + dist[1])
-            except Exception as _:
-                continue
-
-            if not self.is_proper_piece(turn, PieceType.Knight, p1):
-                continue
-            avail.append(p1)
-        return avail
-
-    def _get_rook_which_can_move_to(
-        self,
-        turn,
-        to: SquarePosition,
-        from_: None | SquarePosition = None,
-        ptype: PieceType = PieceType.Rook,
-        is_capture: bool = False,
-    ):
-        avail = []
-
-        def is_clear(start_pos):
-            spi = start_pos.to_index()
-            epi = to.to_index()
-            s = min(spi, epi)
-            e = max(spi, epi)
-            if start_pos.rank == to.rank:
-                # we need to check horizontally
-                inc = 1
-            else:
-                # else check veritcally
-                inc = 8
-            for i in range(s, e, inc):
-                if self.config[i] and (not is_capture or self.config[i].color == turn):
-                    return False
-            return True
-
-        if not from_:
-            # left to right, right to left, top to bottom ,bottom to top
-            for dir_ in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-                if dir_[1] == 0:
-                    if dir_[0] > 0:
-                        inc = 1
-                        start, end = (
-                            SquarePosition(File.A, to.rank).to_index(),
-                            to.to_index() + 1,
-                        )
-                    else:
-                        inc = -1
-                        start, end = (
-                            SquarePosition(File.H, to.rank).to_index(),
-                            to.to_index() - 1,
-                        )
-                else:
-                    if dir_[1] > 0:
-                        inc = -8
-                        start, end = (
-                            SquarePosition(to.file, 8).to_index(),
-                            to.to_index() - 8,
-                        )
-                    else:
-                        inc = 8
-                        start, end = (
-                            SquarePosition(to.file, 1).to_index(),
-                            to.to_index() + 8,
-                        )
-
-                for i in range(start, end - inc, inc):
-                    piece_to_move = SquarePosition.from_index(i)
-                    if not self.is_proper_piece(turn, ptype, piece_to_move):
-                        continue
-
-                    pos_to_check_from = SquarePosition.from_index(i + inc)
-                    if is_clear(pos_to_check_from):
-                        avail.append(piece_to_move)
-
-        elif from_.is_partial():
-            # TODO: make this more pleasing to look at
-            if not from_.rank:  # if hint given is a file
-                if from_.file == to.file:
-                    for r in range(1, 9):
-                        piece_pos = SquarePosition(from_.file, r)
-                        pos_to_check_from = SquarePosition(
-                            from_.file, to.rank + sign(to.rank - r)
-                        )
-                        if self.is_proper_piece(turn, ptype, piece_pos) and is_clear(
-                            pos_to_check_from
-                        ):
-                            avail.append(piece_pos)
-                else:
-                    piece_pos = SquarePosition(from_.file, to.rank)
-                    pos_to_check_from = SquarePosition(
-                        from_.file + sign(to.file - from_.file), to.rank
-                    )
-                    if self.is_proper_piece(turn, ptype, piece_pos) and is_clear(
-                        pos_to_check_from
-                    ):
-                        avail.append(piece_pos)
-            else:  # if hint is rank
-                if from_.rank == to.rank:
-                    for f in range(File.A, File.H + 1):
-                        piece_pos = SquarePosition(f, from_.rank)
-                        pos_to_check_from = SquarePosition(
-                            f + sign(to.file - f), to.rank
-                        )
-                        if self.is_proper_piece(turn, ptype, piece_pos) and is_clear(
-                            pos_to_check_from
-                        ):
-                            avail.append(piece_pos)
-                else:
-                    piece_pos = SquarePosition(to.file, from_.rank)
-                    pos_to_check_from = SquarePosition(
-                        f, from_.rank + sign(to.rank - from_.rank)
-                    )
-                    if self.is_proper_piece(turn, ptype, piece_pos) and is_clear(
-                        pos_to_check_from
-                    ):
-                        avail.append(piece_pos)
-        else:
-            if from_.file == to.file:
-                if from_.rank > to.rank:
-                    inc = -8
-                else:
-                    inc = 8
-            else:
-                if from_.file > to.file:
-                    inc = 1
-                else:
-                    inc = -1
-            p = self.get(from_)
-            pos_to_check_from = SquarePosition.from_index(from_.to_index() + inc)
-            if self.is_proper_piece(turn, ptype, p) and is_clear(pos_to_check_from):
-                avail.append(from_)
-        return avail
-
-    def _get_bishop_which_can_move_to(
-        self,
-        turn,
-        to: SquarePosition,
-        from_: None | SquarePosition = None,
-        ptype: PieceType = PieceType.Bishop,
-        is_capture: bool = False,
-    ):
-        avail = set()
-        dirs = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        def is_valid_start_pos(start_pos):
-            dir_ = (sign(start_pos.file - to.file), sign(start_pos.rank - to.rank))
-            num_iters = min(
-                abs(start_pos.file - to.file), abs(start_pos.rank - to.rank)
-            )
-            if num_iters == 0:
-                return False
-            p = SquarePosition(File(start_pos.file - dir_[0]), start_pos.rank - dir_[1])
-            for _ in range(num_iters):
-                if p.file == to.file and p.rank == to.rank:
-                    return True
-                if self.get(p) and (not is_capture or self.get(p).color == turn):
-                    return False
-                p = SquarePosition(File(p.file - dir_[0]), p.rank - dir_[1])
-            return False
-
-        if not from_:
-            for dir_ in dirs:
-                p = to
-                end_file = File.H if dir_[0] > 0 else File.A
-                end_rank = 1 if dir_[1] < 0 else 8
-                num_iters = min(abs(end_file - p.file), abs(end_rank - p.rank))
-                for _ in range(num_iters):
-                    try:
-                        p = SquarePosition(File(p.file + dir_[0]), p.rank + dir_[1])
-                    except Exception:
-                        break
-
-                    piece = self.get(p)
-
-                    if not piece:
-                        continue
-                    if piece.color != turn or piece.type != ptype:
-                        break
-                    avail.add(p)
-                    break
-        elif from_.is_partial():
-            if from_.file:
-                # We will only have two possible position to get to the destination if we're giving the src file
-                dist = abs(to.file - from_.file)
-                poss = ((from_.file, to.rank + dist), (from_.file, to.rank - dist))
-                for pos in poss:
-                    if pos[1] <= 0 or pos[1] >= 9:
-                        continue
-                    f = SquarePosition(pos[0], pos[1])
-                    if (
-                        not self.get(f)
-                        or self.get(f).type != ptype
-                        or self.get(f).color != turn
-                    ):
-                        continue
-                    if is_valid_start_pos(f):
-                        avail.add(f)
-
-            else:
-                # same explaination as above but for ranks
-                dist = abs(to.rank - from_.rank)
-                files = (dist, 8 - dist)
-                for file in files:
-                    f = SquarePosition(f, from_.rank)
-                    if (
-                        not self.get(f)
-                        or self.get(f).type != ptype
-                        or self.get(f).color != turn
-                    ):
-                        continue
-                    if is_valid_start_pos(f):
-                        avail.add(f)
-
-        elif is_valid_start_pos(from_):
-            avail.add(from_)
-
-        return list(avail)
-
     def copy(self):
         newb = Board()
-        newb.config = self.config.copy()
-        newb.can_castle = self.can_castle.copy()
-        newb.en_passant = self.en_passant.copy()
+        newb._restore(self)
         return newb
+
+    def _restore(self, other):
+        """Makes this board hold the same position as the other board"""
+        self._config = other._config.copy()
+        self.pieces = [other.pieces[0].copy(), other.pieces[1].copy()]
+        self.occupancy = other.occupancy.copy()
+        self.occupied = other.occupied
+        self.can_castle = {
+            color: rights.copy() for color, rights in other.can_castle.items()
+        }
+        self.en_passant = other.en_passant.copy()
+        self._undo = other._undo.copy()
+        self.zobrist = other.zobrist
+        self.halfmove_clock = other.halfmove_clock
@@ -0,0 +1,168 @@
+"""
+Reader for opening books in the Polyglot (.bin) format.
+A book is a sorted array of 16 byte big endian entries: the polyglot key of a position (see Board.polyglot_key), a move, its weight and 4 bytes of learning data which are ignored.
+The file is memory mapped and binary searched in place, so opening even a huge book doesn't read it, and a probe only touches the few pages the search lands on.
+"""
+
+import mmap
+import random
+import struct
+from collections import Counter
+
+from move import (
+    MOVE_FLAG_CASTLE,
+    MOVE_FLAG_PROMOTION_KNIGHT,
+    move_flag,
+    move_from,
+    move_to,
+)
+from piece import PieceColor
+from game import Game
+
+ENTRY_SIZE = 16
+_ENTRY = struct.Struct(">QHHI")
+_KEY = struct.Struct(">Q")
+
+
+def to_polyglot_move(m: int) -> int:
+    """
+    Converts a compact move (see move.py) to the way polyglot writes moves: to | from << 6 | promotion << 12, the promotion going from 1 for a knight to 4 for a queen.
+    Castling is written as the king taking its own rook.
+    """
+    from_i = move_from(m)
+    to_i = move_to(m)
+    flag = move_flag(m)
+    if flag == MOVE_FLAG_CASTLE:
+        to_i = from_i + 3 if to_i > from_i else from_i - 4
+    promotion = flag - MOVE_FLAG_PROMOTION_KNIGHT + 1 if flag >= MOVE_FLAG_PROMOTION_KNIGHT else 0
+    return to_i | from_i << 6 | promotion << 12
+
+
+class OpeningBook:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = self._file.seek(0, 2)
+        # an empty file can't be mapped, it is just a book without entries
+        self._mm = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+        self._n = size // ENTRY_SIZE
+
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return self._n
+
+    def _first(self, key: int) -> int:
+        """RETURNS: index of the first entry with a key not lower than the given one"""
+        lo, hi = 0, self._n
+        mm = self._mm
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _KEY.unpack_from(mm, mid * ENTRY_SIZE)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def entries(self, key: int) -> list[tuple[int, int]]:
+        """RETURNS: (polyglot move, weight) of every entry of the position with the polyglot key"""
+        self.probes += 1
+        res = []
+        i = self._first(key)
+        while i < self._n:
+            k, move, weight, _learn = _ENTRY.unpack_from(self._mm, i * ENTRY_SIZE)
+            if k != key:
+                break
+            res.append((move, weight))
+            i += 1
+        if res:
+            self.hits += 1
+        return res
+
+    def moves(self, board, turn: PieceColor) -> list[tuple[int, int]]:
+        """RETURNS: (compact move, weight) of the book moves in the position, moves which aren't legal (books can be wrong or be hit by a hash collision) are left out"""
+        entries = self.entries(board.polyglot_key(turn))
+        if not entries:
+            return []
+        legal = {to_polyglot_move(m): m for m in board.generate_legal_moves(turn)}
+        return [(legal[pm], w) for pm, w in entries if pm in legal]
+
+    def choose(self, board, turn: PieceColor, rng=random) -> None | int:
+        """Picks one of the book moves, the more weight a move has the likelier it gets picked. RETURNS: the compact move, or None if the position isn't in the book"""
+        moves = [(m, w) for m, w in self.moves(board, turn) if w > 0]
+        if not moves:
+            return None
+        return rng.choices([m for m, _ in moves], [w for _, w in moves])[0]
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def write_book(path: str, entries: list[tuple[int, int, int]]):
+    """Writes (polyglot key, polyglot move, weight) entries as a polyglot book, sorted the way readers expect"""
+    with open(path, "wb") as f:
+        for key, move, weight in sorted(entries):
+            f.write(_ENTRY.pack(key, move, weight, 0))
+
+
+def read_openings(path: str) -> list[tuple[str, str, list[int]]]:
+    """Reads a file of openings, one per line as ECO code, name and SAN moves separated by tabs. RETURNS: (ECO code, name, compact moves) of every opening"""
+    res = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            eco, name, moves = line.split("\t")
+            g = Game()
+            if not g.play_san_str(moves):
+                raise ValueError(f"Invalid moves in the opening {eco} {name}: {moves}")
+            res.append((eco, name, g.move_codes))
+    return res
+
+
+def opening_names(path: str) -> dict:
+    """RETURNS: position key (see Board.position_key) -> "ECO name" of the position each opening of the file ends in"""
+    names = {}
+    for eco, name, codes in read_openings(path):
+        g = Game()
+        g.play_moves(codes)
+        names.setdefault(g.board.position_key(g.turn), f"{eco} {name}")
+    return names
+
+
+def build_book(openings_path: str, book_path: str) -> int:
+    """
+    Writes a polyglot book with every move of the openings in the file, weighted by how many of the openings play it. RETURNS: the number of entries
+    """
+    counts = Counter()
+    for _eco, _name, codes in read_openings(openings_path):
+        g = Game()
+        for m in codes:
+            counts[(g.board.polyglot_key(g.turn), to_polyglot_move(m))] += 1
+            g.play_moves([m])
+    write_book(book_path, [(key, move, n) for (key, move), n in counts.items()])
+    return len(counts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Builds a polyglot opening book from a file of openings"
+    )
+    parser.add_argument("openings", nargs="?", default="assets/openings.tsv")
+    parser.add_argument("book", nargs="?", default="assets/book.bin")
+    args = parser.parse_args()
+    print(f"Wrote {build_book(args.openings, args.book)} entries to {args.book}")
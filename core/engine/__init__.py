@@ -0,0 +1,15 @@
+"""
+A small chess engine to play against: alpha-beta search on the bitboards of core/board.py, with a transposition table and a material plus piece-square table evaluation.
+"""
+
+from .evaluate import PIECE_VALUES, evaluate
+from .search import (
+    DIFFICULTIES,
+    MATE_SCORE,
+    MAX_PLY,
+    SearchResult,
+    SearchTimeout,
+    Searcher,
+    search_fen,
+)
+from .tt import TranspositionTable
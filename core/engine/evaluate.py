@@ -0,0 +1,147 @@
+"""
+Static evaluation of a position: material plus piece-square tables (how good it is for a piece to stand on each square).
+The tables are the ones of the "Simplified Evaluation Function", with a second king table for the endgame where the king should come to the center.
+"""
+
+from piece import PieceColor, PieceType
+from bitboard import iter_bits, popcount
+
+PIECE_VALUES = [0, 100, 320, 500, 330, 20000, 900]  # indexed by PieceType
+
+# fmt: off
+# As seen from white's side, the first row is the 8th rank
+_PAWN = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0,
+]
+_KNIGHT = [
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50,
+]
+_BISHOP = [
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20,
+]
+_ROOK = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0,
+]
+_QUEEN = [
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+     -5,  0,  5,  5,  5,  5,  0, -5,
+      0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20,
+]
+_KING = [
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+     20, 20,  0,  0,  0,  0, 20, 20,
+     20, 30, 10,  0,  0, 10, 30, 20,
+]
+_KING_ENDGAME = [
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50,
+]
+# fmt: on
+
+
+def _tables(table: list[int], value: int) -> list[list[int]]:
+    """
+    Value of the piece on each square (by board index, 0 being A1) for both colors.
+    The tables above are drawn with the 8th rank first, so for white the rank is flipped (i ^ 56) and black uses them as they are.
+    """
+    return [
+        [value + table[i ^ 56] for i in range(64)],
+        [value + table[i] for i in range(64)],
+    ]
+
+
+# PST[ptype][color][square], with the value of the piece included
+PST = [None] * 7
+PST[PieceType.Pawn] = _tables(_PAWN, PIECE_VALUES[PieceType.Pawn])
+PST[PieceType.Knight] = _tables(_KNIGHT, PIECE_VALUES[PieceType.Knight])
+PST[PieceType.Bishop] = _tables(_BISHOP, PIECE_VALUES[PieceType.Bishop])
+PST[PieceType.Rook] = _tables(_ROOK, PIECE_VALUES[PieceType.Rook])
+PST[PieceType.Queen] = _tables(_QUEEN, PIECE_VALUES[PieceType.Queen])
+PST[PieceType.King] = _tables(_KING, 0)
+KING_ENDGAME = _tables(_KING_ENDGAME, 0)
+
+_NON_KING = [
+    PieceType.Pawn,
+    PieceType.Knight,
+    PieceType.Bishop,
+    PieceType.Rook,
+    PieceType.Queen,
+]
+
+
+def is_endgame(board) -> bool:
+    """No queens, or a queen with at most one minor piece beside it"""
+    for color in PieceColor:
+        p = board.pieces[color]
+        if p[PieceType.Queen] and (
+            p[PieceType.Rook]
+            or popcount(p[PieceType.Knight] | p[PieceType.Bishop]) > 1
+        ):
+            return False
+    return True
+
+
+def evaluate(board, turn: PieceColor) -> int:
+    """RETURNS: the score of the position in centipawns, from the point of view of the side to move"""
+    score = 0
+    for color in PieceColor:
+        pieces = board.pieces[color]
+        s = 0
+        for ptype in _NON_KING:
+            table = PST[ptype][color]
+            for i in iter_bits(pieces[ptype]):
+                s += table[i]
+        score += s if color == PieceColor.White else -s
+
+    king_tables = KING_ENDGAME if is_endgame(board) else PST[PieceType.King]
+    for color in PieceColor:
+        king = board.pieces[color][PieceType.King]
+        if king:
+            v = king_tables[color][king.bit_length() - 1]
+            score += v if color == PieceColor.White else -v
+
+    return score if turn == PieceColor.White else -score
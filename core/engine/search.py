@@ -0,0 +1,427 @@
+import threading
+import time
+
+import tablebase
+from piece import PieceColor
+from move import MOVE_FLAG_EN_PASSANT, MOVE_FLAG_PROMOTION_KNIGHT, MOVE_FLAG_PROMOTION_QUEEN
+
+from .evaluate import PIECE_VALUES, evaluate
+from .tt import EXACT, LOWER, UPPER, TranspositionTable
+
+MATE_SCORE = 100_000
+MAX_PLY = 64
+INF = 1_000_000
+
+# How often (in nodes) the time and node limits are checked
+_CHECK_EVERY = 1024
+
+# Rough value of the pieces for ordering captures, most valuable victim first then least valuable attacker
+_ORDER_VALUE = [0, 1, 3, 5, 3, 10, 9]  # indexed by PieceType
+
+# The limits of the search for each level of the bot, the lower levels mostly see less far ahead
+DIFFICULTIES = {
+    "easy": {"time_limit": 0.5, "max_nodes": 2_000, "max_depth": 2},
+    "medium": {"time_limit": 1.5, "max_nodes": 30_000, "max_depth": 4},
+    "hard": {"time_limit": 4.0, "max_nodes": None, "max_depth": MAX_PLY},
+}
+
+_TT_MOVE = 1_000_000
+_CAPTURE = 100_000
+_PROMOTION = 90_000
+_KILLER = 80_000
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when it runs out of time or nodes, the result of the last finished iteration is used"""
+
+
+class SearchResult:
+    def __init__(
+        self,
+        move: None | int,
+        score: int,
+        depth: int,
+        nodes: int,
+        elapsed: float,
+        pv: list[int],
+    ):
+        self.move = move  # compact move, None if there are no legal moves
+        self.score = score  # centipawns for the side to move
+        self.depth = depth  # of the last iteration which finished
+        self.nodes = nodes
+        self.elapsed = elapsed  # seconds
+        self.pv = pv  # the line the search expects to be played
+
+    def mate_in(self) -> None | int:
+        """RETURNS: in how many moves the side to move mates (negative if it gets mated), or None if the search didn't find a mate"""
+        if abs(self.score) < MATE_SCORE - MAX_PLY:
+            return None
+        plies = MATE_SCORE - abs(self.score)
+        moves = (plies + 1) // 2
+        return moves if self.score > 0 else -moves
+
+    def __repr__(self):
+        return f"SearchResult(move={self.move}, score={self.score}, depth={self.depth}, nodes={self.nodes}, elapsed={self.elapsed:.3f})"
+
+
+class Searcher:
+    """
+    Iterative deepening alpha-beta (principal variation search) on a Board, with a quiescence search on captures at the leaves.
+    Moves are tried best first: the move from the transposition table, then captures by most valuable victim and least valuable attacker, then killer moves and the history heuristic.
+    The search stops when it runs out of time or nodes, checked every _CHECK_EVERY nodes, and returns what the last finished iteration found.
+    `history` are the position keys (see Board.position_key) of the game before the root, getting back to one of them counts as a draw.
+    `stop` can be anything with an is_set method (like a threading or multiprocessing Event), setting it stops the search the same way running out of time does.
+    """
+
+    def __init__(
+        self,
+        board,
+        turn: PieceColor,
+        tt: None | TranspositionTable = None,
+        time_limit: None | float = None,
+        max_nodes: None | int = None,
+        max_depth: int = MAX_PLY,
+        history=(),
+        stop=None,
+    ):
+        self.board = board
+        self.turn = int(turn)
+        self.tt = tt or TranspositionTable()
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.max_depth = min(max_depth, MAX_PLY)
+        self.stop = stop
+
+        self._seen = set(history)
+        self._path = set()  # keys of the positions on the line being searched
+        self._killers = [[None, None] for _ in range(MAX_PLY + 2)]
+        self._history = {}  # quiet move (with the color) -> how often it caused a cutoff, weighted by depth
+        self._deadline = None
+        self._root_best = None
+
+        self.nodes = 0
+
+    def search(self) -> SearchResult:
+        start = time.perf_counter()
+        self._deadline = start + self.time_limit if self.time_limit else None
+        self.tt.new_search()
+        b = self.board
+        undo_depth = len(b._undo)
+
+        root_moves = b.generate_legal_moves(self.turn)
+        if not root_moves:
+            score = -MATE_SCORE if b.is_check(self.turn) else 0
+            return SearchResult(None, score, 0, 0, 0.0, [])
+
+        best_move, best_score, depth_done = root_moves[0], 0, 0
+        try:
+            for depth in range(1, self.max_depth + 1):
+                self._root_best = None
+                try:
+                    score = self._root(depth, root_moves)
+                except SearchTimeout:
+                    # the moves are searched best first, so a move found in the unfinished iteration is still the better guess
+                    if self._root_best is not None:
+                        best_move, best_score = self._root_best
+                    break
+                best_move, best_score, depth_done = self._root_best[0], score, depth
+
+                if abs(score) >= MATE_SCORE - MAX_PLY or len(root_moves) == 1:
+                    break
+                # the next iteration takes a few times longer than this one, no point starting it if it can't finish
+                if self._deadline and time.perf_counter() - start > (
+                    self._deadline - start
+                ) / 2:
+                    break
+        finally:
+            while len(b._undo) > undo_depth:
+                b.unmake_move()
+            self._path.clear()
+
+        return SearchResult(
+            best_move,
+            best_score,
+            depth_done,
+            self.nodes,
+            time.perf_counter() - start,
+            self._pv(best_move, depth_done),
+        )
+
+    def _check_limits(self):
+        if self.max_nodes and self.nodes >= self.max_nodes:
+            raise SearchTimeout()
+        if self._deadline and time.perf_counter() >= self._deadline:
+            raise SearchTimeout()
+        if self.stop is not None and self.stop.is_set():
+            raise SearchTimeout()
+
+    def _root(self, depth: int, root_moves: list[int]) -> int:
+        b = self.board
+        turn = self.turn
+        key = b.position_key(turn)
+        entry = self.tt.get(key)
+        root_moves.sort(
+            key=lambda m: self._move_order(m, entry[3] if entry else None, 0, turn),
+            reverse=True,
+        )
+
+        alpha, beta = -INF, INF
+        self._path.add(key)
+        for i, m in enumerate(root_moves):
+            b.make_move(m, turn)
+            if i == 0:
+                score = -self._negamax(depth - 1, -beta, -alpha, 1, 1 - turn)
+            else:
+                score = -self._negamax(depth - 1, -alpha - 1, -alpha, 1, 1 - turn)
+                if score > alpha:
+                    score = -self._negamax(depth - 1, -beta, -alpha, 1, 1 - turn)
+            b.unmake_move()
+            if score > alpha:
+                alpha = score
+                self._root_best = (m, score)
+        self._path.discard(key)
+
+        self.tt.put(key, depth, alpha, EXACT, self._root_best[0])
+        return alpha
+
+    def _negamax(self, depth: int, alpha: int, beta: int, ply: int, turn: int) -> int:
+        self.nodes += 1
+        if self.nodes % _CHECK_EVERY == 0:
+            self._check_limits()
+
+        b = self.board
+        key = b.position_key(turn)
+        if key in self._path or key in self._seen or b.halfmove_clock >= 100:
+            return 0
+
+        # few enough pieces left for the tablebases to know the exact result
+        if b.occupied.bit_count() <= tablebase.MAX_PIECES:
+            tb = b.probe_tablebase(turn)
+            if tb is not None:
+                wdl, plies = tb
+                return wdl * (MATE_SCORE - ply - plies)
+
+        in_check = b.is_check(turn)
+        if in_check:
+            depth += 1  # dont stop searching in the middle of a check
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(alpha, beta, ply, turn)
+
+        alpha_orig = alpha
+        tt_move = None
+        entry = self.tt.get(key)
+        if entry:
+            e_depth, e_score, e_flag, tt_move = entry
+            if e_depth >= depth:
+                e_score = _score_from_tt(e_score, ply)
+                if e_flag == EXACT:
+                    return e_score
+                if e_flag == LOWER:
+                    alpha = max(alpha, e_score)
+                else:
+                    beta = min(beta, e_score)
+                if alpha >= beta:
+                    return e_score
+
+        moves = b.generate_pseudo_legal_moves(turn)
+        moves.sort(key=lambda m: self._move_order(m, tt_move, ply, turn), reverse=True)
+
+        self._path.add(key)
+        best, best_move = -INF, None
+        legal = 0
+        for m in moves:
+            b.make_move(m, turn)
+            if b.is_check(turn):
+                b.unmake_move()
+                continue
+            legal += 1
+            if legal == 1:
+                score = -self._negamax(depth - 1, -beta, -alpha, ply + 1, 1 - turn)
+            else:
+                score = -self._negamax(depth - 1, -alpha - 1, -alpha, ply + 1, 1 - turn)
+                if alpha < score < beta:
+                    score = -self._negamax(depth - 1, -beta, -alpha, ply + 1, 1 - turn)
+            b.unmake_move()
+
+            if score > best:
+                best, best_move = score, m
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not self._is_tactical(m, turn):
+                    self._remember_cutoff(m, depth, ply, turn)
+                break
+        self._path.discard(key)
+
+        if legal == 0:
+            return -(MATE_SCORE - ply) if in_check else 0
+
+        if best <= alpha_orig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.put(key, depth, _score_to_tt(best, ply), flag, best_move)
+        return best
+
+    def _quiesce(self, alpha: int, beta: int, ply: int, turn: int) -> int:
+        """Only looks at captures and promotions until the position is quiet, so the evaluation isn't taken in the middle of an exchange"""
+        self.nodes += 1
+        if self.nodes % _CHECK_EVERY == 0:
+            self._check_limits()
+
+        b = self.board
+        stand_pat = evaluate(b, turn)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        config = b.config
+        captures = []
+        for m in b.generate_pseudo_legal_moves(turn):
+            to_i = (m >> 6) & 63
+            flag = m >> 12
+            victim = config[to_i]
+            if victim is not None:
+                # delta pruning, even winning the piece for free wouldn't get the score up to alpha
+                if (
+                    flag < MOVE_FLAG_PROMOTION_KNIGHT
+                    and stand_pat + PIECE_VALUES[victim.type] + 200 < alpha
+                ):
+                    continue
+                captures.append(m)
+            elif flag == MOVE_FLAG_EN_PASSANT or flag == MOVE_FLAG_PROMOTION_QUEEN:
+                captures.append(m)
+        captures.sort(key=lambda m: self._move_order(m, None, ply, turn), reverse=True)
+
+        for m in captures:
+            b.make_move(m, turn)
+            if b.is_check(turn):
+                b.unmake_move()
+                continue
+            score = -self._quiesce(-beta, -alpha, ply + 1, 1 - turn)
+            b.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _is_tactical(self, m: int, turn: int) -> bool:
+        to_i = (m >> 6) & 63
+        return (
+            (self.board.occupancy[1 - turn] >> to_i) & 1
+            or (m >> 12) == MOVE_FLAG_EN_PASSANT
+            or (m >> 12) >= MOVE_FLAG_PROMOTION_KNIGHT
+        )
+
+    def _move_order(self, m: int, tt_move: None | int, ply: int, turn: int) -> int:
+        if m == tt_move:
+            return _TT_MOVE
+        config = self.board.config
+        victim = config[(m >> 6) & 63]
+        flag = m >> 12
+        if victim is not None:
+            attacker = config[m & 63]
+            return _CAPTURE + _ORDER_VALUE[victim.type] * 16 - _ORDER_VALUE[attacker.type]
+        if flag == MOVE_FLAG_EN_PASSANT:
+            return _CAPTURE + 15
+        if flag == MOVE_FLAG_PROMOTION_QUEEN:
+            return _PROMOTION
+        killers = self._killers[ply]
+        if m == killers[0]:
+            return _KILLER
+        if m == killers[1]:
+            return _KILLER - 1
+        return self._history.get(m | (turn << 16), 0)
+
+    def _remember_cutoff(self, m: int, depth: int, ply: int, turn: int):
+        killers = self._killers[ply]
+        if killers[0] != m:
+            killers[1] = killers[0]
+            killers[0] = m
+        k = m | (turn << 16)
+        self._history[k] = min(self._history.get(k, 0) + depth * depth, _KILLER - 2)
+
+    def _pv(self, first: None | int, depth: int) -> list[int]:
+        """Follows the best moves stored in the transposition table, starting with first"""
+        if first is None:
+            return []
+        b = self.board
+        turn = self.turn
+        pv = []
+        seen = set()
+        m = first
+        while m is not None and len(pv) < max(depth, 1):
+            if m not in b.generate_legal_moves(turn):
+                break
+            pv.append(m)
+            b.make_move(m, turn)
+            turn = 1 - turn
+            key = b.position_key(turn)
+            if key in seen:
+                break
+            seen.add(key)
+            entry = self.tt.get(key)
+            m = entry[3] if entry else None
+        for _ in pv:
+            b.unmake_move()
+        return pv
+
+
+def _score_to_tt(score: int, ply: int) -> int:
+    """Mate scores are stored as distance to mate from the position itself instead of from the root, so they stay right wherever its found again"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -(MATE_SCORE - MAX_PLY):
+        return score - ply
+    return score
+
+
+def _score_from_tt(score: int, ply: int) -> int:
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -(MATE_SCORE - MAX_PLY):
+        return score + ply
+    return score
+
+
+# Each thread (and so each worker process) keeps its own tables between searches, so they stay bounded however many games are being played
+_local = threading.local()
+
+
+def _thread_tt(with_history: bool) -> TranspositionTable:
+    """
+    Searches with a history score the positions leading back into their game as draws, and those scores end up in the table.
+    So searches without one (like the ones of /analyze, whose evaluations are shared by every game reaching the position) get a table of their own, which never has any of them.
+    """
+    tables = getattr(_local, "tables", None)
+    if tables is None:
+        tables = _local.tables = {}
+    tt = tables.get(with_history)
+    if tt is None:
+        tt = tables[with_history] = TranspositionTable()
+    return tt
+
+
+def search_fen(
+    fen: str,
+    time_limit: None | float = None,
+    max_nodes: None | int = None,
+    max_depth: int = MAX_PLY,
+    history=(),
+    stop=None,
+) -> SearchResult:
+    """
+    Searches the position in the FEN. Only plain values go in and out, so this can be run on a thread or process pool.
+    `history` are the position keys of the game so far and `stop` an event to stop the search early, see Searcher.
+    """
+    from game import Game
+
+    g = Game.from_FEN(fen)
+    tt = _thread_tt(bool(history))
+    return Searcher(
+        g.board, g.turn, tt, time_limit, max_nodes, max_depth, history, stop
+    ).search()
@@ -0,0 +1,56 @@
+# What the score stored with a position means, since alpha-beta often only finds out a bound of it
+EXACT = 0
+LOWER = 1  # the score is at least this much (the search failed high)
+UPPER = 2  # the score is at most this much (the search failed low)
+
+
+class TranspositionTable:
+    """
+    Remembers what the search found out about positions, keyed by their Zobrist hash, so positions reached again through other move orders (or in the next iteration) don't have to be searched again.
+    It has a fixed number of slots (a power of 2), and the slot of a position is picked by the low bits of its hash. When two positions want the same slot, the one searched deeper wins, unless the one already there is from an older search.
+    """
+
+    def __init__(self, size_log2: int = 16):
+        self.size = 1 << size_log2
+        self._mask = self.size - 1
+        # (key, depth, score, flag, best move, generation) or None
+        self._entries = [None] * self.size
+        self._generation = 0
+
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        """Marks what is stored as being from an older search, so it gets replaced first"""
+        self._generation += 1
+
+    def get(self, key: int):
+        """RETURNS: (depth, score, flag, best move) stored for the position, or None"""
+        e = self._entries[key & self._mask]
+        if e is None or e[0] != key:
+            return None
+        self.hits += 1
+        return e[1], e[2], e[3], e[4]
+
+    def put(self, key: int, depth: int, score: int, flag: int, move: int):
+        i = key & self._mask
+        e = self._entries[i]
+        if (
+            e is not None
+            and e[0] != key
+            and e[5] == self._generation
+            and e[1] > depth
+        ):
+            return
+        if e is not None and e[0] == key and move is None:
+            move = e[4]  # keep the best move we knew of
+        self._entries[i] = (key, depth, score, flag, move, self._generation)
+        self.stores += 1
+
+    def clear(self):
+        self._entries = [None] * self.size
+
+    def usage(self) -> float:
+        """Fraction of the slots in use, looking at the first thousand like engines usually do"""
+        n = min(1000, self.size)
+        return sum(e is not None for e in self._entries[:n]) / n
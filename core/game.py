@@ -1,6 +1,6 @@
 import move_parser
 import board
-from piece import PieceColor, Piece, PieceType
+from piece import PieceColor, Piece
 from img import SQUARE_SIZE, IMG_SIZE
 from square import SquarePosition, File
 from move import Castling
@@ -38,26 +38,40 @@ class Game:
         # Stores a tuple of (the played move with all the details,the minimum info required to make the move). Both of these are of the type Move
         # the first item of the tuple will be used to easily quickly make the moves, if someone wants to undo or redo a move. The second part of the tuple is to store the raw move given
         self.played_moves = []
+        # The compact moves (see move.py) of the played moves, this is what gets stored
+        self.move_codes = []
 
         self.starting_turn = turn  # This is stored to determine who played which move, even though you can figure it out using the current turn, this is more clearer
         self.turn = turn
+        # If the side to move is in check, updated by eval_state
+        self.in_check = False
+        # Starts at 1 and goes up after every move of black, like in FEN
+        self.fullmove_number = 1
+
+        # How many times each position (keyed by its zobrist hash) has occured, used for the repetition rules
+        self.position_counts = {self.board.position_key(turn): 1}
         self.state = self.eval_state()
 
     @staticmethod
     def from_FEN(fen: str):
-        import re
+        g = Game()
+        g.set_FEN(fen)
+        return g
 
-        # TODO: half move clock and full move counter (if needed)
+    def set_FEN(self, fen: str):
+        """Sets up the game from the position in the FEN, forgetting all the played moves"""
+        import re
 
-        reg = r"(?P<config>[1-8rnbqkpRNBQKP/]+) (?P<turn>[wb]) (?P<castlerights>-|[kqKQ]{4}) (?P<enpassant>-|[a-h][36]) (?P<halfmoveclock>\d+) (?P<fullmovecounter>\d+)"
+        # the clocks are optional, since some FENs dont include them
+        reg = r"(?P<config>[1-8rnbqkpRNBQKP/]+) (?P<turn>[wb]) (?P<castlerights>-|[KQkq]{1,4}) (?P<enpassant>-|[a-h][36])(?: (?P<halfmoveclock>\d+) (?P<fullmovecounter>\d+))?"
 
         s = re.match(reg, fen)
         if not s:
             raise InvalidFEN("Unable to match regex.")
 
         b = board.Board()
-        b.config = [None for _ in range(8 * 8)]
-        i = len(b.config)
+        config = [None for _ in range(8 * 8)]
+        i = len(config)
 
         for c in s.group("config"):
             if c.isdigit():
@@ -77,9 +91,12 @@ class Game:
             pos = SquarePosition.from_index(i - 1)
             pos.file = File.H - pos.file
 
-            b.config[pos.to_index()] = Piece(p, color)
+            config[pos.to_index()] = Piece(p, color)
             i -= 1
 
+        # assigning the whole list at once so the board can rebuild its bitboards
+        b.config = config
+
         turn = PieceColor.White if s.group("turn") == "w" else PieceColor.Black
 
         b.can_castle = {
@@ -100,11 +117,35 @@ class Game:
             side = Castling.Short if right.lower() == "k" else Castling.Long
             b.can_castle[p][side] = True
 
-        g = Game()
-        g.board = b
-        g.turn = turn
+        # the square behind the pawn which just moved two steps, so a pawn on the 3rd rank means white just moved
+        enpassant = s.group("enpassant")
+        if enpassant != "-":
+            color = PieceColor.White if enpassant[1] == "3" else PieceColor.Black
+            b.en_passant[color] = 1 << move_parser.file_from_alpha(enpassant[0])
 
-        return g
+        b.zobrist = b.compute_zobrist()
+        b.halfmove_clock = int(s.group("halfmoveclock") or 0)
+
+        self.board = b
+        self.played_moves = []
+        self.move_codes = []
+        self.turn = turn
+        self.starting_turn = turn
+        self.fullmove_number = int(s.group("fullmovecounter") or 1)
+        self.position_counts = {b.position_key(turn): 1}
+        self.state = self.eval_state()
+
+    def to_FEN(self) -> str:
+        return self.board.to_FEN(self.turn, self.halfmove_clock, self.fullmove_number)
+
+    @property
+    def halfmove_clock(self) -> int:
+        """Number of moves since the last capture or pawn move. The board keeps track of it since it changes with every move made"""
+        return self.board.halfmove_clock
+
+    @halfmove_clock.setter
+    def halfmove_clock(self, v: int):
+        self.board.halfmove_clock = v
 
     def play_san(self, move_str: str) -> bool:
         """
@@ -120,9 +161,7 @@ class Game:
         if not played_move:
             return False
 
-        self.played_moves.append((played_move, move))
-        self.turn = PieceColor(1 - self.turn)
-        self.state = self.eval_state()
+        self._on_move_played(played_move, move)
         return True
 
     def play_san_str(self, moves_str: str):
@@ -137,75 +176,87 @@ class Game:
             if not played_move:
                 return False
 
-            self.played_moves.append((played_move, move))
-            self.turn = PieceColor(1 - self.turn)
-            self.state = self.eval_state()
+            self._on_move_played(played_move, move)
 
         return True
 
-    def eval_state(self) -> GameState:
-        turn_is_checkmate = self.board.is_checkmate(self.turn)
-        comp_turn_is_checkmate = self.board.is_checkmate(self.turn.compl())
+    def play_moves(self, codes: [int]):
+        """
+        Plays compact moves which are already known to be legal, like the stored moves of a game. There is no parsing or checking whether the moves are legal, and the state is only evaluated once at the end, so this is a lot faster than playing them one by one with play_san.
+        The moves are written down the way SAN would write them.
+        """
+        b = self.board
+        for m in codes:
+            move = b.to_san_move(m, self.turn)
+            played_move = b.to_move(m, self.turn)
+            b.make_move(m, self.turn)
+            self._on_move_played(played_move, move, evaluate=False)
+        self.state = self.eval_state()
 
-        is_draw = self.is_draw()
+    def _on_move_played(self, played_move, move, evaluate: bool = True):
+        """Updates the game after a move has been made on the board"""
+        self.played_moves.append((played_move, move))
+        self.move_codes.append(self.board.last_move())
+        if self.turn == PieceColor.Black:
+            self.fullmove_number += 1
+        self.turn = PieceColor(1 - self.turn)
 
-        if turn_is_checkmate:
-            return (
-                GameState.WinWhite
-                if self.turn == PieceColor.White
-                else GameState.WinBlack
-            )
-        if comp_turn_is_checkmate:
-            return (
-                GameState.WinWhite
-                if self.turn == PieceColor.Black
-                else GameState.WinWhite
-            )
+        key = self.board.position_key(self.turn)
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
 
-        if is_draw:
+        if evaluate:
+            self.state = self.eval_state()
+
+    def repetitions(self) -> int:
+        """Returns the number of times the current position has occured"""
+        return self.position_counts.get(self.board.position_key(self.turn), 0)
+
+    def eval_state(self) -> GameState:
+        """
+        Evaluates the state of the game after the last move. Only what the last move could have changed is looked at:
+            - Only the side to move can be checkmated or stalemated, so the other side isn't checked
+            - The material only changes on captures and promotions, so the impossible checkmate check is skipped otherwise
+        """
+        board = self.board
+        self.in_check = board.is_check(self.turn)
+
+        if not board.has_valid_moves(self.turn):
+            if self.in_check:
+                return (
+                    GameState.WinBlack
+                    if self.turn == PieceColor.White
+                    else GameState.WinWhite
+                )
+            return GameState.Draw  # stalemate
+
+        if self.is_fivefold_rep() or self.seventy_five_move_rule():
+            return GameState.Draw
+
+        last = self.played_moves[-1][0] if self.played_moves else None
+        if (
+            last is None
+            or last.is_normal_move()
+            and (last.move.is_capture or last.move.promotion_to)
+        ) and self.impossible_checkmate():
             return GameState.Draw
 
         return GameState.Playing
 
     def is_threefold_rep(self) -> bool:
         """Checks for threefold repetitions"""
-        if len(self.played_moves) < 8:
-            return False
-        if len(set([str(x[0]) for x in self.played_moves[-8:-1]])) == 4:
-            return True
-        return False
+        return self.repetitions() >= 3
 
     def is_fivefold_rep(self) -> bool:
         """Checks for fivefold repetitions"""
-        if len(self.played_moves) < 12:
-            return False
-        s = set([str(x[0]) for x in self.played_moves[-12:-1]])
-        if len(s) == 4:
-            return True
-        print(s, self.played_moves[-12:-1])
-        return False
+        return self.repetitions() >= 5
 
     def fifty_move_rule(self) -> bool:
         """Returns True if a draw can be made based on the fifty move rule"""
-        if len(self.played_moves) < 50 * 2:
-            return False
-        for m, _ in self.played_moves[-1:-101]:
-            if m.is_normal() and (
-                m.move.piece_type == PieceType.Pawn or m.move.is_capture
-            ):
-                return False
-        return True
+        return self.halfmove_clock >= 50 * 2
 
     def seventy_five_move_rule(self) -> bool:
         """Returns True if a draw can be made based on the seventy five move rule"""
-        if len(self.played_moves) < 75 * 2:
-            return False
-        for m, _ in self.played_moves[-1 : -(75 * 2 + 1)]:
-            if m.is_normal() and (
-                m.move.piece_type == PieceType.Pawn or m.move.is_capture
-            ):
-                return False
-        return True
+        return self.halfmove_clock >= 75 * 2
 
     def impossible_checkmate(self) -> bool:
         """
@@ -214,73 +265,18 @@ class Game:
             - Only 2 Kings
             - 2 Kings and a Bishop
             - 2 Kings and a Knight
-            - King and Bishop and King and Bishop, where the Bishops are of the same square color
+            - 2 Kings and Bishops, where all the Bishops are of the same square color
         """
-        pieces: [(Piece, int)] = []
-        for i, sq in enumerate(self.board.config):
-            if not sq:
-                continue
-
-            # if theres any other piece besides king, bishop or knight, then its a gaurentee its not a draw yet
-            if sq.type in [PieceType.Pawn, PieceType.Rook, PieceType.Queen]:
-                return False
-
-            pieces.append((sq, i))
-
-        # The conditions won't be satisfied if there are more than 3 pieces, so automatically its not a draw yet
-        if len(pieces) > 3:
-            return False
-
-        if len(pieces) == 2:
-            # if only kings are there on the board
-            if pieces[0][0].type == pieces[1][0].type == PieceType.King:
-                return True
-            else:
-                return False
-
-        if len(pieces) == 3:
-            num_kings = 0
-            num_bishops = 0
-            bishop_poses = []
-            num_knights = 0
-            for p, pos in pieces:
-                if p.type == PieceType.King:
-                    num_kings += 1
-                elif p.type == PieceType.Bishop:
-                    num_bishops += 1
-                    bishop_poses.append(pos)
-                elif p.type == PieceType.Knight:
-                    num_knights += 1
-
-            if num_kings != 2:
-                return True  # lol, maybe throw an error in the future
-
-            # if there is only a bishop with two kings, or only a knight with two kings, or just two kings
-            if (
-                num_bishops <= 1 or num_knights <= 1
-            ) and num_bishops + num_knights <= 1:
-                return True
-
-            # Two bishops in the same colored sqaures
-            if (
-                num_bishops == 2
-                and SquarePosition.from_index(bishop_poses[0]).get_sq_color()
-                == SquarePosition.from_index(bishop_poses[1]).get_sq_color()
-            ):
-                return True
-
-        return False
+        return self.board.insufficient_material()
 
     def is_draw(self) -> bool:
         """Returns True ONLY IF the draw is forced. So this excludes threefold repetitions and the fifty move rule, which can be optionally claimed by the players"""
-        if (
+        return (
             self.board.is_stalemate(self.turn)
-            or self.board.is_stalemate(self.turn.compl())
             or self.is_fivefold_rep()
             or self.seventy_five_move_rule()
             or self.impossible_checkmate()
-        ):
-            return True
+        )
 
 
 def dostuff():
@@ -1,5 +1,5 @@
 from PIL import Image
-from piece import PieceType
+from piece import PieceType, PieceColor
 
 IMG_SIZE = 64 * 8
 
@@ -10,10 +10,8 @@ BLACK = (10, 50, 50, 255)
 WHITE = (255, 255, 255, 255)
 MOVE_COLOR = (212, 183, 70, 100)
 
-WHITE_PIECES = Image.open("./assets/WhitePieces_Wood.png")
-WHITE_PIECES.convert("RGBA")
-BLACK_PIECES = Image.open("./assets/BlackPieces_Wood.png")
-BLACK_PIECES.convert("RGBA")
+WHITE_PIECES = Image.open("./assets/WhitePieces_Wood.png").convert("RGBA")
+BLACK_PIECES = Image.open("./assets/BlackPieces_Wood.png").convert("RGBA")
 PIECE_IMAGES = {}
 
 for i, p_name in enumerate(sorted(PieceType)):
@@ -22,3 +20,58 @@ for i, p_name in enumerate(sorted(PieceType)):
     white = WHITE_PIECES.crop((start, 0, end, 16))
     black = BLACK_PIECES.crop((start, 0, end, 16))
     PIECE_IMAGES[p_name] = {"black": black, "white": white}
+
+
+# Resized piece sprites, keyed by (piece type, color, square dimensions)
+_sprites = {}
+# Empty boards with only the squares drawn, keyed by (image dimensions, square dimensions, dark color, light color)
+_backgrounds = {}
+
+
+def get_piece_sprite(
+    ptype: PieceType, color: PieceColor, sq_dims: tuple[int, int]
+) -> Image.Image:
+    """Returns the image of the piece resized to fit a square. The result is cached, so dont modify it"""
+    key = (ptype, color, sq_dims)
+    sprite = _sprites.get(key)
+    if sprite is None:
+        sprite = PIECE_IMAGES[ptype][
+            "white" if color == PieceColor.White else "black"
+        ].resize(sq_dims)
+        _sprites[key] = sprite
+    return sprite
+
+
+def get_board_background(
+    img_dims: tuple[int, int],
+    sq_dims: tuple[int, int],
+    dark: tuple[int, int, int, int] = BLACK,
+    light: tuple[int, int, int, int] = WHITE,
+) -> Image.Image:
+    """Returns the image of the empty board. The result is cached, so copy it before drawing on it"""
+    key = (img_dims, sq_dims, dark, light)
+    bg = _backgrounds.get(key)
+    if bg is None:
+        bg = Image.new("RGBA", img_dims, (0, 0, 0, 255))
+        for k in range(8 * 8):
+            i = k // 8
+            j = k % 8
+            flippy = (i + j) % 2 == 0  # determines square color lol
+            x, y = j * sq_dims[0], (7 - i) * sq_dims[1]
+            bg.paste(dark if flippy else light, (x, y, x + sq_dims[0], y + sq_dims[1]))
+        _backgrounds[key] = bg
+    return bg
+
+
+def warm_cache(
+    img_dims: tuple[int, int] = (IMG_SIZE, IMG_SIZE),
+    sq_dims: tuple[int, int] = (SQUARE_SIZE, SQUARE_SIZE),
+):
+    """Builds the background and all the sprites for the given size ahead of time"""
+    get_board_background(img_dims, sq_dims)
+    for ptype in PieceType:
+        for color in PieceColor:
+            get_piece_sprite(ptype, color, sq_dims)
+
+
+warm_cache()
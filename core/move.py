@@ -1,3 +1,5 @@
+import sys
+from array import array
 from typing import Union, Optional
 from enum import Enum
 from piece import PieceType, PieceColor
@@ -14,6 +16,64 @@ piece_to_alpha = {
 }
 
 
+"""
+Compact moves are plain ints used by the move generator, so that generating moves doesnt allocate any objects.
+    bits 0-5: index of the square the piece is moved from
+    bits 6-11: index of the square the piece is moved to
+    bits 12-15: one of the MOVE_FLAG_* values below
+Castling is stored as the king's move, (e.g. e1g1 is O-O for white)
+"""
+MOVE_FLAG_NORMAL = 0
+MOVE_FLAG_DOUBLE_PUSH = 1
+MOVE_FLAG_EN_PASSANT = 2
+MOVE_FLAG_CASTLE = 3
+MOVE_FLAG_PROMOTION_KNIGHT = 4
+MOVE_FLAG_PROMOTION_BISHOP = 5
+MOVE_FLAG_PROMOTION_ROOK = 6
+MOVE_FLAG_PROMOTION_QUEEN = 7
+
+promotion_to_flag = {
+    PieceType.Knight: MOVE_FLAG_PROMOTION_KNIGHT,
+    PieceType.Bishop: MOVE_FLAG_PROMOTION_BISHOP,
+    PieceType.Rook: MOVE_FLAG_PROMOTION_ROOK,
+    PieceType.Queen: MOVE_FLAG_PROMOTION_QUEEN,
+}
+flag_to_promotion = {v: k for k, v in promotion_to_flag.items()}
+
+
+def encode_move(from_i: int, to_i: int, flag: int = MOVE_FLAG_NORMAL) -> int:
+    return from_i | (to_i << 6) | (flag << 12)
+
+
+def move_from(m: int) -> int:
+    return m & 63
+
+
+def move_to(m: int) -> int:
+    return (m >> 6) & 63
+
+
+def move_flag(m: int) -> int:
+    return m >> 12
+
+
+def pack_moves(moves: list[int]) -> bytes:
+    """Packs compact moves into 2 bytes each (little endian), which is how the moves of a game are stored"""
+    a = array("H", moves)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+
+def unpack_moves(data: bytes) -> list[int]:
+    """The opposite of pack_moves"""
+    a = array("H")
+    a.frombytes(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tolist()
+
+
 class Castling(Enum):
     Short = (0,)
     Long = 1
@@ -82,7 +142,11 @@ class Move:
             rep = f"{suff}"
             if self.move.from_:
                 rep += str(self.move.from_)
+            if self.move.is_capture:
+                rep += "x"
             rep += str(self.move.to)
+            if self.move.promotion_to:
+                rep += "=" + piece_to_alpha[self.move.promotion_to]
         elif self.move == Castling.Short:
             rep = "O-O"
         elif self.move == Castling.Long:
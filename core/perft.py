@@ -0,0 +1,147 @@
+"""
+Perft (performance test) for the move generator in board.py.
+It walks the tree of legal moves up to a given depth and counts the leaf nodes, which are then compared against the published numbers of some well known positions.
+The positions are picked to cover the tricky bits: castling, en passant (including the discovered check kind), promotions and checks.
+
+Usage (from the root of the repo):
+    python core/perft.py                           check all the positions, exits with 1 if any count is wrong
+    python core/perft.py --depth 3                 same, but no deeper than depth 3
+    python core/perft.py --fen "<FEN>" --depth 4   count the nodes of any position
+    python core/perft.py --fen "<FEN>" --depth 4 --divide
+                                                   also print the node count under each move, useful to find where a bug is
+    python -m pytest tests/test_perft.py           check the shallow depths of all the positions as tests
+"""
+
+import argparse
+import sys
+import time
+
+from game import Game
+from piece import PieceColor
+
+# (name, FEN, expected node counts at depth 1, 2, 3, ...)
+# Numbers from https://www.chessprogramming.org/Perft_Results
+POSITIONS = [
+    (
+        "start",
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609],
+    ),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    (
+        "en passant",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "promotion",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "castling",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+    (
+        "middlegame",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594],
+    ),
+]
+
+# Deep enough to go through every kind of move, while still finishing in a few seconds per position
+DEFAULT_MAX_NODES = 500_000
+
+
+def perft(board, turn: PieceColor, depth: int) -> int:
+    """Counts the leaf nodes of the legal move tree of the given depth"""
+    if depth == 0:
+        return 1
+    moves = board.generate_legal_moves(turn)
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for m in moves:
+        board.make_move(m, turn)
+        nodes += perft(board, 1 - turn, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board, turn: PieceColor, depth: int) -> dict[str, int]:
+    """Same as perft, but returns the node count under each of the root moves"""
+    res = {}
+    for m in board.generate_legal_moves(turn):
+        name = str(board.to_move(m, turn))
+        board.make_move(m, turn)
+        res[name] = perft(board, 1 - turn, depth - 1)
+        board.unmake_move()
+    return res
+
+
+def run(fen: str, depth: int) -> tuple[int, float]:
+    """Runs perft on the FEN, returning (nodes, seconds taken)"""
+    g = Game.from_FEN(fen)
+    start = time.perf_counter()
+    nodes = perft(g.board, g.turn, depth)
+    return nodes, time.perf_counter() - start
+
+
+def check(max_depth: None | int = None) -> bool:
+    """Checks the node counts of all the positions, printing the results. Returns True if all of them matched"""
+    ok = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in POSITIONS:
+        for depth, exp in enumerate(expected, start=1):
+            if max_depth is not None and depth > max_depth:
+                break
+            if max_depth is None and exp > DEFAULT_MAX_NODES:
+                break
+            nodes, took = run(fen, depth)
+            total_nodes += nodes
+            total_time += took
+            status = "ok" if nodes == exp else f"FAILED (expected {exp})"
+            ok &= nodes == exp
+            print(
+                f"{name:<12} depth {depth}: {nodes:>9} nodes {took:8.3f}s {_nps(nodes, took):>9} nodes/s  {status}"
+            )
+    print(f"total: {total_nodes} nodes in {total_time:.3f}s, {_nps(total_nodes, total_time)} nodes/s")
+    return ok
+
+
+def _nps(nodes: int, took: float) -> int:
+    return int(nodes / took) if took > 0 else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Perft for the move generator")
+    parser.add_argument("--fen", help="Position to count the nodes of")
+    parser.add_argument("--depth", type=int, help="Depth to search to")
+    parser.add_argument(
+        "--divide", action="store_true", help="Print the node count of each root move"
+    )
+    args = parser.parse_args(argv)
+
+    if not args.fen:
+        return 0 if check(args.depth) else 1
+
+    depth = args.depth or 1
+    if args.divide:
+        g = Game.from_FEN(args.fen)
+        for name, nodes in sorted(divide(g.board, g.turn, depth).items()):
+            print(f"{name}: {nodes}")
+
+    nodes, took = run(args.fen, depth)
+    print(f"depth {depth}: {nodes} nodes in {took:.3f}s, {_nps(nodes, took)} nodes/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -81,7 +81,10 @@ class SquarePosition:
         return SquarePosition(file, rank)
 
     def __str__(self):
-        return f"{str(self.file)}{self.rank}"
+        # partial positions only show the part which is known
+        file = "" if self.file is None else str(self.file)
+        rank = "" if self.rank is None else str(self.rank)
+        return f"{file}{rank}"
 
     def __repr__(self):
         return self.__str__()
@@ -0,0 +1,413 @@
+"""
+Endgame tablebases: the exact result of every position of an endgame with a few pieces, with the number of moves until mate.
+A table is generated by retrograde analysis, starting from the checkmates and working backwards one ply at a time: a position is won if a move leads to a lost one, and lost once every move leads to a won one.
+Positions where a capture or a promotion leaves the endgame are looked up in the table of the endgame they lead to, so those have to be generated first.
+
+Tables are named after their material, white's pieces first (e.g. KQvK), and store one byte per position:
+    0 for a draw (or a position which can't happen), otherwise 1 + the number of plies until mate, which is odd when the side to move wins and even when it gets mated.
+Only one position of each set of positions which are the same but mirrored or rotated is stored: the one whose squares, in the order of the name, come first when compared one after the other.
+Without pawns the board can be mirrored and rotated 8 ways, and that position always has the white king in the a1-d1-d4 triangle. Pawns only move up the board, so tables with pawns can only be mirrored left to right, which puts the white king on files a-d.
+They are indexed by the side to move, the square of the white king among the ones it can be on, and the squares of the other pieces in the order of the name:
+    index = (side to move * number of white king squares + white king square) * 64^(n - 1) + square of the second piece * 64^(n - 2) + ... + square of the last piece.
+Positions where black has the extra pieces are looked up in the table with the colors swapped and the board mirrored. Castling and enpassant are ignored, a position with either isn't probed.
+
+Usage (from the root of the repo):
+    python core/tablebase.py [KQvK KRvK ...]
+"""
+
+import mmap
+import os
+import time
+
+from bitboard import (
+    KING_ATTACKS,
+    KNIGHT_ATTACKS,
+    PAWN_ATTACKS,
+    bishop_attacks,
+    queen_attacks,
+    rook_attacks,
+)
+from piece import PieceColor, PieceType
+
+TABLEBASE_DIR = "./assets/tablebases"
+# The tables generated by default, in an order where every table comes after the ones it leads to
+DEFAULT_TABLES = ["KQvK", "KRvK", "KPvK"]
+MAX_PIECES = 4
+
+_LETTERS = {
+    "K": PieceType.King,
+    "Q": PieceType.Queen,
+    "R": PieceType.Rook,
+    "B": PieceType.Bishop,
+    "N": PieceType.Knight,
+    "P": PieceType.Pawn,
+}
+_ORDER = "KQRBNP"
+_LETTER_OF = {t: c for c, t in _LETTERS.items()}
+_PROMOTIONS = (PieceType.Queen, PieceType.Rook, PieceType.Bishop, PieceType.Knight)
+
+# name -> the bytes of the table (mmapped from its file, or built by generate), None if there is no such table
+_tables = {}
+
+
+def _transform(sq: int, flip_files: bool, flip_ranks: bool, transpose: bool) -> int:
+    if transpose:
+        sq = (sq & 7) << 3 | sq >> 3
+    return sq ^ (7 if flip_files else 0) ^ (56 if flip_ranks else 0)
+
+
+# The ways the board can be mirrored or rotated without changing the game, as square -> square lists
+_SYMMETRIES = [
+    [_transform(sq, f, r, t) for sq in range(64)]
+    for t in (False, True)
+    for r in (False, True)
+    for f in (False, True)
+]
+_PAWN_SYMMETRIES = [list(range(64)), [sq ^ 7 for sq in range(64)]]
+# Squares the white king is on in the stored positions
+_KING_SQUARES = [sq for sq in range(64) if sq >> 3 <= sq & 7 <= 3]
+_PAWN_KING_SQUARES = [sq for sq in range(64) if sq & 7 <= 3]
+
+
+class _Layout:
+    """How the positions of a table are indexed"""
+
+    def __init__(self, name: str):
+        self.pieces = parse_name(name)
+        pawns = any(t == PieceType.Pawn for _, t in self.pieces)
+        self.symmetries = _PAWN_SYMMETRIES if pawns else _SYMMETRIES
+        self.king_squares = _PAWN_KING_SQUARES if pawns else _KING_SQUARES
+        self.king_index = {sq: i for i, sq in enumerate(self.king_squares)}
+        self.rest = 64 ** (len(self.pieces) - 1)
+        self.size = 2 * len(self.king_squares) * self.rest
+
+    def canonical(self, squares: list[int]) -> list[int]:
+        """RETURNS: the squares of the position which is stored for this one"""
+        return min([s[sq] for sq in squares] for s in self.symmetries)
+
+    def index(self, turn: PieceColor, squares: list[int]) -> int:
+        squares = self.canonical(squares)
+        idx = int(turn) * len(self.king_squares) + self.king_index[squares[0]]
+        for sq in squares[1:]:
+            idx = idx * 64 + sq
+        return idx
+
+    def position(self, idx: int) -> tuple[PieceColor, list[int]]:
+        """The opposite of index, the positions which aren't stored come out as they are"""
+        rest, idx = idx % self.rest, idx // self.rest
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            rest, sq = divmod(rest, 64)
+            squares.append(sq)
+        turn, king = divmod(idx, len(self.king_squares))
+        squares.append(self.king_squares[king])
+        squares.reverse()
+        return PieceColor(turn), squares
+
+
+_layouts = {}
+
+
+def _layout(name: str) -> _Layout:
+    if name not in _layouts:
+        _layouts[name] = _Layout(name)
+    return _layouts[name]
+
+
+def parse_name(name: str) -> list[tuple[PieceColor, PieceType]]:
+    """RETURNS: the pieces of the table in the order they are indexed in: both kings, then white's other pieces, then black's"""
+    white, black = name.upper().split("V")
+    if white[0] != "K" or black[0] != "K":
+        raise ValueError(f"Both sides need a king: {name}")
+    return (
+        [(PieceColor.White, PieceType.King), (PieceColor.Black, PieceType.King)]
+        + [(PieceColor.White, _LETTERS[c]) for c in white[1:]]
+        + [(PieceColor.Black, _LETTERS[c]) for c in black[1:]]
+    )
+
+
+def _material(types: list[PieceType]) -> str:
+    return "K" + "".join(sorted((_LETTER_OF[t] for t in types), key=_ORDER.index))
+
+
+def _table(name: str):
+    if name not in _tables:
+        path = os.path.join(TABLEBASE_DIR, name + ".bin")
+        t = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                t = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(t) != _layout(name).size:
+                t.close()
+                raise ValueError(f"{path} isn't laid out like a table of {name}, generate it again")
+        _tables[name] = t
+    return _tables[name]
+
+
+def _decode(byte: int) -> tuple[int, int]:
+    if byte == 0:
+        return 0, 0
+    plies = byte - 1
+    return (1 if plies % 2 else -1), plies
+
+
+def probe(pieces: list[tuple[PieceColor, PieceType, int]], turn: PieceColor):
+    """
+    Looks up the position given as (color, type, square) of every piece (kings included).
+    RETURNS: (1 if the side to move wins, 0 for a draw or -1 if it loses, plies until mate or 0 for a draw), or None if there is no table for the material
+    """
+    white = [t for c, t, _ in pieces if c == PieceColor.White and t != PieceType.King]
+    black = [t for c, t, _ in pieces if c == PieceColor.Black and t != PieceType.King]
+    # nobody can mate with a lone minor piece, so those don't need a table
+    if len(white) + len(black) <= 1 and all(
+        t in (PieceType.Bishop, PieceType.Knight) for t in white + black
+    ):
+        return 0, 0
+
+    for swap in (False, True):
+        w, b = (black, white) if swap else (white, black)
+        name = _material(w) + "v" + _material(b)
+        table = _table(name)
+        if table is None:
+            continue
+        squares = {}
+        for c, t, sq in pieces:
+            if swap:
+                c, sq = PieceColor(1 - c), sq ^ 56
+            squares.setdefault((c, t), []).append(sq)
+        layout = _layout(name)
+        idx = layout.index(
+            PieceColor(1 - turn) if swap else turn,
+            [squares[key].pop() for key in layout.pieces],
+        )
+        return _decode(table[idx])
+    return None
+
+
+def _attacks(ptype: PieceType, color: PieceColor, sq: int, occupied: int) -> int:
+    if ptype == PieceType.King:
+        return KING_ATTACKS[sq]
+    if ptype == PieceType.Knight:
+        return KNIGHT_ATTACKS[sq]
+    if ptype == PieceType.Bishop:
+        return bishop_attacks(sq, occupied)
+    if ptype == PieceType.Rook:
+        return rook_attacks(sq, occupied)
+    if ptype == PieceType.Queen:
+        return queen_attacks(sq, occupied)
+    return PAWN_ATTACKS[color][sq]
+
+
+def _in_check(pieces, squares, color: PieceColor) -> bool:
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    king = squares[pieces.index((color, PieceType.King))]
+    for (c, t), sq in zip(pieces, squares):
+        if c != color and _attacks(t, c, sq, occupied) >> king & 1:
+            return True
+    return False
+
+
+def _legal(pieces, squares, turn: PieceColor) -> bool:
+    if len(set(squares)) != len(squares):
+        return False
+    for (_, t), sq in zip(pieces, squares):
+        if t == PieceType.Pawn and not 8 <= sq < 56:
+            return False
+    # the side which just moved can't have left its king in check
+    return not _in_check(pieces, squares, PieceColor(1 - turn))
+
+
+def _moves(pieces, squares, turn: PieceColor):
+    """Yields (index of the piece, square it goes to, index of the captured piece or None, promotion or None) of every pseudo legal move"""
+    own = their = 0
+    for (c, _), sq in zip(pieces, squares):
+        if c == turn:
+            own |= 1 << sq
+        else:
+            their |= 1 << sq
+    occupied = own | their
+
+    for j, ((c, t), sq) in enumerate(zip(pieces, squares)):
+        if c != turn:
+            continue
+        if t == PieceType.Pawn:
+            step = 8 if turn == PieceColor.White else -8
+            targets = PAWN_ATTACKS[turn][sq] & their
+            one = sq + step
+            if not occupied >> one & 1:
+                targets |= 1 << one
+                start = 1 if turn == PieceColor.White else 6
+                if sq // 8 == start and not occupied >> (one + step) & 1:
+                    targets |= 1 << (one + step)
+        else:
+            targets = _attacks(t, turn, sq, occupied) & ~own
+
+        while targets:
+            to = (targets & -targets).bit_length() - 1
+            targets &= targets - 1
+            captured = squares.index(to) if their >> to & 1 else None
+            if t == PieceType.Pawn and (to < 8 or to >= 56):
+                for promotion in _PROMOTIONS:
+                    yield j, to, captured, promotion
+            else:
+                yield j, to, captured, None
+
+
+def _unmoves(pieces, squares, mover: PieceColor):
+    """Yields (index of the piece, square it came from) of every move of mover which could have led to the position without capturing or promoting"""
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    for j, ((c, t), sq) in enumerate(zip(pieces, squares)):
+        if c != mover:
+            continue
+        if t == PieceType.Pawn:
+            step = -8 if mover == PieceColor.White else 8
+            one = sq + step
+            if 8 <= one < 56 and not occupied >> one & 1:
+                yield j, one
+                double_rank = 3 if mover == PieceColor.White else 4
+                if sq // 8 == double_rank and not occupied >> (one + step) & 1:
+                    yield j, one + step
+        else:
+            # sliding and jumping moves can be played backwards the same way
+            froms = _attacks(t, mover, sq, occupied) & ~occupied
+            while froms:
+                f = (froms & -froms).bit_length() - 1
+                froms &= froms - 1
+                yield j, f
+
+
+def generate(name: str) -> bytearray:
+    """Generates the table of the endgame, the tables it leads to by a capture or a promotion have to be there already"""
+    layout = _layout(name)
+    pieces = layout.pieces
+    if len(pieces) > MAX_PIECES:
+        raise ValueError(f"Only tables of up to {MAX_PIECES} pieces are supported")
+    size = layout.size
+    decode = layout.position
+    encode = layout.index
+
+    # the indexes of positions which aren't the stored one of their set are left out as well
+    legal = bytearray(size)
+    for idx in range(size):
+        turn, squares = decode(idx)
+        if _legal(pieces, squares, turn) and layout.canonical(squares) == squares:
+            legal[idx] = 1
+
+    # Positions are finalized one ply count at a time, buckets[plies] has the positions found to be decided in that many plies
+    buckets = {}
+    # How many of the positions a position can move to don't lead to a position where the other side wins yet, the position is lost when it gets to 0.
+    # Positions are counted instead of moves, since two moves of a symmetric position can lead to the same stored position
+    count = bytearray(size)
+    # Positions which can win (or lose the slowest) by leaving the endgame, with the plies that takes
+    exit_win = {}
+    exit_loss = {}
+
+    for idx in range(size):
+        if not legal[idx]:
+            continue
+        turn, squares = decode(idx)
+        children = set()
+        draws = 0
+        any_move = False
+        for j, to, captured, promotion in _moves(pieces, squares, turn):
+            child = list(squares)
+            child[j] = to
+            if captured is None and promotion is None:
+                c = encode(1 - turn, child)
+                if legal[c]:
+                    children.add(c)
+                    any_move = True
+                continue
+
+            child_pieces = list(pieces)
+            if promotion is not None:
+                child_pieces[j] = (turn, promotion)
+            if captured is not None:
+                del child_pieces[captured]
+                del child[captured]
+            if _in_check(child_pieces, child, turn):
+                continue
+            any_move = True
+            res = probe(
+                [(c, t, sq) for (c, t), sq in zip(child_pieces, child)],
+                PieceColor(1 - turn),
+            )
+            if res is None:
+                raise ValueError(
+                    f"{name} needs the table of {child_pieces}, generate it first"
+                )
+            wdl, plies = res
+            if wdl < 0:
+                exit_win[idx] = min(exit_win.get(idx, 255), plies + 1)
+            elif wdl > 0:
+                exit_loss[idx] = max(exit_loss.get(idx, 0), plies + 1)
+            else:
+                draws = 1  # a way out to a draw, so this position can't be lost
+
+        if not any_move:
+            if _in_check(pieces, squares, turn):
+                buckets.setdefault(0, []).append(idx)  # checkmated
+            continue  # stalemate stays a draw
+        internal = len(children) + draws
+        count[idx] = internal
+        if idx in exit_win:
+            buckets.setdefault(exit_win[idx], []).append(idx)
+        elif internal == 0:
+            buckets.setdefault(exit_loss[idx], []).append(idx)
+
+    values = bytearray(size)
+    plies = 0
+    while buckets:
+        for idx in buckets.pop(plies, ()):
+            if values[idx]:
+                continue
+            if plies >= 255:
+                raise ValueError(f"{name} has mates too long to store")
+            values[idx] = plies + 1
+
+            turn, squares = decode(idx)
+            mover = PieceColor(1 - turn)
+            parents = set()
+            for j, f in _unmoves(pieces, squares, mover):
+                parent = list(squares)
+                parent[j] = f
+                p = encode(mover, parent)
+                if legal[p] and not values[p]:
+                    parents.add(p)
+            for p in parents:
+                if plies % 2 == 0:
+                    # the position is lost for its side to move, so whoever moved into it wins
+                    buckets.setdefault(plies + 1, []).append(p)
+                elif p not in exit_win:
+                    count[p] -= 1
+                    if count[p] == 0:
+                        lost_in = max(plies + 1, exit_loss.get(p, 0))
+                        buckets.setdefault(lost_in, []).append(p)
+        plies += 1
+
+    _tables[name] = values
+    return values
+
+
+def write_table(name: str, values: bytes, directory: str = TABLEBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + ".bin"), "wb") as f:
+        f.write(values)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name in sys.argv[1:] or DEFAULT_TABLES:
+        start = time.perf_counter()
+        values = generate(name)
+        write_table(name, values)
+        decided = sum(1 for v in values if v)
+        longest = max(values) // 2
+        print(
+            f"{name}: {decided}/{len(values)} positions decided, longest mate {longest} moves, {time.perf_counter() - start:.1f}s"
+        )
@@ -0,0 +1,28 @@
+"""
+Random keys used to Zobrist hash a position. The hash of a position is the xor of the keys of everything in it (every piece on its square, the castling rights, the enpassantable file and the side to move), which means it can be updated incrementally by xoring in and out whatever changed.
+The keys are generated from a fixed seed so that the hashes are the same across restarts, and can be stored or used as cache keys.
+"""
+
+import random
+
+from piece import PieceColor
+from move import Castling
+
+_rng = random.Random(0x5EED_C4E55)
+
+
+def _key() -> int:
+    return _rng.getrandbits(64)
+
+
+# PIECE_KEYS[color][piece_type][square index], index 0 of the middle list is unused like in Board.pieces
+PIECE_KEYS = [[[_key() for _ in range(64)] for _ in range(7)] for _ in PieceColor]
+
+CASTLING_KEYS = {
+    (color, side): _key() for color in PieceColor for side in Castling
+}
+
+# Indexed by the file of the pawn which can be captured enpassant
+EN_PASSANT_KEYS = [_key() for _ in range(8)]
+
+BLACK_TO_MOVE = _key()
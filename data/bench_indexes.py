@@ -0,0 +1,164 @@
+"""
+Benchmark of the match queries with and without the indexes from data/db.py, against a local mongod.
+It fills a separate database with finished (archived) matches and a few running ones, then times looking up the running match of a user and listing all the running matches, first with no indexes and then after ensure_indexes.
+
+Usage (from the root of the repo, the database is only filled the first time):
+    python -m data.bench_indexes [--uri mongodb://localhost:27017] [--archived 1000000] [--running 1000] [--reset]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.append("./core")
+
+from pymongo import MongoClient
+
+from core.game import GameState
+from core.move import pack_moves
+from data.db import (
+    active_match_query,
+    ensure_indexes,
+    running_matches_query,
+    stored_moves,
+)
+
+INSERT_BATCH = 10_000
+# stand-in for real moves, only the size of the documents matters here
+MOVES = list(range(4096))
+
+
+def match_doc(white, black, state) -> dict:
+    n = random.randint(10, 80)
+    return {
+        "_id": uuid.uuid4(),
+        "moves": stored_moves(pack_moves(random.sample(MOVES, n)), state),
+        "white": white,
+        "black": black,
+        "state": int(state),
+        "turn": n % 2,
+        "version": n,
+    }
+
+
+def fill(matches, archived: int, running: int, users: int) -> list:
+    """Inserts the matches. RETURNS: the ids of the users with a running match"""
+    finished = [GameState.Draw, GameState.WinWhite, GameState.WinBlack]
+    done = 0
+    start = time.perf_counter()
+    while done < archived:
+        n = min(INSERT_BATCH, archived - done)
+        matches.insert_many(
+            [
+                match_doc(
+                    random.randrange(users),
+                    random.randrange(users),
+                    random.choice(finished),
+                )
+                for _ in range(n)
+            ],
+            ordered=False,
+        )
+        done += n
+        print(f"\r{done}/{archived} archived matches", end="", flush=True)
+    print(f" ({time.perf_counter() - start:.1f}s)")
+
+    # running games get their own players, since a player only has one at a time
+    playing = list(range(users, users + running * 2))
+    matches.insert_many(
+        [
+            match_doc(playing[i], playing[i + 1], GameState.Playing)
+            for i in range(0, len(playing), 2)
+        ]
+    )
+    return playing
+
+
+def time_query(run, repeat: int) -> tuple[float, float]:
+    """RETURNS: (median, 95th percentile) latency in milliseconds"""
+    took = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        took.append((time.perf_counter() - start) * 1000)
+    took.sort()
+    return statistics.median(took), took[int(len(took) * 0.95) - 1]
+
+
+def docs_examined(db, query: dict) -> tuple[str, int]:
+    """RETURNS: (the stage of the winning plan, number of documents mongo looked at)"""
+    res = db.command(
+        "explain", {"find": "matches", "filter": query}, verbosity="executionStats"
+    )
+    stage = res["queryPlanner"]["winningPlan"]
+    while "inputStage" in stage or "inputStages" in stage:
+        stage = stage.get("inputStage") or stage["inputStages"][0]
+    return stage["stage"], res["executionStats"]["totalDocsExamined"]
+
+
+def run(db, playing: list, users: int, repeat: int):
+    matches = db["matches"]
+    queries = [
+        (
+            "active match (playing user)",
+            lambda: matches.find_one(active_match_query(random.choice(playing))),
+            active_match_query(playing[0]),
+        ),
+        (
+            "active match (idle user)",
+            lambda: matches.find_one(active_match_query(random.randrange(users))),
+            active_match_query(0),
+        ),
+        (
+            "running matches",
+            lambda: list(matches.find(running_matches_query(), {"_id": 1})),
+            running_matches_query(),
+        ),
+    ]
+    for name, query, example in queries:
+        median, p95 = time_query(query, repeat)
+        stage, examined = docs_examined(db, example)
+        print(
+            f"  {name:<30} median {median:8.2f}ms  p95 {p95:8.2f}ms  {stage:<8} {examined} docs examined"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="chess_bench")
+    parser.add_argument("--archived", type=int, default=1_000_000)
+    parser.add_argument("--running", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--reset", action="store_true", help="drop and refill the database"
+    )
+    args = parser.parse_args(argv)
+
+    db = MongoClient(args.uri, uuidRepresentation="standard")[args.db]
+    matches = db["matches"]
+
+    expected = args.archived + args.running
+    if args.reset or matches.estimated_document_count() != expected:
+        matches.drop()
+        playing = fill(matches, args.archived, args.running, args.users)
+    else:
+        playing = list(range(args.users, args.users + args.running * 2))
+
+    print(f"{expected} matches, {args.running} of them running")
+
+    matches.drop_indexes()
+    print("without indexes:")
+    run(db, playing, args.users, max(1, args.repeat // 20))  # these are slow
+
+    ensure_indexes(matches)
+    print("with indexes:")
+    run(db, playing, args.users, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
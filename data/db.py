@@ -1,29 +1,89 @@
 import uuid
 
-from core.game import GameState
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+
+from core.game import Game, GameState
+from core.move import pack_moves
+from data.rating import DEFAULT_RATING, rating_changes
 from db import chessdb
 
 _players = chessdb["players"]
 _matches = chessdb["matches"]
+# Engine evaluations of positions, keyed by their zobrist hash, see get_evals
+_evals = chessdb["evals"]
+
+_RUNNING = {"state": int(GameState.Playing)}
+
+# Only running games are ever looked up by player or state, and they are a tiny part of all the matches, so the indexes only cover them.
+# The queries have to include the state in every condition for the partial indexes to be used
+MATCH_INDEXES = [
+    IndexModel(
+        [("white", ASCENDING)],
+        name="running_by_white",
+        partialFilterExpression=_RUNNING,
+    ),
+    IndexModel(
+        [("black", ASCENDING)],
+        name="running_by_black",
+        partialFilterExpression=_RUNNING,
+    ),
+    IndexModel(
+        [("state", ASCENDING)],
+        name="running",
+        partialFilterExpression=_RUNNING,
+    ),
+]
+
+# The leaderboard reads the top players off this instead of sorting the whole collection
+PLAYER_INDEXES = [IndexModel([("rating", DESCENDING)], name="by_rating")]
+
+
+def ensure_indexes(matches=_matches, players=_players) -> [str]:
+    """Creates the indexes the queries below need, the ones which already exist are left as they are. RETURNS: the names of the indexes"""
+    return matches.create_indexes(MATCH_INDEXES) + players.create_indexes(
+        PLAYER_INDEXES
+    )
+
+
+def active_match_query(user_id) -> dict:
+    """Filter for the running match of the user"""
+    return {"$or": [{**_RUNNING, "white": user_id}, {**_RUNNING, "black": user_id}]}
+
+
+def running_matches_query() -> dict:
+    return dict(_RUNNING)
 
 
 class PlayerData:
     def __init__(
-        self, user_id, num_matches: int = 0, num_wins: int = 0, num_draws: int = 0
+        self,
+        user_id,
+        num_matches: int = 0,
+        num_wins: int = 0,
+        num_draws: int = 0,
+        rating: float = DEFAULT_RATING,
     ):
         self.user_id = user_id
         self.num_matches = num_matches
         self.num_wins = num_wins
         self.num_draws = num_draws
         self.num_losses = num_matches - num_wins - num_draws
+        self.rating = rating
 
     @staticmethod
     def from_dict(d):
-        return PlayerData(d["_id"], d["num_matches"], d["num_wins"], d["num_draws"])
+        # counters which were never incremented arent in the document
+        return PlayerData(
+            d["_id"],
+            d.get("num_matches", 0),
+            d.get("num_wins", 0),
+            d.get("num_draws", 0),
+            d.get("rating", DEFAULT_RATING),
+        )
 
     @staticmethod
     def from_id(user_id):
-        res = _players.find_one({"_id": user_id}, {})
+        res = _players.find_one({"_id": user_id})
         if not res:
             return None
         return PlayerData.from_dict(res)
@@ -32,26 +92,235 @@ class PlayerData:
         return _players.insert_one(self.__dict__) is not None
 
     def update_db(self) -> bool:
-        d = self.__dict__
+        d = self.__dict__.copy()
         _id = d.pop("user_id")
         return _players.update_one({"_id": _id}, {"$set": d}, upsert=True).acknowledged
 
 
+# What the stats of a player without a document start from
+STAT_DEFAULTS = {"rating": DEFAULT_RATING}
+
+
+def result_increments(
+    white_id,
+    black_id,
+    state: GameState,
+    white_doc: None | dict = None,
+    black_doc: None | dict = None,
+) -> list[tuple]:
+    """
+    RETURNS: (user id, how much each stat goes up) for both players of a match which ended with the given state.
+    The rating changes are worked out from the current ratings and number of matches in the players' documents, which are empty for new players.
+    """
+    white_doc = white_doc or {}
+    black_doc = black_doc or {}
+    white = {"num_matches": 1}
+    black = {"num_matches": 1}
+    white_score = None
+    match state:
+        case GameState.Draw:
+            white["num_draws"] = black["num_draws"] = 1
+            white_score = 0.5
+        case GameState.WinWhite:
+            white["num_wins"] = black["num_losses"] = 1
+            white_score = 1.0
+        case GameState.WinBlack:
+            black["num_wins"] = white["num_losses"] = 1
+            white_score = 0.0
+
+    if white_score is not None:
+        white["rating"], black["rating"] = rating_changes(
+            white_doc.get("rating", DEFAULT_RATING),
+            black_doc.get("rating", DEFAULT_RATING),
+            white_score,
+            white_doc.get("num_matches", 0),
+            black_doc.get("num_matches", 0),
+        )
+    return [(white_id, white), (black_id, black)]
+
+
+def match_result_updates(
+    white_id,
+    black_id,
+    state: GameState,
+    white_doc: None | dict = None,
+    black_doc: None | dict = None,
+) -> list[tuple]:
+    """
+    RETURNS: the (filter, update, upsert) of the writes adding the result of a match to both players, see record_match_result.
+    Players without a document get one with the defaults of the stats first, then everything is added to with $inc. So results of the same player written at the same time add up instead of overwriting each other.
+    """
+    updates = []
+    for user_id, inc in result_increments(
+        white_id, black_id, state, white_doc, black_doc
+    ):
+        updates.append(({"_id": user_id}, {"$setOnInsert": dict(STAT_DEFAULTS)}, True))
+        updates.append(({"_id": user_id}, {"$inc": inc}, False))
+    return updates
+
+
+def record_match_result(white_id, black_id, state: GameState):
+    """
+    Adds the result of a match to the stats and ratings of both players. Players without stats yet get them created.
+    The rating changes are worked out by data/rating.py from the ratings read just before, and all the writes go in a single bulk_write
+    """
+    docs = {
+        d["_id"]: d
+        for d in _players.find(
+            {"_id": {"$in": [white_id, black_id]}}, {"rating": 1, "num_matches": 1}
+        )
+    }
+    ops = [
+        UpdateOne(query, update, upsert=upsert)
+        for query, update, upsert in match_result_updates(
+            white_id, black_id, state, docs.get(white_id), docs.get(black_id)
+        )
+    ]
+    # ordered, so the defaults of a new player are there before they get added to
+    _players.bulk_write(ops, ordered=True)
+
+
+def get_top_players(n: int) -> [PlayerData]:
+    return [
+        PlayerData.from_dict(d)
+        for d in _players.find().sort("rating", DESCENDING).limit(n)
+    ]
+
+
+def count_players_above(rating: float) -> int:
+    """How many players have a higher rating, counted on the rating index"""
+    return _players.count_documents({"rating": {"$gt": rating}})
+
+
+def count_players() -> int:
+    """Number of players, from the collection's metadata so it doesn't go through them"""
+    return _players.estimated_document_count()
+
+
+def player_stats_pipeline(into: str = "player_stats") -> list:
+    """
+    Aggregation which counts the stats of every player from the finished matches, and merges them into the `into` collection.
+    Into a separate collection it is a view of what the stats should be, to check the players collection against. Into "players" it rebuilds the stats.
+    Games against the engine don't count towards the stats (see Chess._save_and_delete_game), so only games between two users are counted.
+    """
+    return [
+        # matches stored before the engine existed have no engine field, which None matches as well
+        {"$match": {"state": {"$ne": int(GameState.Playing)}, "engine": None}},
+        {
+            "$project": {
+                "draw": {"$eq": ["$state", int(GameState.Draw)]},
+                "sides": [
+                    {
+                        "_id": "$white",
+                        "win": {"$eq": ["$state", int(GameState.WinWhite)]},
+                        "loss": {"$eq": ["$state", int(GameState.WinBlack)]},
+                    },
+                    {
+                        "_id": "$black",
+                        "win": {"$eq": ["$state", int(GameState.WinBlack)]},
+                        "loss": {"$eq": ["$state", int(GameState.WinWhite)]},
+                    },
+                ],
+            }
+        },
+        {"$unwind": "$sides"},
+        {
+            "$group": {
+                "_id": "$sides._id",
+                "num_matches": {"$sum": 1},
+                "num_wins": {"$sum": {"$cond": ["$sides.win", 1, 0]}},
+                "num_draws": {"$sum": {"$cond": ["$draw", 1, 0]}},
+                "num_losses": {"$sum": {"$cond": ["$sides.loss", 1, 0]}},
+            }
+        },
+        # merge, so anything else stored with the player is kept
+        {
+            "$merge": {
+                "into": into,
+                "whenMatched": "merge",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+def rebuild_player_stats(into: str = "player_stats"):
+    _matches.aggregate(player_stats_pipeline(into))
+
+
+def diff_player_stats(view: str = "player_stats") -> list[tuple]:
+    """
+    Compares the players collection to a view made by rebuild_player_stats.
+    RETURNS: (user id, stored counters, counted counters) of every player whose stats differ
+    """
+    fields = ["num_matches", "num_wins", "num_draws", "num_losses"]
+    projection = {f: 1 for f in fields}
+    stored = {d["_id"]: d for d in _players.find({}, projection)}
+    diffs = []
+    for d in chessdb[view].find({}, projection):
+        s = stored.get(d["_id"], {})
+        if any(s.get(f, 0) != d.get(f, 0) for f in fields):
+            diffs.append(
+                (d["_id"], {f: s.get(f, 0) for f in fields}, {f: d[f] for f in fields})
+            )
+    return diffs
+
+
+def stored_moves(moves: bytes, state):
+    """
+    How the packed moves of a match are stored. The moves of a running match are a list of packed chunks, so the new moves can be $push'ed instead of writing all of them again.
+    Once the match is over nothing gets appended anymore, so its moves are stored as a single blob.
+    """
+    if state != GameState.Playing:
+        return bytes(moves)
+    return [bytes(moves)] if moves else []
+
+
 class MatchData:
-    def __init__(self, gid: uuid.UUID, played_moves, white_id, black_id, state, turn):
-        self.moves_full = list(map(lambda x: str(x[0]), played_moves))
-        self.moves_partial = list(map(lambda x: str(x[1]), played_moves))
+    # Set on matches read from documents which still store the moves in an older format (as strings, or as a single blob while running), they should be written back in the new format
+    needs_migration = False
+
+    def __init__(
+        self,
+        gid: uuid.UUID,
+        moves: bytes,
+        white_id,
+        black_id,
+        state,
+        turn,
+        checkpoints: None | list[dict] = None,
+        engine: None | str = None,
+    ):
+        # The compact moves packed with move.pack_moves, 2 bytes a move. Stored as binary, see stored_moves
+        self.moves = moves
         self.white = white_id
         self.black = black_id
         self.state = state
         self._id = gid
         self.turn = turn
+        # Incremented on every update, an update only goes through if the version it was made from is still the stored one
+        self.version = 0
+        # FENs of the position every few moves, as {"ply": number of moves played, "fen": FEN}. Restoring a game starts from the last one so not every move has to be replayed.
+        # The FEN has the halfmove clock and fullmove number, so those are restored from it as well
+        self.checkpoints = checkpoints or []
+        # Difficulty of the built-in engine for games against the bot, None for games between two users
+        self.engine = engine
+
+    def to_doc(self) -> dict:
+        d = self.__dict__.copy()
+        d.pop("needs_migration", None)
+        d["moves"] = stored_moves(self.moves, self.state)
+        return d
 
     def insert_to_db(self) -> bool:
-        return _matches.insert_one(self.__dict__).acknowledged
+        return _matches.insert_one(self.to_doc()).acknowledged
 
     def update_on_db(self, fields: [str] = []) -> bool:
-        d = self.__dict__
+        return _matches.update_one(*self._update_args(fields)).acknowledged
+
+    def _update_args(self, fields: [str] = []):
+        """Returns the (filter, update) pair to update the given fields, or all of them if none are given"""
+        d = self.to_doc()
         _id = d["_id"]
         upds = {}
         if not fields:
@@ -62,33 +331,241 @@ class MatchData:
         for field in fields:
             upds[field] = d[field]
 
-        return _matches.update_one({"_id": _id}, {"$set": upds}).acknowledged
+        return {"_id": _id}, {"$set": upds}
 
     @staticmethod
     def from_dict(d):
-        m = MatchData(d["_id"], [], d["white"], d["black"], d["state"], d["turn"])
-        m.moves_full = d["moves_full"]
-        m.moves_partial = d["moves_partial"]
+        moves = d.get("moves")
+        m = MatchData(d["_id"], b"", d["white"], d["black"], d["state"], d["turn"])
+        if moves is None:
+            # raises if the moves can't all be replayed, since migrating would drop the ones which weren't
+            moves = legacy_moves_to_packed(d.get("moves_full", []))
+            m.needs_migration = True
+        elif isinstance(moves, list):
+            moves = b"".join(moves)
+        elif m.state == GameState.Playing:
+            m.needs_migration = True  # a single blob can't be appended to
+        m.moves = bytes(moves)
+        m.version = d.get("version", 0)
+        m.checkpoints = d.get("checkpoints", [])
+        m.engine = d.get("engine")
         return m
 
     def get_from_game_id(_id: uuid.UUID):
-        res = _matches.find_one({"_id": _id}, {})
+        res = _matches.find_one({"_id": _id})
         if not res:
             return None
         return MatchData.from_dict(res)
 
     def get_active_game_by_userid(user_id: uuid.UUID):
-        res = _matches.find_one(
-            {
-                "state": GameState.Playing,
-                "$or": [{"white": user_id}, {"black": user_id}],
-            }
-        )
+        res = _matches.find_one(active_match_query(user_id))
         if not res:
             return None
         return MatchData.from_dict(res)
 
 
+class MatchDelta:
+    """
+    The changes made to a match since it was last written: the moves played since then, and the state and turn if they changed.
+    Applying it appends the new moves instead of writing all of them again, and only goes through if the stored version is still `version`.
+    `moves` replaces all the stored moves instead, for documents being migrated and for the final write of a match, which stores them as a single blob (see stored_moves).
+    """
+
+    def __init__(
+        self,
+        gid: uuid.UUID,
+        version: int,
+        new_moves: bytes = b"",
+        state=None,
+        turn=None,
+        checkpoints: None | list[dict] = None,
+        moves: None | bytes = None,
+        drop_legacy_moves: bool = False,
+    ):
+        self._id = gid
+        self.version = version
+        self.new_moves = new_moves
+        self.state = state
+        self.turn = turn
+        self.checkpoints = checkpoints or []
+        self.moves = moves
+        # removes the moves stored as strings, for documents which are being migrated
+        self.drop_legacy_moves = drop_legacy_moves
+        # how many updates this delta is made of, the stored version goes up by this much
+        self.count = 1
+
+    def merge(self, newer: "MatchDelta") -> "MatchDelta":
+        """Combines this delta with one made after it into a single delta"""
+        moves = newer.moves
+        new_moves = b""
+        if moves is None:
+            if self.moves is not None:
+                moves = self.moves + newer.new_moves
+            else:
+                new_moves = self.new_moves + newer.new_moves
+        m = MatchDelta(
+            self._id,
+            self.version,
+            new_moves,
+            self.state if newer.state is None else newer.state,
+            self.turn if newer.turn is None else newer.turn,
+            self.checkpoints + newer.checkpoints,
+            moves,
+            self.drop_legacy_moves or newer.drop_legacy_moves,
+        )
+        m.count = self.count + newer.count
+        return m
+
+    def stored_moves(self):
+        """What the moves are replaced with, the state only changes once the match is over so a delta without one is of a running match"""
+        return stored_moves(
+            self.moves, GameState.Playing if self.state is None else self.state
+        )
+
+    def _update_args(self):
+        # documents written before versions existed dont have the field, which null matches
+        version = self.version if self.version else {"$in": [0, None]}
+        upd = {"$inc": {"version": self.count}}
+        pushes = {}
+        if self.new_moves:
+            pushes["moves"] = self.new_moves
+        if self.checkpoints:
+            pushes["checkpoints"] = {"$each": self.checkpoints}
+        if pushes:
+            upd["$push"] = pushes
+        if self.drop_legacy_moves:
+            upd["$unset"] = {"moves_full": "", "moves_partial": ""}
+        sets = {}
+        if self.moves is not None:
+            sets["moves"] = self.stored_moves()
+        if self.state is not None:
+            sets["state"] = self.state
+        if self.turn is not None:
+            sets["turn"] = self.turn
+        if sets:
+            upd["$set"] = sets
+        return {"_id": self._id, "version": version}, upd
+
+
+def apply_match_deltas(deltas: [MatchDelta]) -> [uuid.UUID]:
+    """
+    Applies all the deltas in one round trip.
+    RETURNS: The ids of the matches whose update was rejected because the stored version didn't match
+    """
+    if not deltas:
+        return []
+    ops = [UpdateOne(*d._update_args()) for d in deltas]
+    res = _matches.bulk_write(ops, ordered=False)
+    if res.matched_count == len(ops):
+        return []
+
+    # only look up which ones failed when some of them did
+    expected = {d._id: d.version + d.count for d in deltas}
+    found = {
+        m["_id"]: m.get("version", 0)
+        for m in _matches.find({"_id": {"$in": list(expected)}}, {"version": 1})
+    }
+    return [gid for gid, v in expected.items() if found.get(gid) != v]
+
+
+def legacy_moves_to_packed(moves_full: [str]) -> bytes:
+    """
+    Converts the moves of a match stored as strings (with all the details, like Ng1f3) to the packed format, by replaying them from the starting position.
+    The strings never had the piece a pawn promoted to, so a promotion without one is taken to be to a queen.
+    Raises ValueError if a move can't be played, instead of returning the moves before it and losing the rest of the game.
+    """
+    g = Game()
+    for i, move in enumerate(moves_full):
+        if g.play_san(move):
+            continue
+        promotion = move[:1].islower() and "=" not in move and move[-1:] in "18"
+        if not (promotion and g.play_san(move + "=Q")):
+            raise ValueError(f"Move {i + 1} ({move}) of the stored moves can't be played")
+    return pack_moves(g.move_codes)
+
+
+def migrate_legacy_matches(batch_size: int = 500) -> int:
+    """
+    Rewrites the finished matches which still store their moves as strings. The running ones are left to the bot, which writes them in the new format the next time it saves them, so this can be run while it is running.
+    Matches whose moves can't all be replayed are left as they are, and printed.
+    RETURNS: the number of matches migrated
+    """
+    query = {
+        "moves": {"$exists": False},
+        "moves_full": {"$exists": True},
+        "state": {"$ne": int(GameState.Playing)},
+    }
+    n = 0
+    ops = []
+    for d in _matches.find(query, {"moves_full": 1}, batch_size=batch_size):
+        try:
+            moves = legacy_moves_to_packed(d["moves_full"])
+        except ValueError as e:
+            print(f"Not migrating match {d['_id']}: {e}")
+            continue
+        ops.append(
+            UpdateOne(
+                {"_id": d["_id"], "moves": {"$exists": False}},
+                {
+                    "$set": {"moves": moves},
+                    "$unset": {"moves_full": "", "moves_partial": ""},
+                },
+            )
+        )
+        if len(ops) >= batch_size:
+            n += _matches.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        n += _matches.bulk_write(ops, ordered=False).modified_count
+    return n
+
+
+def running_matches_cursor(batch_size: int = 100):
+    """Cursor over the running matches, which gets them from the server batch_size documents at a time instead of all at once"""
+    return _matches.find(running_matches_query(), batch_size=batch_size)
+
+
 def get_all_running_matches() -> [MatchData]:
-    res = _matches.find({"state": GameState.Playing}, {})
-    return [MatchData.from_dict(m) for m in res]
+    return [MatchData.from_dict(m) for m in running_matches_cursor()]
+
+
+def _signed(key: int) -> int:
+    """Mongo only stores signed 64 bit integers, so the upper half of the zobrist hashes wraps around to the negatives"""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def get_evals(keys: [int], depth: int) -> dict:
+    """
+    Looks up the stored evaluations of the positions, only the ones searched at least `depth` deep count.
+    RETURNS: position key -> (depth, score for the side to move, best move)
+    """
+    signed = {_signed(k): k for k in keys}
+    res = _evals.find({"_id": {"$in": list(signed)}, "depth": {"$gte": depth}})
+    return {signed[d["_id"]]: (d["depth"], d["score"], d.get("move")) for d in res}
+
+
+def save_evals(evals: [tuple]):
+    """
+    Stores (position key, depth, score, best move) tuples in one bulk write. One document is kept per position, an evaluation only replaces the stored one if it was searched deeper
+    """
+    if not evals:
+        return
+    ops = []
+    for key, depth, score, move in evals:
+        deeper = {"$lt": [{"$ifNull": ["$depth", -1]}, depth]}
+        ops.append(
+            UpdateOne(
+                {"_id": _signed(key)},
+                [
+                    {
+                        "$set": {
+                            "score": {"$cond": [deeper, score, "$score"]},
+                            "move": {"$cond": [deeper, move, "$move"]},
+                            "depth": {"$cond": [deeper, depth, "$depth"]},
+                        }
+                    }
+                ],
+                upsert=True,
+            )
+        )
+    _evals.bulk_write(ops, ordered=False)
@@ -0,0 +1,28 @@
+"""
+Converts the finished matches which still store their moves as lists of strings to the packed binary format. Running matches are converted by the bot the next time it saves them, so this is safe to run while it is up.
+
+Usage (from the root of the repo):
+    python -m data.migrate_moves [--batch-size N]
+"""
+
+import argparse
+import sys
+import time
+
+sys.path.append("./core")
+
+from data.db import migrate_legacy_matches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    n = migrate_legacy_matches(args.batch_size)
+    print(f"Migrated {n} matches in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
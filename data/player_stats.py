@@ -0,0 +1,44 @@
+"""
+Counts the stats of every player from the finished matches with an aggregation, for checking or rebuilding the stats in the players collection (which are only ever incremented as games end).
+
+Usage (from the root of the repo):
+    python -m data.player_stats            # builds the player_stats view and prints the players whose stats differ
+    python -m data.player_stats --rebuild  # writes the counted stats into the players collection
+"""
+
+import argparse
+import sys
+import time
+
+sys.path.append("./core")
+
+from data.db import diff_player_stats, rebuild_player_stats
+
+VIEW = "player_stats"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="write the counted stats into the players collection",
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.rebuild:
+        rebuild_player_stats("players")
+        print(f"Rebuilt the players' stats in {time.perf_counter() - start:.1f}s")
+        return
+
+    rebuild_player_stats(VIEW)
+    diffs = diff_player_stats(VIEW)
+    print(f"Counted the stats in {time.perf_counter() - start:.1f}s")
+    for user_id, stored, counted in diffs:
+        print(f"{user_id}: stored {stored}, counted {counted}")
+    print(f"{len(diffs)} players have different stats")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Elo ratings of the players. A player's rating goes up by K * (score - expected score) after every game, where the expected score comes from the difference between the two ratings.
+"""
+
+DEFAULT_RATING = 1200.0
+
+# Ratings of new players move faster, so they get to where they belong in fewer games
+K_PROVISIONAL = 40
+K = 20
+PROVISIONAL_GAMES = 30
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    """The score (1 for a win, 0.5 for a draw) the player is expected to get on average against the opponent"""
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def k_factor(num_matches: int) -> int:
+    return K_PROVISIONAL if num_matches < PROVISIONAL_GAMES else K
+
+
+def rating_changes(
+    white: float, black: float, white_score: float, white_games: int, black_games: int
+) -> tuple[float, float]:
+    """RETURNS: how much the rating of white and black change after a game in which white scored white_score"""
+    expected = expected_score(white, black)
+    return (
+        k_factor(white_games) * (white_score - expected),
+        k_factor(black_games) * (expected - white_score),
+    )
@@ -0,0 +1,321 @@
+"""
+Async persistence used by the bot. Every call to mongo is blocking, so running it directly inside a command handler would freeze the whole bot until mongo replies.
+MongoStore runs the calls of data/db.py on a dedicated thread pool (as big as the connection pool) instead, and MemoryStore keeps everything in dicts so the bot can be run and tested without a mongo server.
+"""
+
+import asyncio
+import itertools
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from core.game import GameState
+from data.rating import DEFAULT_RATING
+from data.db import (
+    PlayerData,
+    MatchData,
+    apply_match_deltas,
+    ensure_indexes,
+    count_players,
+    count_players_above,
+    get_all_running_matches,
+    get_evals,
+    get_top_players,
+    match_result_updates,
+    record_match_result,
+    running_matches_cursor,
+    save_evals,
+)
+
+
+class Store(ABC):
+    """Interface of the persistence layer, everything returns copies so modifying the results doesnt change what's stored"""
+
+    async def ping(self):
+        pass
+
+    async def ensure_indexes(self):
+        """Creates whatever indexes the queries need, called once at startup"""
+        pass
+
+    @abstractmethod
+    async def get_player(self, user_id):
+        """Returns the PlayerData of the user, or None if they havent played yet"""
+
+    @abstractmethod
+    async def save_player(self, player) -> bool:
+        """Writes the stats of the player, creating them if they dont exist yet"""
+
+    @abstractmethod
+    async def record_match_result(self, white_id, black_id, state):
+        """Adds the result of a finished match to the stats and ratings of both players, atomically"""
+
+    @abstractmethod
+    async def get_top_players(self, n: int) -> list:
+        """The n players with the highest rating, highest first"""
+
+    @abstractmethod
+    async def count_players_above(self, rating: float) -> int:
+        """How many players have a higher rating than the given one"""
+
+    @abstractmethod
+    async def count_players(self) -> int:
+        """Number of players with stats, it can be an estimate"""
+
+    @abstractmethod
+    async def insert_match(self, match) -> bool:
+        """Stores a new match, RETURNS: False if there already is one with the same id"""
+
+    @abstractmethod
+    async def update_match(self, match, fields: [str] = []) -> bool:
+        """Updates the given fields of the match, or all of them if none are given"""
+
+    @abstractmethod
+    async def apply_match_deltas(self, deltas: list) -> list:
+        """Applies all the MatchDeltas in one go, returning the ids of the matches whose version didn't match"""
+
+    @abstractmethod
+    async def get_match(self, gid):
+        """Returns the MatchData of the match, or None if there is no match with the id"""
+
+    @abstractmethod
+    async def get_active_match(self, user_id):
+        """Returns the MatchData of the running game the user is playing in, if any"""
+
+    @abstractmethod
+    async def get_running_matches(self) -> list:
+        """The MatchData of every running match"""
+
+    @abstractmethod
+    async def iter_running_matches(self, batch_size: int = 100):
+        """Yields the running matches in lists of at most batch_size MatchData, so they dont all have to be in memory at once"""
+
+    @abstractmethod
+    async def get_evals(self, keys: list, depth: int) -> dict:
+        """Stored engine evaluations of the positions searched at least depth deep, as position key -> (depth, score, best move)"""
+
+    @abstractmethod
+    async def save_evals(self, evals: list):
+        """Stores (position key, depth, score, best move) evaluations, deeper ones win over shallower ones"""
+
+    def close(self):
+        pass
+
+
+class MongoStore(Store):
+    def __init__(self, pool_size: None | int = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size or db.DB_POOL_SIZE, thread_name_prefix="mongo"
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    async def ping(self):
+        await self._run(db.ping)
+
+    async def ensure_indexes(self):
+        await self._run(ensure_indexes)
+
+    async def get_player(self, user_id):
+        return await self._run(PlayerData.from_id, user_id)
+
+    async def save_player(self, player) -> bool:
+        return await self._run(player.update_db)
+
+    async def record_match_result(self, white_id, black_id, state):
+        await self._run(record_match_result, white_id, black_id, state)
+
+    async def get_top_players(self, n: int) -> list:
+        return await self._run(get_top_players, n)
+
+    async def count_players_above(self, rating: float) -> int:
+        return await self._run(count_players_above, rating)
+
+    async def count_players(self) -> int:
+        return await self._run(count_players)
+
+    async def insert_match(self, match) -> bool:
+        return await self._run(match.insert_to_db)
+
+    async def update_match(self, match, fields: [str] = []) -> bool:
+        return await self._run(match.update_on_db, fields)
+
+    async def apply_match_deltas(self, deltas: list) -> list:
+        return await self._run(apply_match_deltas, deltas)
+
+    async def get_match(self, gid):
+        return await self._run(MatchData.get_from_game_id, gid)
+
+    async def get_active_match(self, user_id):
+        return await self._run(MatchData.get_active_game_by_userid, user_id)
+
+    async def get_running_matches(self) -> list:
+        return await self._run(get_all_running_matches)
+
+    async def iter_running_matches(self, batch_size: int = 100):
+        cursor = running_matches_cursor(batch_size)
+        try:
+            while True:
+                batch = await self._run(_next_batch, cursor, batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            # closing it tells the server to drop the cursor, which is a round trip like the reads
+            await self._run(cursor.close)
+
+    async def get_evals(self, keys: list, depth: int) -> dict:
+        return await self._run(get_evals, keys, depth)
+
+    async def save_evals(self, evals: list):
+        await self._run(save_evals, evals)
+
+    def close(self):
+        # called on the event loop after the last flush, so nothing it needs is left on the pool. Waiting for the threads would block the loop
+        self._executor.shutdown(wait=False)
+
+
+class MemoryStore(Store):
+    """Keeps the documents in dicts, in the same shape they would have in mongo"""
+
+    def __init__(self):
+        self.players = {}
+        self.matches = {}
+        self.evals = {}  # position key -> (depth, score, best move)
+
+    async def get_player(self, user_id):
+        d = self.players.get(user_id)
+        return PlayerData.from_dict(d) if d else None
+
+    async def save_player(self, player) -> bool:
+        d = {k: v for k, v in player.__dict__.items() if k != "user_id"}
+        d["_id"] = player.user_id
+        self.players[player.user_id] = d
+        return True
+
+    async def record_match_result(self, white_id, black_id, state):
+        # the same writes MongoStore sends
+        for query, update, upsert in match_result_updates(
+            white_id,
+            black_id,
+            state,
+            self.players.get(white_id),
+            self.players.get(black_id),
+        ):
+            d = self.players.get(query["_id"])
+            if d is None:
+                if not upsert:
+                    continue
+                d = self.players[query["_id"]] = {
+                    **query,
+                    **_copy_doc(update.get("$setOnInsert", {})),
+                }
+            for field, n in update.get("$inc", {}).items():
+                d[field] = d.get(field, 0) + n
+
+    async def get_top_players(self, n: int) -> list:
+        top = sorted(
+            self.players.values(),
+            key=lambda d: d.get("rating", DEFAULT_RATING),
+            reverse=True,
+        )
+        return [PlayerData.from_dict(d) for d in top[:n]]
+
+    async def count_players_above(self, rating: float) -> int:
+        return sum(
+            d.get("rating", DEFAULT_RATING) > rating for d in self.players.values()
+        )
+
+    async def count_players(self) -> int:
+        return len(self.players)
+
+    async def insert_match(self, match) -> bool:
+        if match._id in self.matches:
+            return False
+        self.matches[match._id] = _copy_doc(match.to_doc())
+        return True
+
+    async def update_match(self, match, fields: [str] = []) -> bool:
+        doc = self.matches.get(match._id)
+        if doc is None:
+            return False
+        d = match.to_doc()
+        for field in fields or [k for k in d if k != "_id"]:
+            doc[field] = _copy_doc(d[field])
+        return True
+
+    async def apply_match_deltas(self, deltas: list) -> list:
+        conflicts = []
+        for delta in deltas:
+            doc = self.matches.get(delta._id)
+            if doc is None or doc.get("version", 0) != delta.version:
+                conflicts.append(delta._id)
+                continue
+            if delta.moves is not None:
+                doc["moves"] = delta.stored_moves()
+            if delta.new_moves:
+                doc["moves"].append(delta.new_moves)
+            if delta.drop_legacy_moves:
+                doc.pop("moves_full", None)
+                doc.pop("moves_partial", None)
+            if delta.state is not None:
+                doc["state"] = delta.state
+            if delta.turn is not None:
+                doc["turn"] = delta.turn
+            doc.setdefault("checkpoints", []).extend(_copy_doc(delta.checkpoints))
+            doc["version"] = delta.version + delta.count
+        return conflicts
+
+    async def get_match(self, gid):
+        d = self.matches.get(gid)
+        return MatchData.from_dict(_copy_doc(d)) if d else None
+
+    async def get_active_match(self, user_id):
+        for d in self.matches.values():
+            if d["state"] == GameState.Playing and user_id in (d["white"], d["black"]):
+                return await self.get_match(d["_id"])
+        return None
+
+    async def get_running_matches(self) -> list:
+        return [
+            await self.get_match(gid)
+            for gid, d in self.matches.items()
+            if d["state"] == GameState.Playing
+        ]
+
+    async def iter_running_matches(self, batch_size: int = 100):
+        running = [
+            gid for gid, d in self.matches.items() if d["state"] == GameState.Playing
+        ]
+        for i in range(0, len(running), batch_size):
+            yield [await self.get_match(gid) for gid in running[i : i + batch_size]]
+
+    async def get_evals(self, keys: list, depth: int) -> dict:
+        return {
+            k: self.evals[k]
+            for k in keys
+            if k in self.evals and self.evals[k][0] >= depth
+        }
+
+    async def save_evals(self, evals: list):
+        for key, depth, score, move in evals:
+            stored = self.evals.get(key)
+            if stored is None or stored[0] < depth:
+                self.evals[key] = (depth, score, move)
+
+
+def _next_batch(cursor, n: int) -> list:
+    """Reads the next n matches off the cursor, this blocks whenever the cursor has to get more from the server"""
+    return [MatchData.from_dict(d) for d in itertools.islice(cursor, n)]
+
+
+def _copy_doc(v):
+    """Copies the lists and dicts of a document, so the stored one cant be changed from outside"""
+    if isinstance(v, dict):
+        return {k: _copy_doc(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_copy_doc(x) for x in v]
+    return v
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+
+class MatchWriteBehind:
+    """
+    Queues match updates (MatchDeltas) instead of writing each one straight away. Updates of the same game are coalesced into a single delta.
+    The queue is flushed as a single bulk write every `interval` seconds, as soon as `max_pending` games are waiting, or when flush is called directly (e.g. when a game ends or the bot shuts down).
+    An update is rejected when someone else wrote to the match since it was read, and every later update of that game would be rejected too since they are made from the same version.
+    So the updates of those games are dropped and `on_conflict` is called with their ids, whoever made them has to read the match again before changing it.
+    """
+
+    def __init__(
+        self,
+        store,
+        interval: float = 2.0,
+        max_pending: int = 64,
+        on_conflict=None,
+    ):
+        self.store = store
+        self.interval = interval
+        self.max_pending = max_pending
+        self.on_conflict = on_conflict
+
+        self._pending = {}  # game id -> MatchDelta of everything not written yet
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._early_flush = None
+
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.conflicts = 0
+        self.last_flush_latency = 0.0  # seconds
+        self.max_flush_latency = 0.0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, delta):
+        pending = self._pending.get(delta._id)
+        self._pending[delta._id] = pending.merge(delta) if pending else delta
+        if len(self._pending) >= self.max_pending and self._early_flush is None:
+            self._early_flush = asyncio.create_task(self.flush())
+            self._early_flush.add_done_callback(self._early_flush_done)
+
+    def _early_flush_done(self, task: asyncio.Task):
+        if self._early_flush is task:
+            self._early_flush = None
+        # flush already logged the failure and put the updates back for the next flush, this only marks the exception as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def flush(self) -> list:
+        """Writes everything pending. RETURNS: the ids of the games whose updates were rejected because of a version conflict"""
+        async with self._lock:
+            if not self._pending:
+                return []
+            batch = self._pending
+            self._pending = {}
+
+            start = time.perf_counter()
+            try:
+                conflicts = await self.store.apply_match_deltas(list(batch.values()))
+            except Exception as e:
+                self.failures += 1
+                print(f"Failed to flush {len(batch)} match updates: {e}")
+                # put them back in front of any update which came in while flushing
+                for gid, delta in batch.items():
+                    newer = self._pending.get(gid)
+                    self._pending[gid] = delta.merge(newer) if newer else delta
+                raise
+            finally:
+                self.last_flush_latency = time.perf_counter() - start
+                self.max_flush_latency = max(
+                    self.max_flush_latency, self.last_flush_latency
+                )
+
+            if conflicts:
+                # someone else wrote to these matches since we last read them, so our changes are dropped instead of overwriting theirs.
+                # Updates queued while flushing were made from the same version, so they would be rejected as well
+                self.conflicts += len(conflicts)
+                for gid in conflicts:
+                    self._pending.pop(gid, None)
+                print(f"Version conflict on matches, updates dropped: {conflicts}")
+                if self.on_conflict:
+                    self.on_conflict(conflicts)
+
+            self.flushes += 1
+            self.written += len(batch) - len(conflicts)
+            return conflicts
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # already logged, the updates are retried on the next flush
+
+    async def close(self):
+        """Stops the timer and writes everything which is still pending"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._early_flush:
+            # whatever it fails to write is put back and written below
+            await asyncio.gather(self._early_flush, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending_count,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+            "conflicts": self.conflicts,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
@@ -7,9 +7,15 @@ load_dotenv()
 test_uri = os.getenv("testDBUri")
 uri = test_uri
 
-client = MongoClient(uri, uuidRepresentation="standard")
+# Max number of connections to mongo, the store runs its blocking calls on as many threads
+DB_POOL_SIZE = int(os.getenv("dbPoolSize", 16))
 
-# TODO: Add some sort of error handling
-client.admin.command("ping")
+# This doesn't connect yet, pymongo connects on the first operation
+client = MongoClient(uri, uuidRepresentation="standard", maxPoolSize=DB_POOL_SIZE)
 
 chessdb = client["chess"]
+
+
+def ping():
+    # TODO: Add some sort of error handling
+    client.admin.command("ping")
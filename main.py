@@ -8,6 +8,7 @@ from discord import Intents
 from discord.ext import commands
 
 import os
+import traceback
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,15 +18,45 @@ guild_ids = [TEST_SERVER]
 
 intents = Intents().all()
 
-client = commands.Bot(command_prefix="!", intents=intents)
+class ChessBot(commands.Bot):
+    # loads the running matches after startup, see setup_hook
+    warm_start_task = None
+
+    async def close(self):
+        if self.warm_start_task:
+            self.warm_start_task.cancel()
+        # unloading the cog writes out everything which hasn't been saved yet
+        await self.remove_cog("Chess")
+        await super().close()
+
+
+def report_warm_start(task):
+    if task.cancelled():
+        return
+    e = task.exception()
+    if e:
+        print("Failed to restore the running matches:")
+        traceback.print_exception(e)
+
+
+client = ChessBot(command_prefix="!", intents=intents)
 
 
 @client.event
 async def setup_hook():
 
     import bot.client as botmod
+    from data.store import MongoStore
+
+    store = MongoStore()
+    await store.ping()
+    await store.ensure_indexes()
 
-    await client.add_cog(botmod.Chess(client))
+    cog = botmod.Chess(client, store)
+    await client.add_cog(cog)
+    # runs in the background since it waits for the bot to be ready, which only happens after setup_hook returns
+    client.warm_start_task = client.loop.create_task(cog.warm_start())
+    client.warm_start_task.add_done_callback(report_warm_start)
  
     for g in guild_ids:
         obj = discord.Object(id=g)
@@ -38,4 +69,6 @@ async def on_ready():
     print(f"logged in as: {client.user}")
 
 
-client.run(os.getenv("token"))
+# the guard is needed since the render pool can be run on processes, which import this file again
+if __name__ == "__main__":
+    client.run(os.getenv("token"))
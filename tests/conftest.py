@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# the same imports as the bot, which is run from the root of the repo with core on the path (see main.py)
+sys.path[:0] = [ROOT, os.path.join(ROOT, "core")]
+# and the assets (images, opening book, tablebases) are loaded relative to it
+os.chdir(ROOT)
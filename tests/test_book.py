@@ -0,0 +1,79 @@
+"""
+Checks the polyglot keys against the ones published with the format, and probes the bundled book (assets/book.bin).
+"""
+
+import random
+
+import pytest
+
+from book import OpeningBook, to_polyglot_move
+from game import Game
+
+BOOK_PATH = "assets/book.bin"
+
+# The positions and keys given in the polyglot book format specification, after the moves played so far
+KEYS = [
+    ([], 0x463B96181691FC9C),
+    (["e4"], 0x823C9B50FD114196),
+    (["e4", "d5"], 0x0756B94461C50FB0),
+    (["e4", "d5", "e5"], 0x662FAFB965DB29D4),
+    (["e4", "d5", "e5", "f5"], 0x22A48B5A8E47FF78),
+    (["e4", "d5", "e5", "f5", "Ke2"], 0x652A607CA3F242C1),
+    (["e4", "d5", "e5", "f5", "Ke2", "Kf7"], 0x00FDD303C946BDD9),
+    (["a4", "b5", "h4", "b4", "c4"], 0x3C8123EA7B067637),
+    (["a4", "b5", "h4", "b4", "c4", "bxc3", "Ra3"], 0x5C3F9B829B279560),
+]
+
+# polyglot moves are to | from << 6, with a1 = 0
+E2E4 = 28 | 12 << 6
+D2D4 = 27 | 11 << 6
+E7E5 = 36 | 52 << 6
+C7C5 = 34 | 50 << 6
+
+
+def _game(sans: list[str]) -> Game:
+    g = Game()
+    for san in sans:
+        assert g.play_san(san), san
+    return g
+
+
+@pytest.fixture
+def book():
+    with OpeningBook(BOOK_PATH) as b:
+        yield b
+
+
+@pytest.mark.parametrize("sans,key", KEYS, ids=lambda v: " ".join(v) if isinstance(v, list) else hex(v))
+def test_polyglot_keys(sans, key):
+    g = _game(sans)
+    assert g.board.polyglot_key(g.turn) == key
+
+
+def test_starting_position(book):
+    entries = dict(book.entries(KEYS[0][1]))
+    assert E2E4 in entries and D2D4 in entries
+    # 1. e4 is the most played first move of the openings the book is built from
+    assert max(entries, key=entries.get) == E2E4
+
+
+def test_reply_to_e4(book):
+    g = _game(["e4"])
+    moves = book.moves(g.board, g.turn)
+    assert {to_polyglot_move(m) for m, _ in moves} >= {E7E5, C7C5}
+    assert {str(g.board.to_san_move(m, g.turn)) for m, _ in moves} >= {"e5", "c5"}
+
+
+def test_position_out_of_the_book(book):
+    g = _game(["a4", "h5", "Ra3", "Rh6"])
+    assert book.entries(g.board.polyglot_key(g.turn)) == []
+    assert book.choose(g.board, g.turn) is None
+    assert book.hits < book.probes
+
+
+def test_choose_only_picks_book_moves(book):
+    g = Game()
+    book_moves = {m for m, _ in book.moves(g.board, g.turn)}
+    rng = random.Random(1)
+    for _ in range(20):
+        assert book.choose(g.board, g.turn, rng) in book_moves
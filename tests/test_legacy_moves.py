@@ -0,0 +1,61 @@
+"""
+Checks the conversion of matches which stored their moves as strings (before the moves were packed), see data/db.py.
+"""
+
+import uuid
+
+import pytest
+
+from core.game import Game, GameState
+from core.move import unpack_moves
+from data.db import MatchData, legacy_moves_to_packed
+from piece import PieceColor
+
+# 1. e4 d5 2. exd5 c6 3. dxc6 Nf6 4. cxb7 Nbd7 5. bxa8=Q, written the way the moves used to be stored: without captures or the promoted piece
+PROMOTION_GAME = ["e2e4", "d7d5", "e4d5", "c7c6", "d5c6", "Ng8f6", "c6b7", "Nb8d7", "b7a8"]
+PROMOTION_SAN = ["e4", "d5", "exd5", "c6", "dxc6", "Nf6", "cxb7", "Nbd7", "bxa8=Q"]
+
+
+def _legacy_doc(moves_full: list[str], state=GameState.Playing) -> dict:
+    return {
+        "_id": uuid.uuid4(),
+        "white": 1,
+        "black": 2,
+        "state": state,
+        "turn": PieceColor(len(moves_full) % 2),
+        "moves_full": moves_full,
+        "moves_partial": moves_full,
+    }
+
+
+def _replay(packed: bytes) -> Game:
+    g = Game()
+    g.play_moves(unpack_moves(packed))
+    return g
+
+
+def test_promotions_without_a_piece_become_queens():
+    g = _replay(legacy_moves_to_packed(PROMOTION_GAME))
+    assert [str(m) for _, m in g.played_moves] == PROMOTION_SAN
+
+
+def test_promotions_with_a_piece_are_kept():
+    g = _replay(legacy_moves_to_packed(PROMOTION_GAME[:-1] + ["b7a8=N"]))
+    assert str(g.played_moves[-1][1]) == "bxa8=N"
+
+
+def test_a_move_which_cant_be_played_raises():
+    with pytest.raises(ValueError, match="Move 3"):
+        legacy_moves_to_packed(["e2e4", "e7e5", "e4e5"])
+
+
+def test_running_legacy_matches_are_migrated_with_every_move():
+    m = MatchData.from_dict(_legacy_doc(PROMOTION_GAME))
+    assert m.needs_migration
+    assert len(unpack_moves(m.moves)) == len(PROMOTION_GAME)
+
+
+def test_legacy_matches_which_dont_replay_arent_migrated():
+    # loading it would drop the moves stored as strings on the next write, with the moves after the broken one
+    with pytest.raises(ValueError):
+        MatchData.from_dict(_legacy_doc(PROMOTION_GAME[:4] + ["a1a8"] + PROMOTION_GAME[4:]))
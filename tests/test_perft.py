@@ -0,0 +1,29 @@
+"""
+Checks the move generator against the published perft numbers of the positions in core/perft.py.
+Only the shallow depths are run so the suite stays fast, `python core/perft.py` goes deeper.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "core"))
+
+from perft import POSITIONS, run
+
+# Depths whose node count is above this are left to the command line
+MAX_NODES = 100_000
+
+CASES = [
+    pytest.param(fen, depth, expected, id=f"{name}-{depth}")
+    for name, fen, counts in POSITIONS
+    for depth, expected in enumerate(counts, start=1)
+    if expected <= MAX_NODES
+]
+
+
+@pytest.mark.parametrize("fen,depth,expected", CASES)
+def test_perft(fen, depth, expected):
+    nodes, _took = run(fen, depth)
+    assert nodes == expected
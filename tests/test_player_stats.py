@@ -0,0 +1,113 @@
+"""
+Checks the aggregation of data/player_stats.py against the stats which are incremented as games end, on a few matches kept in a MemoryStore.
+There is no mongo server to run the pipeline on, so the stages it uses are evaluated by _aggregate below.
+"""
+
+import asyncio
+import uuid
+
+from core.game import GameState
+from data.db import MatchData, player_stats_pipeline
+from data.store import MemoryStore
+
+FIELDS = ["num_matches", "num_wins", "num_draws", "num_losses"]
+
+
+def _eval(expr, doc):
+    if isinstance(expr, str) and expr.startswith("$"):
+        for part in expr[1:].split("."):
+            doc = doc.get(part)
+        return doc
+    if isinstance(expr, list):
+        return [_eval(e, doc) for e in expr]
+    if isinstance(expr, dict):
+        if "$eq" in expr:
+            a, b = _eval(expr["$eq"], doc)
+            return a == b
+        if "$cond" in expr:
+            cond, yes, no = expr["$cond"]
+            return _eval(yes, doc) if _eval(cond, doc) else _eval(no, doc)
+        return {k: _eval(v, doc) for k, v in expr.items()}
+    return expr
+
+
+def _matches(doc, query) -> bool:
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            if value == cond["$ne"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _aggregate(pipeline, docs) -> dict:
+    """RETURNS: the documents the pipeline would merge, by id"""
+    for stage in pipeline:
+        (op, arg), = stage.items()
+        if op == "$match":
+            docs = [d for d in docs if _matches(d, arg)]
+        elif op == "$project":
+            docs = [{k: _eval(v, d) for k, v in arg.items()} for d in docs]
+        elif op == "$unwind":
+            field = arg[1:]
+            docs = [{**d, field: x} for d in docs for x in d[field]]
+        elif op == "$group":
+            groups = {}
+            for d in docs:
+                key = _eval(arg["_id"], d)
+                g = groups.setdefault(key, {"_id": key})
+                for field, acc in arg.items():
+                    if field != "_id":
+                        g[field] = g.get(field, 0) + _eval(acc["$sum"], d)
+            docs = list(groups.values())
+        elif op == "$merge":
+            return {d["_id"]: d for d in docs}
+    raise AssertionError("the pipeline doesn't end with a $merge")
+
+
+def _finish(store, white, black, state, engine=None):
+    """Stores a finished match, and records its result the way the bot does"""
+    m = MatchData(uuid.uuid4(), b"", white, black, state, 0, engine=engine)
+    asyncio.run(store.insert_match(m))
+    if engine is None:
+        asyncio.run(store.record_match_result(white, black, state))
+
+
+def test_counts_match_the_recorded_results():
+    store = MemoryStore()
+    _finish(store, 1, 2, GameState.WinWhite)
+    _finish(store, 2, 1, GameState.Draw)
+    _finish(store, 3, 1, GameState.WinBlack)
+    _finish(store, 2, 3, GameState.WinWhite)
+    asyncio.run(store.insert_match(MatchData(uuid.uuid4(), b"", 1, 3, GameState.Playing, 0)))
+
+    counted = _aggregate(player_stats_pipeline(), store.matches.values())
+    assert counted.keys() == store.players.keys()
+    for user_id, stats in counted.items():
+        assert {f: stats[f] for f in FIELDS} == {
+            f: store.players[user_id].get(f, 0) for f in FIELDS
+        }
+
+
+def test_engine_games_are_left_out():
+    store = MemoryStore()
+    _finish(store, 1, 2, GameState.WinBlack)
+    _finish(store, 1, 999, GameState.WinWhite, engine="easy")
+    _finish(store, 999, 2, GameState.Draw, engine="hard")
+
+    counted = _aggregate(player_stats_pipeline(), store.matches.values())
+    assert 999 not in counted
+    assert counted[1]["num_matches"] == counted[2]["num_matches"] == 1
+    assert counted[2]["num_wins"] == 1
+
+
+def test_matches_without_an_engine_field_are_counted():
+    store = MemoryStore()
+    _finish(store, 1, 2, GameState.Draw)
+    for d in store.matches.values():
+        del d["engine"]  # stored before there was an engine
+
+    counted = _aggregate(player_stats_pipeline(), store.matches.values())
+    assert counted[1]["num_draws"] == counted[2]["num_draws"] == 1
@@ -0,0 +1,87 @@
+"""
+Checks that recording match results gives the ratings of data/rating.py, with the writes MongoStore sends applied by the MemoryStore.
+"""
+
+import asyncio
+
+import pytest
+
+from bot.leaderboard import Leaderboard
+from core.game import GameState
+from data.db import match_result_updates
+from data.rating import DEFAULT_RATING, PROVISIONAL_GAMES, rating_changes
+from data.store import MemoryStore
+
+
+def _record(store, results):
+    async def run():
+        for white, black, state in results:
+            await store.record_match_result(white, black, state)
+
+    asyncio.run(run())
+
+
+def test_new_players_start_from_the_default_rating():
+    store = MemoryStore()
+    _record(store, [(1, 2, GameState.WinWhite)])
+    white, black = rating_changes(DEFAULT_RATING, DEFAULT_RATING, 1.0, 0, 0)
+    assert store.players[1]["rating"] == DEFAULT_RATING + white
+    assert store.players[2]["rating"] == DEFAULT_RATING + black
+    assert store.players[1]["num_wins"] == store.players[2]["num_losses"] == 1
+
+
+def test_ratings_follow_the_elo_formula():
+    results = [
+        (1, 2, GameState.WinWhite),
+        (2, 3, GameState.Draw),
+        (3, 1, GameState.WinBlack),
+        (1, 3, GameState.WinBlack),
+    ] * 16
+    store = MemoryStore()
+    _record(store, results)
+
+    ratings = {}
+    games = {}
+    for white, black, state in results:
+        score = {GameState.WinWhite: 1.0, GameState.Draw: 0.5, GameState.WinBlack: 0.0}[state]
+        w, b = rating_changes(
+            ratings.get(white, DEFAULT_RATING),
+            ratings.get(black, DEFAULT_RATING),
+            score,
+            games.get(white, 0),
+            games.get(black, 0),
+        )
+        ratings[white] = ratings.get(white, DEFAULT_RATING) + w
+        ratings[black] = ratings.get(black, DEFAULT_RATING) + b
+        games[white] = games.get(white, 0) + 1
+        games[black] = games.get(black, 0) + 1
+
+    assert max(games.values()) > PROVISIONAL_GAMES
+    for user_id, rating in ratings.items():
+        assert store.players[user_id]["rating"] == pytest.approx(rating)
+        assert store.players[user_id]["num_matches"] == games[user_id]
+
+
+def test_updates_only_add_to_existing_players():
+    updates = match_result_updates(1, 2, GameState.Draw, {"_id": 1, "rating": 1500.0, "num_matches": 40})
+    for _query, update, upsert in updates:
+        # the defaults only go into new documents, anything else only adds
+        assert set(update) <= {"$setOnInsert", "$inc"}
+        assert "$setOnInsert" not in update or upsert
+
+
+def test_ranks():
+    store = MemoryStore()
+    _record(store, [(i, i + 1, GameState.WinWhite) for i in range(1, 40, 2)])
+    board = Leaderboard(store, size=5)
+
+    async def ranks():
+        await board.refresh()
+        ratings = [d["rating"] for d in store.players.values()]
+        for rating in ratings + [0.0, 5000.0]:
+            expected = sum(r > rating for r in ratings) + 1
+            assert await board.rank_of(rating) == expected
+
+    asyncio.run(ranks())
+    # the ratings below the top players were counted once each
+    assert 0 < board.rank_counts < len(store.players)
@@ -0,0 +1,66 @@
+"""
+Checks that games restored from what is stored (see GameSession.from_match_data) are the same as the games which were saved.
+"""
+
+from types import SimpleNamespace
+
+from bot.client import CHECKPOINT_INTERVAL, GameSession
+from core.game import GameState
+
+WHITE = SimpleNamespace(id=1, name="white", mention="@white", bot=False)
+BLACK = SimpleNamespace(id=2, name="black", mention="@black", bot=False)
+
+# the knights go out and back, the position repeats every 8 plies
+SHUFFLE = ["Nf3", "Nf6", "Nc3", "Nc6", "Ng1", "Ng8", "Nb1", "Nb8"]
+
+
+def _play(sans: list[str]) -> GameSession:
+    g = GameSession(WHITE, BLACK)
+    for san in sans:
+        assert g.play_san(san), san
+    return g
+
+
+def _restore(g: GameSession) -> GameSession:
+    return GameSession.from_match_data(g.to_match_data(), WHITE, BLACK)
+
+
+def _assert_same(restored: GameSession, g: GameSession):
+    assert restored.to_FEN() == g.to_FEN()
+    assert restored.move_codes == g.move_codes
+    assert restored.san_moves() == g.san_moves()
+    assert restored.checkpoints == g.checkpoints
+    assert restored.state == g.state
+
+
+def test_restores_from_the_last_checkpoint():
+    g = _play(
+        ["e4", "e5", "Nf3", "Nc6", "Bb5", "a6", "Ba4", "Nf6", "O-O", "Be7", "Re1", "b5"]
+        + ["Bb3", "d6", "c3", "O-O", "h3", "Nb8", "d4", "Nbd7", "c4", "c6", "cxb5"]
+    )
+    assert len(g.checkpoints) == 1
+    restored = _restore(g)
+    assert restored.restored_from == CHECKPOINT_INTERVAL
+    _assert_same(restored, g)
+
+
+def test_repetitions_before_the_checkpoint_are_counted():
+    # the checkpoint is in the middle of the repetitions
+    g = _play(["e4", "e5"] + SHUFFLE * 3)
+    assert len(g.move_codes) > CHECKPOINT_INTERVAL
+    restored = _restore(g)
+    _assert_same(restored, g)
+    assert restored.repetitions() == g.repetitions() == 4
+    assert restored.position_counts == g.position_counts
+
+    # so the restored game ends by fivefold repetition on the same move
+    for san in SHUFFLE:
+        assert restored.play_san(san) and g.play_san(san)
+        assert restored.state == g.state
+    assert g.state == GameState.Draw
+
+
+def test_engine_history_after_a_restore():
+    g = _play(["d4", "d5"] + SHUFFLE * 3 + ["Nf3"])
+    restored = _restore(g)
+    assert set(restored.position_counts) == set(g.position_counts)
@@ -0,0 +1,35 @@
+"""
+Checks that the scores of searches with a game history, where going back to a position of the game is a draw, don't leak into searches without one (like the ones of /analyze).
+"""
+
+from core.engine import search_fen
+from game import Game
+
+# White is a queen up, but in the game it was played in every position two plies from here already happened
+FEN = "rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+DEPTH = 2
+
+
+def _positions_two_plies_ahead(fen: str) -> list[int]:
+    g = Game.from_FEN(fen)
+    b = g.board
+    keys = []
+    for m in b.generate_legal_moves(g.turn):
+        b.make_move(m, g.turn)
+        for reply in b.generate_legal_moves(1 - g.turn):
+            b.make_move(reply, 1 - g.turn)
+            keys.append(b.position_key(g.turn))
+            b.unmake_move()
+        b.unmake_move()
+    return keys
+
+
+def test_repetitions_count_as_draws_in_the_game():
+    res = search_fen(FEN, max_depth=DEPTH, history=_positions_two_plies_ahead(FEN))
+    assert res.score == 0
+
+
+def test_analysis_after_a_game_search_ignores_its_history():
+    search_fen(FEN, max_depth=DEPTH, history=_positions_two_plies_ahead(FEN))
+    res = search_fen(FEN, max_depth=DEPTH)
+    assert res.score > 500
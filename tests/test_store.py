@@ -0,0 +1,88 @@
+"""
+Checks the Store interface and its MemoryStore, which the bot is run with when there is no mongo server.
+"""
+
+import asyncio
+import uuid
+
+import pytest
+
+from core.game import GameState
+from data.db import MatchData, MatchDelta, PlayerData
+from data.store import MemoryStore, Store
+from piece import PieceColor
+
+
+def _match(state=GameState.Playing, white=1, black=2) -> MatchData:
+    return MatchData(uuid.uuid4(), b"", white, black, state, PieceColor.White)
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        Store()
+
+
+def test_results_are_copies():
+    async def run():
+        store = MemoryStore()
+        m = _match()
+        await store.insert_match(m)
+        got = await store.get_match(m._id)
+        got.checkpoints.append({"ply": 20, "fen": "x"})
+        assert (await store.get_match(m._id)).checkpoints == []
+
+        await store.save_player(PlayerData(1, 3, 1, 1))
+        p = await store.get_player(1)
+        p.num_wins = 10
+        assert (await store.get_player(1)).num_wins == 1
+
+    asyncio.run(run())
+
+
+def test_running_matches():
+    async def run():
+        store = MemoryStore()
+        running = [_match(white=i, black=i + 100) for i in range(5)]
+        for m in running + [_match(GameState.Draw, 1, 2)]:
+            await store.insert_match(m)
+        assert not await store.insert_match(running[0])
+
+        assert (await store.get_active_match(103))._id == running[3]._id
+        assert await store.get_active_match(7) is None
+        batches = [b async for b in store.iter_running_matches(2)]
+        assert [len(b) for b in batches] == [2, 2, 1]
+        assert {m._id for b in batches for m in b} == {m._id for m in running}
+
+    asyncio.run(run())
+
+
+def test_deltas_append_moves_and_bump_the_version():
+    async def run():
+        store = MemoryStore()
+        m = _match()
+        await store.insert_match(m)
+        deltas = [
+            MatchDelta(m._id, 0, b"\x01\x02", turn=PieceColor.Black),
+            MatchDelta(m._id, 1, b"\x03\x04", turn=PieceColor.White),
+        ]
+        for d in deltas:
+            assert await store.apply_match_deltas([d]) == []
+        stored = await store.get_match(m._id)
+        assert stored.moves == b"\x01\x02\x03\x04"
+        assert stored.version == 2
+        assert store.matches[m._id]["moves"] == [b"\x01\x02", b"\x03\x04"]
+
+    asyncio.run(run())
+
+
+def test_stale_deltas_are_rejected():
+    async def run():
+        store = MemoryStore()
+        m = _match()
+        await store.insert_match(m)
+        assert await store.apply_match_deltas([MatchDelta(m._id, 0, b"\x01\x02")]) == []
+        # made from the version before the one above
+        assert await store.apply_match_deltas([MatchDelta(m._id, 0, b"\x05\x06")]) == [m._id]
+        assert (await store.get_match(m._id)).moves == b"\x01\x02"
+
+    asyncio.run(run())
@@ -0,0 +1,166 @@
+"""
+Checks the shipped endgame tables (see core/tablebase.py) on random positions: every result has to follow from the results of the positions after each move,
+and positions which are the same but mirrored or rotated have to get the same result.
+"""
+
+import os
+import random
+
+import pytest
+
+import tablebase
+from board import Board
+from game import Game
+from piece import Piece, PieceColor, PieceType
+
+POSITIONS_PER_TABLE = 1000
+
+# the material of each table, and the same with the colors swapped which is looked up in the same table
+MATERIAL = {
+    "KQvK": [PieceType.Queen],
+    "KRvK": [PieceType.Rook],
+    "KPvK": [PieceType.Pawn],
+}
+
+
+def _random_position(rng, white: list, black: list):
+    """RETURNS: a random board with the pieces where the side not to move isn't in check, and the side to move"""
+    pieces = (
+        [(PieceColor.White, PieceType.King), (PieceColor.Black, PieceType.King)]
+        + [(PieceColor.White, t) for t in white]
+        + [(PieceColor.Black, t) for t in black]
+    )
+    while True:
+        squares = rng.sample(range(64), len(pieces))
+        if any(
+            t == PieceType.Pawn and not 8 <= sq < 56
+            for (_, t), sq in zip(pieces, squares)
+        ):
+            continue
+        b = _board({sq: p for sq, p in zip(squares, pieces)})
+        turn = rng.choice(list(PieceColor))
+        if not b.is_check(PieceColor(1 - turn)):
+            return b, turn
+
+
+def _board(pieces: dict) -> Board:
+    """A board with only the given {square: (color, type)} pieces, which can't castle"""
+    b = Board()
+    b.config = [None] * 64
+    for sq, (c, t) in pieces.items():
+        b.config[sq] = Piece(t, c)
+    b.can_castle = {c: {side: False for side in rights} for c, rights in b.can_castle.items()}
+    b.zobrist = b.compute_zobrist()
+    return b
+
+
+def _pieces(b: Board) -> dict:
+    return {sq: (p.color, p.type) for sq, p in enumerate(b.config) if p is not None}
+
+
+CASES = [
+    case
+    for name, extra in MATERIAL.items()
+    for case in (
+        pytest.param(name, extra, [], id=name),
+        pytest.param(name, [], extra, id=name + "-swapped"),
+    )
+]
+
+
+@pytest.fixture(autouse=True)
+def _tables():
+    missing = [
+        name
+        for name in MATERIAL
+        if not os.path.exists(os.path.join(tablebase.TABLEBASE_DIR, name + ".bin"))
+    ]
+    if missing:
+        pytest.skip(f"the tables {missing} aren't generated")
+
+
+@pytest.mark.parametrize("name,white,black", CASES)
+def test_results_follow_from_the_moves(name, white, black):
+    rng = random.Random(name + str(len(white)))
+    for _ in range(POSITIONS_PER_TABLE):
+        b, turn = _random_position(rng, white, black)
+        moves = b.generate_legal_moves(turn)
+        children = []
+        for m in moves:
+            b.make_move(m, turn)
+            children.append(b.probe_tablebase(PieceColor(1 - turn)))
+            b.unmake_move()
+
+        if not moves:
+            expected = (-1, 0) if b.is_check(turn) else (0, 0)
+        else:
+            # wins as fast as it can, or loses as slowly as it can
+            wins = [plies + 1 for wdl, plies in children if wdl == -1]
+            if wins:
+                expected = (1, min(wins))
+            elif all(wdl == 1 for wdl, _ in children):
+                expected = (-1, max(plies + 1 for _, plies in children))
+            else:
+                expected = (0, 0)
+        assert b.probe_tablebase(turn) == expected, b.to_FEN(turn)
+
+
+def _symmetries(pawns: bool) -> list:
+    if pawns:
+        # only left to right, the pawns can't go the other way
+        return [lambda sq: sq ^ 7]
+    flips = [lambda sq: sq ^ 7, lambda sq: sq ^ 56, lambda sq: (sq & 7) << 3 | sq >> 3]
+    res = []
+    for n in range(1, 8):
+        chosen = [f for i, f in enumerate(flips) if n >> i & 1]
+
+        def transform(sq, chosen=chosen):
+            for f in chosen:
+                sq = f(sq)
+            return sq
+
+        res.append(transform)
+    return res
+
+
+@pytest.mark.parametrize("name,white,black", CASES)
+def test_mirrored_positions_have_the_same_result(name, white, black):
+    rng = random.Random(name)
+    symmetries = _symmetries(PieceType.Pawn in MATERIAL[name])
+    for _ in range(POSITIONS_PER_TABLE // 3):
+        b, turn = _random_position(rng, white, black)
+        res = b.probe_tablebase(turn)
+        for transform in symmetries:
+            mirrored = _board({transform(sq): p for sq, p in _pieces(b).items()})
+            assert mirrored.probe_tablebase(turn) == res, b.to_FEN(turn)
+
+
+def test_pawns_are_mirrored_across_the_files():
+    # a rook's pawn doesn't win when the other king gets to the corner in front of it, on either side, while a knight's pawn does
+    draw_a, draw_h, win_b = (
+        Game.from_FEN(fen)
+        for fen in (
+            "k7/8/8/P1K5/8/8/8/8 w - - 0 1",
+            "7k/8/8/5K1P/8/8/8/8 w - - 0 1",
+            "k7/8/8/1PK5/8/8/8/8 w - - 0 1",
+        )
+    )
+    assert draw_a.board.probe_tablebase(draw_a.turn) == (0, 0)
+    assert draw_h.board.probe_tablebase(draw_h.turn) == (0, 0)
+    assert win_b.board.probe_tablebase(win_b.turn)[0] == 1
+
+
+@pytest.mark.parametrize("name", list(MATERIAL))
+def test_layout(name):
+    layout = tablebase._layout(name)
+    assert os.path.getsize(os.path.join(tablebase.TABLEBASE_DIR, name + ".bin")) == layout.size
+    rng = random.Random(name)
+    for _ in range(200):
+        idx = rng.randrange(layout.size)
+        turn, squares = layout.position(idx)
+        canonical = layout.canonical(squares)
+        if canonical == squares:
+            assert layout.index(turn, squares) == idx
+        # every mirror of a position has the index of the stored one
+        for s in layout.symmetries:
+            assert layout.index(turn, [s[sq] for sq in squares]) == layout.index(turn, canonical)
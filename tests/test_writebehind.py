@@ -0,0 +1,140 @@
+"""
+Checks the batching of match updates by MatchWriteBehind, on a MemoryStore.
+"""
+
+import asyncio
+import gc
+import uuid
+
+import pytest
+
+from core.game import GameState
+from data.db import MatchData, MatchDelta
+from data.store import MemoryStore
+from data.writebehind import MatchWriteBehind
+from piece import PieceColor
+
+
+class FailingStore(MemoryStore):
+    """Fails the next `failures` bulk writes"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.writes = 0
+
+    async def apply_match_deltas(self, deltas: list) -> list:
+        self.writes += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo went away")
+        return await super().apply_match_deltas(deltas)
+
+
+async def _matches(store, n: int) -> list:
+    gids = []
+    for i in range(n):
+        m = MatchData(uuid.uuid4(), b"", i, i + 100, GameState.Playing, PieceColor.White)
+        await store.insert_match(m)
+        gids.append(m._id)
+    return gids
+
+
+def test_merge_appends_and_keeps_the_first_version():
+    gid = uuid.uuid4()
+    a = MatchDelta(gid, 3, b"\x01\x02", turn=PieceColor.Black, checkpoints=[{"ply": 20}])
+    b = MatchDelta(gid, 4, b"\x03\x04", GameState.Draw, PieceColor.White)
+    m = a.merge(b)
+    assert (m.version, m.count) == (3, 2)
+    assert m.new_moves == b"\x01\x02\x03\x04" and m.moves is None
+    assert (m.state, m.turn) == (GameState.Draw, PieceColor.White)
+    assert m.checkpoints == [{"ply": 20}]
+
+
+def test_merge_after_a_rewrite_keeps_rewriting():
+    gid = uuid.uuid4()
+    rewrite = MatchDelta(gid, 0, moves=b"\x01\x02", drop_legacy_moves=True)
+    m = rewrite.merge(MatchDelta(gid, 1, b"\x03\x04"))
+    assert m.moves == b"\x01\x02\x03\x04" and m.new_moves == b""
+    assert m.drop_legacy_moves
+
+
+def test_updates_of_a_game_are_coalesced():
+    async def run():
+        store = MemoryStore()
+        (gid,) = await _matches(store, 1)
+        writer = MatchWriteBehind(store, max_pending=10)
+        for v in range(3):
+            writer.submit(MatchDelta(gid, v, bytes([v, v])))
+        assert writer.pending_count == 1
+        assert await writer.flush() == []
+        stored = await store.get_match(gid)
+        assert stored.moves == b"\x00\x00\x01\x01\x02\x02"
+        assert stored.version == 3
+        assert writer.stats()["written"] == 1
+
+    asyncio.run(run())
+
+
+def test_conflicts_drop_the_updates_of_the_game():
+    async def run():
+        store = MemoryStore()
+        gid, other = await _matches(store, 2)
+        # someone else wrote to the match since it was read
+        store.matches[gid]["version"] = 5
+        reported = []
+        writer = MatchWriteBehind(store, max_pending=10, on_conflict=reported.append)
+        writer.submit(MatchDelta(gid, 0, b"\x01\x02"))
+        writer.submit(MatchDelta(other, 0, b"\x01\x02"))
+        assert await writer.flush() == [gid]
+        assert reported == [[gid]]
+        assert writer.pending_count == 0
+        assert (await store.get_match(gid)).moves == b""
+        assert (await store.get_match(other)).moves == b"\x01\x02"
+        assert writer.stats()["conflicts"] == 1
+
+    asyncio.run(run())
+
+
+def test_failed_writes_are_retried():
+    async def run():
+        store = FailingStore(1)
+        (gid,) = await _matches(store, 1)
+        writer = MatchWriteBehind(store, max_pending=10)
+        writer.submit(MatchDelta(gid, 0, b"\x01\x02"))
+        with pytest.raises(ConnectionError):
+            await writer.flush()
+        # made while the failed write was out, it goes after the one which failed
+        writer.submit(MatchDelta(gid, 1, b"\x03\x04"))
+        assert await writer.flush() == []
+        assert (await store.get_match(gid)).moves == b"\x01\x02\x03\x04"
+        assert writer.stats()["failures"] == 1
+
+    asyncio.run(run())
+
+
+def test_failed_early_flushes_are_retried_without_warnings():
+    unhandled = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda _, ctx: unhandled.append(ctx))
+        store = FailingStore(1)
+        gids = await _matches(store, 2)
+        writer = MatchWriteBehind(store, max_pending=2)
+        for gid in gids:
+            writer.submit(MatchDelta(gid, 0, b"\x01\x02"))
+        assert writer._early_flush is not None
+        while writer._early_flush is not None:
+            await asyncio.sleep(0)
+        # nothing else holds the failed task, so it warns now if its exception wasn't retrieved
+        gc.collect()
+        assert unhandled == []
+        assert writer.pending_count == 2
+
+        await writer.close()
+        assert store.writes == 2
+        for gid in gids:
+            assert (await store.get_match(gid)).moves == b"\x01\x02"
+
+    asyncio.run(run())
+    assert unhandled == []